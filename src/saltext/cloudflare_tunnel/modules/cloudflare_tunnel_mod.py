@@ -31,11 +31,79 @@ api_token:
 account:
     CloudFlare Account ID, this can be found on the bottom right of the Overview page for your
     domain
+
+The following settings are optional:
+
+base_url:
+    Cloudflare API base URL, defaults to the URL the CloudFlare python module uses
+
+request_timeout:
+    Timeout in seconds for each request to the Cloudflare API
+
+dns_batch_size:
+    Maximum number of record changes sent in one request by ``apply_dns_batch``, defaults to 200
+
+rate_limit:
+    Requests allowed per ``rate_limit_period`` for each API token, defaults to 1200. Calls over
+    the limit wait for their turn instead of failing. Set to ``0`` to turn the limiter off
+
+rate_limit_period:
+    Length in seconds of the rate limit window, defaults to 300
+
+rate_limit_burst:
+    Requests that can be sent at once before calls are paced, defaults to 100
+
+rate_limit_file:
+    Path of a file holding the rate limiter state, so that every process on the minion
+    configured with the same file shares one limit
+
+retry_attempts:
+    Times a request is sent before a throttling, server or connection error is returned,
+    defaults to 5
+
+retry_base_delay:
+    Seconds the first retry waits at most, the cap doubles for each retry, defaults to 0.5
+
+retry_max_delay:
+    Upper bound in seconds of the wait between two attempts, defaults to 30
+
+retry_deadline:
+    Seconds after the first attempt past which a request is not retried, defaults to 120
+
+zone_index_ttl:
+    Seconds the index of the account's zones is kept before it is listed again, defaults to 3600
+
+disk_cache:
+    Keep the tunnels, zones and DNS records read from the API in a msgpack file under the minion
+    cachedir, so that later ``salt-call`` runs reuse them, defaults to ``False``. Entries are
+    dropped when this module changes them
+
+disk_cache_ttl:
+    Seconds each kind of entry stays in the disk cache, defaults to
+    ``{"tunnels": 3600, "zones": 86400, "dns": 300}``
+
+cassette:
+    Path of a JSON lines file the requests to the Cloudflare API are recorded to or replayed
+    from, tokens and tunnel secrets are redacted. Meant for tests and benchmarks
+
+cassette_mode:
+    ``record`` to send the requests and append them to the cassette, or ``replay`` to answer
+    them from the cassette without reaching the API, defaults to ``replay``
+
+cassette_latency:
+    ``recorded`` to wait the recorded time of each replayed request, or ``zero`` to answer at
+    once, defaults to ``recorded``
+
+Clients are pooled per API token and client settings, so the HTTP connections they open are
+reused by later calls in the same process.
 """
 import logging
+import os
+import time
 
 import salt.exceptions
 import salt.utils
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_cache as cf_tunnel_cache
 import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod as cf_tunnel_utils
 
 try:
@@ -49,6 +117,10 @@ log = logging.getLogger(__name__)
 
 __virtualname__ = "cloudflare_tunnel"
 
+# Lookups memoized in __context__ are dropped after this many seconds, in case the context
+# outlives the run (minions running jobs in threads keep their loader context)
+CONTEXT_CACHE_TTL = 300
+
 
 def __virtual__():
     # Check to make sure the python wrapper for CloudFlare and the CloudFlare CLI are installed
@@ -107,17 +179,101 @@ def _simple_config(tunnel_config):
     """
     Simplify the results returned from the API
     """
-    return {"tunnel_id": tunnel_config["tunnel_id"], "config": tunnel_config["config"]}
+    return {
+        "tunnel_id": tunnel_config["tunnel_id"],
+        "config": tunnel_config["config"],
+        "version": tunnel_config.get("version"),
+    }
+
+
+def _context_cache(section):
+    """
+    Returns a dictionary in ``__context__`` memoizing lookups for the length of the run
+
+    section
+        Kind of lookup memoized: ``zones``, ``tunnels``, ``tunnel_listing``, ``configs`` or ``dns``
+    """
+    cache = __context__.get("cloudflare_tunnel.cache")
+    if not cache or time.monotonic() - cache["created"] > CONTEXT_CACHE_TTL:
+        cache = {"created": time.monotonic()}
+        __context__["cloudflare_tunnel.cache"] = cache
+
+    return cache.setdefault(section, {})
+
+
+def _invalidate_context_cache():
+    """
+    Forget the memoized tunnels and tunnel configs after a change was written
+
+    Zones are kept, this module never changes them.
+    """
+    cache = __context__.get("cloudflare_tunnel.cache", {})
+    cache.pop("tunnels", None)
+    cache.pop("tunnel_listing", None)
+    cache.pop("configs", None)
+
+
+def _invalidate_cache(zone_id=None):
+    """
+    Forget what a change written to Cloudflare made out of date
+
+    zone_id
+        Zone whose DNS records were changed, if any
+    """
+    _invalidate_context_cache()
+    if zone_id:
+        _context_cache("dns").pop(zone_id, None)
+
+    disk_cache = _disk_cache()
+    if disk_cache:
+        if zone_id:
+            disk_cache.invalidate("dns", zone_id)
+        else:
+            disk_cache.invalidate("tunnels")
+
+
+def _get_profile():
+    """
+    Returns the ``cloudflare`` configuration profile, resolved once per run
+    """
+    if "cloudflare_tunnel.profile" not in __context__:
+        __context__["cloudflare_tunnel.profile"] = __salt__["config.get"]("cloudflare")
+
+    return __context__["cloudflare_tunnel.profile"]
+
+
+def _inventory_cache():
+    """
+    Returns the persistent inventory cache kept under the minion cachedir
+    """
+    if "cloudflare_tunnel.disk_cache" not in __context__:
+        __context__["cloudflare_tunnel.disk_cache"] = cf_tunnel_cache.InventoryCache(
+            os.path.join(__opts__["cachedir"], "cloudflare_tunnel"),
+            ttls=_get_profile().get("disk_cache_ttl"),
+        )
+
+    return __context__["cloudflare_tunnel.disk_cache"]
+
+
+def _disk_cache():
+    """
+    Returns the persistent inventory cache, or ``None`` unless ``disk_cache`` is enabled
+    """
+    if not _get_profile().get("disk_cache"):
+        return None
+
+    return _inventory_cache()
 
 
 def _get_tunnel_token(tunnel_id):
     """
     Generates a tunnel token to be used when installing the cloudflared connector
     """
-    api_token = __salt__["config.get"]("cloudflare").get("api_token")
-    account = __salt__["config.get"]("cloudflare").get("account")
+    profile = _get_profile()
+    api_token = profile.get("api_token")
+    account = profile.get("account")
 
-    return cf_tunnel_utils.get_tunnel_token(api_token, account, tunnel_id)
+    return cf_tunnel_utils.get_tunnel_token(api_token, account, tunnel_id, profile=profile)
 
 
 def _get_zone_id(domain_name):
@@ -127,26 +283,34 @@ def _get_zone_id(domain_name):
     Zone ID is used in the majority of cloudflare api calls. It is the unique ID
     for each domain that is hosted
 
+    The zone is the one with the longest name that is a suffix of the domain name, looked up in
+    an index of every zone in the account.
+
     domain_name
         Domain name of the zone_id you want to get
     """
-    api_token = __salt__["config.get"]("cloudflare").get("api_token")
+    zones = _context_cache("zones")
+    if domain_name in zones:
+        return zones[domain_name]
 
-    zone_details = None
-    # Split the dns name to pull out just the domain name to grab the zone id
-    domain_split = domain_name.split(".")
-    domain_length = len(domain_split)
-    domain = f"{domain_split[domain_length - 2]}.{domain_split[domain_length - 1]}"
+    profile = _get_profile()
+    api_token = profile.get("api_token")
+    account = profile.get("account")
 
-    zone_details = cf_tunnel_utils.get_zone_id(api_token, domain)
+    disk_cache = _disk_cache()
+    if disk_cache:
+        zone = disk_cache.get("zones", f"{account}:{domain_name}")
+        if zone:
+            zones[domain_name] = zone
+            return zone
 
-    if zone_details:
-        ret_zone_details = {}
-        ret_zone_details = _simple_zone(zone_details[0])
-    else:
-        return False
+    zone_details = cf_tunnel_utils.find_zone(api_token, domain_name, account, profile=profile)
 
-    return ret_zone_details
+    zones[domain_name] = _simple_zone(zone_details) if zone_details else False
+    if disk_cache and zone_details:
+        disk_cache.set("zones", f"{account}:{domain_name}", zones[domain_name])
+
+    return zones[domain_name]
 
 
 def get_tunnel(tunnel_name):
@@ -165,15 +329,69 @@ def get_tunnel(tunnel_name):
     Returns a dictionary containing the tunnel details if successful or ``False`` if tunnel doesn't
     exist
     """
-    account = __salt__["config.get"]("cloudflare").get("account")
-    api_token = __salt__["config.get"]("cloudflare").get("api_token")
-
-    tunnel = cf_tunnel_utils.get_tunnel(api_token, account, tunnel_name)
+    tunnels = _context_cache("tunnels")
+    if tunnel_name in tunnels:
+        return tunnels[tunnel_name]
 
-    if not tunnel:
+    # Every tunnel of the account was listed during this run, the tunnel does not exist
+    if _context_cache("tunnel_listing"):
         return False
 
-    return _simple_tunnel(tunnel[0])
+    profile = _get_profile()
+    account = profile.get("account")
+    api_token = profile.get("api_token")
+
+    # Only tunnels that exist are kept on disk, a missing one is looked up again every run
+    disk_cache = _disk_cache()
+    if disk_cache:
+        tunnel = disk_cache.get("tunnels", f"{account}:{tunnel_name}")
+        if tunnel:
+            tunnels[tunnel_name] = tunnel
+            return tunnel
+
+    tunnel = cf_tunnel_utils.get_tunnel(api_token, account, tunnel_name, profile=profile)
+
+    tunnels[tunnel_name] = _simple_tunnel(tunnel[0]) if tunnel else False
+    if disk_cache and tunnel:
+        disk_cache.set("tunnels", f"{account}:{tunnel_name}", tunnels[tunnel_name])
+
+    return tunnels[tunnel_name]
+
+
+def list_tunnels():
+    """
+    List the tunnels of the account
+
+    The tunnels are memoized for the rest of the run, so looking any of them up by name with
+    ``get_tunnel`` afterwards does not send another request.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cloudflare_tunnel.list_tunnels
+
+    Returns a list of dictionaries containing the tunnel details
+    """
+    listing = _context_cache("tunnel_listing")
+    if "tunnels" in listing:
+        return list(listing["tunnels"])
+
+    profile = _get_profile()
+    account = profile.get("account")
+    api_token = profile.get("api_token")
+
+    tunnels = [
+        _simple_tunnel(tunnel)
+        for tunnel in cf_tunnel_utils.list_tunnels(api_token, account, profile=profile)
+    ]
+
+    memo = _context_cache("tunnels")
+    for tunnel in tunnels:
+        memo[tunnel["name"]] = tunnel
+    listing["tunnels"] = tunnels
+
+    return list(tunnels)
 
 
 def create_tunnel(tunnel_name):
@@ -192,17 +410,26 @@ def create_tunnel(tunnel_name):
     Returns a dictionary containing the tunnel details if successful or ``False`` if it already
     exists
     """
-    account = __salt__["config.get"]("cloudflare").get("account")
-    api_token = __salt__["config.get"]("cloudflare").get("api_token")
+    profile = _get_profile()
+    account = profile.get("account")
+    api_token = profile.get("api_token")
 
     tunnel = get_tunnel(tunnel_name)
 
     if tunnel:
         return (False, f"Tunnel {tunnel_name} already exists")
     else:
-        tunnel = cf_tunnel_utils.create_tunnel(api_token, account, tunnel_name)
+        tunnel = _simple_tunnel(
+            cf_tunnel_utils.create_tunnel(api_token, account, tunnel_name, profile=profile)
+        )
+
+        # The other lookups are still valid, the new tunnel is added to them
+        _context_cache("tunnels")[tunnel_name] = tunnel
+        listing = _context_cache("tunnel_listing")
+        if "tunnels" in listing:
+            listing["tunnels"].append(tunnel)
 
-    return _simple_tunnel(tunnel)
+    return tunnel
 
 
 def remove_tunnel(tunnel_id):
@@ -220,10 +447,13 @@ def remove_tunnel(tunnel_id):
 
     Returns ``True`` if tunnel removed
     """
-    api_token = __salt__["config.get"]("cloudflare").get("api_token")
-    account = __salt__["config.get"]("cloudflare").get("account")
+    profile = _get_profile()
+    api_token = profile.get("api_token")
+    account = profile.get("account")
+
+    tunnel = cf_tunnel_utils.remove_tunnel(api_token, account, tunnel_id, profile=profile)
+    _invalidate_cache()
 
-    tunnel = cf_tunnel_utils.remove_tunnel(api_token, account, tunnel_id)
     if tunnel:
         return True
     else:
@@ -245,11 +475,12 @@ def get_dns(dns_name):
 
     Returns a dictionary containing the dns details or ``False`` if it does not exist
     """
-    api_token = __salt__["config.get"]("cloudflare").get("api_token")
+    profile = _get_profile()
+    api_token = profile.get("api_token")
     zone = _get_zone_id(dns_name)
 
     if zone:
-        dns = cf_tunnel_utils.get_dns(api_token, zone["id"], dns_name)
+        dns = cf_tunnel_utils.get_dns(api_token, zone["id"], dns_name, profile=profile)
 
         if dns:
             dns_details = {}
@@ -262,6 +493,76 @@ def get_dns(dns_name):
     return _simple_dns(dns_details)
 
 
+def get_zones(hostnames):
+    """
+    Get the zone of several hostnames, listing the zones of the account at most once
+
+    hostnames
+        List of DNS record names
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cloudflare_tunnel.get_zones '["sample.example.com", "other.example.org"]'
+
+    Returns a dictionary of the zone details keyed by hostname
+    """
+    zones = {}
+    for hostname in hostnames:
+        zone = _get_zone_id(hostname)
+        if not zone:
+            raise salt.exceptions.ArgumentValueError(f"Zone not found for dns {hostname}")
+
+        zones[hostname] = zone
+
+    return zones
+
+
+def get_dns_snapshot(hostnames):
+    """
+    Get the A, AAAA and CNAME records for several hostnames, reading each zone once
+
+    hostnames
+        List of DNS record names
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cloudflare_tunnel.get_dns_snapshot '["sample.example.com", "other.example.com"]'
+
+    Returns a dictionary of the dns details keyed by hostname, hostnames without any of these
+    records are left out
+    """
+    profile = _get_profile()
+    api_token = profile.get("api_token")
+
+    zone_hostnames = {}
+    for hostname, zone in get_zones(hostnames).items():
+        zone_hostnames.setdefault(zone["id"], []).append(hostname)
+
+    disk_cache = _disk_cache()
+    snapshots = _context_cache("dns")
+    dns_records = {}
+    for zone_id, names in zone_hostnames.items():
+        snapshot = snapshots.get(zone_id)
+        if snapshot is None and disk_cache:
+            snapshot = disk_cache.get("dns", zone_id)
+        if snapshot is None:
+            snapshot = cf_tunnel_utils.get_dns_snapshot(api_token, zone_id, profile=profile)
+            if disk_cache:
+                disk_cache.set("dns", zone_id, snapshot)
+        snapshots[zone_id] = snapshot
+
+        for hostname in names:
+            dns = snapshot.get(hostname.lower())
+            if dns:
+                dns_records[hostname] = _simple_dns(dns)
+
+    return dns_records
+
+
 def create_dns(hostname, tunnel_id):
     """
     Create cname record for the tunnel
@@ -280,30 +581,27 @@ def create_dns(hostname, tunnel_id):
 
     Returns a dictionary containing the dns details
     """
-    api_token = __salt__["config.get"]("cloudflare").get("api_token")
+    profile = _get_profile()
+    api_token = profile.get("api_token")
     zone = _get_zone_id(hostname)
 
     if zone:
-        # Split the dns name to pull out just the domain name to grab the zone id
-        domain_split = hostname.split(".")
-
-        dns = get_dns(hostname)
+        # The zone is already resolved, look the record up in it directly
+        dns = cf_tunnel_utils.get_dns(api_token, zone["id"], hostname, profile=profile)
+        dns = dns[0] if dns else None
 
-        dns_data = {
-            "name": domain_split[0],
-            "type": "CNAME",
-            "content": f"{tunnel_id}.cfargotunnel.com",
-            "ttl": 1,
-            "proxied": True,
-            "comment": "DNS managed by SaltStack",
-        }
+        dns_data = cf_tunnel_utils.tunnel_dns_record(hostname, tunnel_id)
 
         if dns:
             # If DNS exist, check to see if it is pointing to the correct tunnel
             if dns["content"] != f"{tunnel_id}.cfargotunnel.com":
-                dns = cf_tunnel_utils.create_dns(api_token, zone["id"], dns_data, dns["id"])
+                dns = cf_tunnel_utils.create_dns(
+                    api_token, zone["id"], dns_data, dns["id"], profile=profile
+                )
+                _invalidate_cache(zone["id"])
         else:
-            dns = cf_tunnel_utils.create_dns(api_token, zone["id"], dns_data)
+            dns = cf_tunnel_utils.create_dns(api_token, zone["id"], dns_data, profile=profile)
+            _invalidate_cache(zone["id"])
     else:
         raise salt.exceptions.ArgumentValueError(
             f"Cloudflare zone not found for hostname {hostname}"
@@ -327,19 +625,167 @@ def remove_dns(hostname):
 
     Returns ``True`` if successful
     """
-    api_token = __salt__["config.get"]("cloudflare").get("api_token")
     dns = get_dns(hostname)
 
     if dns:
-        ret_dns = cf_tunnel_utils.remove_dns(api_token, dns["zone_id"], dns["id"])
-        if ret_dns:
-            return True
-        else:
-            raise salt.exceptions.CommandExecutionError("Issue removing DNS entry")
+        return remove_dns_by_id(dns["zone_id"], dns["id"])
     else:
         raise salt.exceptions.ArgumentValueError(f"Could not find DNS entry for {hostname}")
 
 
+def remove_dns_by_id(zone_id, dns_id):
+    """
+    Delete a cloudflare dns entry already looked up, without resolving its zone again
+
+    zone_id
+        Cloudflare Zone ID of the record
+
+    dns_id
+        ID of the DNS entry to remove
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cloudflare_tunnel.remove_dns_by_id <zone id> <dns record id>
+
+    Returns ``True`` if successful
+    """
+    profile = _get_profile()
+    api_token = profile.get("api_token")
+
+    ret_dns = cf_tunnel_utils.remove_dns(api_token, zone_id, dns_id, profile=profile)
+    _invalidate_cache(zone_id)
+
+    if ret_dns:
+        return True
+    else:
+        raise salt.exceptions.CommandExecutionError("Issue removing DNS entry")
+
+
+def update_dns_by_id(zone_id, dns_id, hostname, tunnel_id):
+    """
+    Point a cloudflare dns entry already looked up to the tunnel, without resolving its zone
+    or looking the record up again
+
+    zone_id
+        Cloudflare Zone ID of the record
+
+    dns_id
+        ID of the DNS entry to overwrite
+
+    hostname
+        DNS record name
+
+    tunnel_id
+        tunnel uuid
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cloudflare_tunnel.update_dns_by_id <zone id> <dns record id> \
+test.example.com tunnel_id
+
+    Returns a dictionary containing the dns details
+    """
+    profile = _get_profile()
+    api_token = profile.get("api_token")
+
+    dns_data = cf_tunnel_utils.tunnel_dns_record(hostname, tunnel_id)
+    dns = cf_tunnel_utils.create_dns(api_token, zone_id, dns_data, dns_id, profile=profile)
+    _invalidate_cache(zone_id)
+
+    return _simple_dns(dns)
+
+
+def apply_dns_batch(zone_id, creates=None, updates=None, deletes=None):
+    """
+    Create, update and delete DNS records of a zone through the batch endpoint
+
+    The changes are sent in chunks of ``dns_batch_size`` records, deletes first, then updates,
+    then creates. Cloudflare applies each chunk as a whole, so if a chunk fails every record in
+    it is reported as failed and the remaining chunks are still sent.
+
+    zone_id
+        Cloudflare Zone ID
+
+    creates
+        List of records to create, see `create dns record <https://developers.cloudflare.com/api/
+        operations/dns-records-for-a-zone-create-dns-record>`_
+
+    updates
+        List of complete records to overwrite, each one including its ``id``
+
+    deletes
+        List of record ids to remove, or of records with their ``id`` and ``name``
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cloudflare_tunnel.apply_dns_batch <zone id> deletes='["<dns record id>"]' \
+creates='[{"name": "test.example.com", "type": "CNAME", "content": "<target>", "proxied": true}]'
+
+    Returns a list with one dictionary per record holding its ``name``, ``id``, the ``action``
+    taken (``deleted``, ``updated`` or ``created``) and the ``result``, with a ``comment`` holding
+    the error when the result is ``False``
+    """
+    profile = _get_profile()
+    api_token = profile.get("api_token")
+    batch_size = profile.get("dns_batch_size", cf_tunnel_utils.DNS_BATCH_SIZE)
+
+    changes = [
+        ("deletes", "deleted", {"id": record} if isinstance(record, str) else record)
+        for record in deletes or []
+    ]
+    changes.extend(("puts", "updated", record) for record in updates or [])
+    changes.extend(("posts", "created", record) for record in creates or [])
+
+    _invalidate_cache(zone_id)
+
+    results = []
+    for start in range(0, len(changes), batch_size):
+        chunk = changes[start : start + batch_size]
+        batch = {"deletes": [], "puts": [], "posts": []}
+        for operation, _, record in chunk:
+            if operation == "deletes":
+                batch[operation].append({"id": record["id"]})
+            else:
+                batch[operation].append(record)
+
+        try:
+            response = cf_tunnel_utils.batch_dns(api_token, zone_id, profile=profile, **batch)
+        except salt.exceptions.CommandExecutionError as exc:
+            log.error("DNS batch for zone %s failed: %s", zone_id, exc)
+            results.extend(
+                {
+                    "name": record.get("name"),
+                    "id": record.get("id"),
+                    "action": action,
+                    "result": False,
+                    "comment": str(exc),
+                }
+                for _, action, record in chunk
+            )
+            continue
+
+        # The response lists the records of each operation in the order they were sent
+        applied = {operation: iter(response.get(operation) or []) for operation in batch}
+        for operation, action, record in chunk:
+            dns = next(applied[operation], None) or {}
+            results.append(
+                {
+                    "name": dns.get("name", record.get("name")),
+                    "id": dns.get("id", record.get("id")),
+                    "action": action,
+                    "result": True,
+                }
+            )
+
+    return results
+
+
 def get_tunnel_config(tunnel_id):
     """
     Get a cloudflare tunnel configuration
@@ -356,14 +802,21 @@ def get_tunnel_config(tunnel_id):
     Returns a dictionary containing the tunnel configuration details or ``False`` if it does not
     exist
     """
-    api_token = __salt__["config.get"]("cloudflare").get("api_token")
-    account = __salt__["config.get"]("cloudflare").get("account")
+    configs = _context_cache("configs")
+    if tunnel_id in configs:
+        return configs[tunnel_id]
 
-    tunnel_config = cf_tunnel_utils.get_tunnel_config(api_token, account, tunnel_id)
-    if tunnel_config["config"] is None:
-        return False
+    profile = _get_profile()
+    api_token = profile.get("api_token")
+    account = profile.get("account")
 
-    return _simple_config(tunnel_config)
+    tunnel_config = cf_tunnel_utils.get_tunnel_config(
+        api_token, account, tunnel_id, profile=profile
+    )
+
+    configs[tunnel_id] = False if tunnel_config["config"] is None else _simple_config(tunnel_config)
+
+    return configs[tunnel_id]
 
 
 def create_tunnel_config(tunnel_id, config):
@@ -390,15 +843,17 @@ def create_tunnel_config(tunnel_id, config):
 
     Returns a dictionary containing the tunnel configuration details
     """
-    api_token = __salt__["config.get"]("cloudflare").get("api_token")
-    account = __salt__["config.get"]("cloudflare").get("account")
+    profile = _get_profile()
+    api_token = profile.get("api_token")
+    account = profile.get("account")
 
     if {"service": "http_status:404"} not in config["ingress"]:
         config["ingress"].append({"service": "http_status:404"})
 
     tunnel_config = cf_tunnel_utils.create_tunnel_config(
-        api_token, account, tunnel_id, {"config": config}
+        api_token, account, tunnel_id, {"config": config}, profile=profile
     )
+    _invalidate_context_cache()
 
     if not tunnel_config:
         raise salt.exceptions.CommandExecutionError("There was an issue creating the tunnel config")
@@ -466,3 +921,100 @@ def remove_connector():
             raise salt.exceptions.CommandExecutionError("Error uninstalling connector")
 
     return True
+
+
+def client_stats():
+    """
+    Get the counters of the Cloudflare client pool, rate limiter and request coalescing for the
+    current process
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cloudflare_tunnel.client_stats
+
+    Returns a dictionary with a ``pool`` section holding the number of clients ``created``, the
+    number of calls that ``reused`` a pooled client and its open connections, the number of
+    clients ``evicted`` from the pool and the number currently ``idle``, a ``rate_limit``
+    section holding the number of ``requests``, how many were ``delayed`` and the total and
+    longest time in seconds they waited for the rate limiter, and a ``single_flight`` section
+    holding the number of GET requests that shared an identical request already in flight
+    (``hits``) and that were sent (``misses``)
+    """
+    return cf_tunnel_utils.client_stats()
+
+
+def stats(reset=False):
+    """
+    Get the number of requests sent to the Cloudflare API by the current process, with their
+    errors, retries and latency, per HTTP method and endpoint
+
+    reset
+        Set the counters back to zero once they are read, defaults to ``False``
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cloudflare_tunnel.stats
+        salt '*' cloudflare_tunnel.stats reset=True
+
+    Returns a dictionary keyed by ``"<method> <endpoint>"`` holding the ``count`` of requests,
+    the number that ended in an ``errors``, the number of ``retries``, the ``latency_sum`` and
+    ``latency_max`` in seconds and a ``histogram`` mapping each bucket bound in seconds to the
+    number of requests that took at most that long
+    """
+    return cf_tunnel_utils.api_stats(reset=reset)
+
+
+def cache_stats():
+    """
+    Get the content of the persistent inventory cache
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cloudflare_tunnel.cache_stats
+
+    Returns a dictionary telling whether the cache is ``enabled``, with the ``path`` and ``size``
+    in bytes of the cache file, an ``entities`` section holding for ``tunnels``, ``zones`` and
+    ``dns`` the number of live ``entries``, the number of ``expired`` ones and their ``ttl``, and
+    the ``hits`` and ``misses`` of the lookups made in this run
+    """
+    stats = _inventory_cache().stats()
+    stats["enabled"] = bool(_get_profile().get("disk_cache"))
+
+    return stats
+
+
+def cache_clear(entity=None):
+    """
+    Remove entries from the persistent inventory cache
+
+    entity
+        Kind of entries to remove: ``tunnels``, ``zones``, ``dns`` or the ``fingerprints`` of the
+        tunnel states, all of them by default
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' cloudflare_tunnel.cache_clear
+        salt '*' cloudflare_tunnel.cache_clear entity=dns
+
+    Returns ``True`` if successful
+    """
+    if entity is None:
+        _inventory_cache().clear()
+    elif entity in cf_tunnel_cache.DEFAULT_TTLS:
+        _inventory_cache().invalidate(entity)
+    else:
+        raise salt.exceptions.ArgumentValueError(
+            f"Unknown cache entity {entity}, expected one of "
+            + ", ".join(cf_tunnel_cache.DEFAULT_TTLS)
+        )
+    _invalidate_context_cache()
+
+    return True
@@ -32,13 +32,76 @@ api_token:
 account:
     CloudFlare Account ID, this can be found on the bottom right of the Overview page for your
     domain
+
+max_workers:
+    Optional, number of DNS records created, updated or removed at the same time, defaults to 4
+
+prometheus_textfile:
+    Optional, path of a ``.prom`` file in the node_exporter textfile collector directory. After
+    each ``present`` or ``absent`` run the API latency histograms, the API calls, ingress rules
+    diffed, DNS records changed and duration of each phase of every tunnel state are written to
+    it atomically
+
+profiling:
+    Optional, set to ``True`` to profile every ``present`` and ``absent`` run, see the
+    ``profiling`` argument of the states
+
+trace:
+    Optional, record a trace of every ``present`` and ``absent`` run, with a span for the run,
+    for each of its phases and for each request sent to the Cloudflare API. Set to ``jsonl`` to
+    append the spans to ``trace_file``, or to the dotted path of an exporter class, created
+    without arguments, whose ``export`` method is called with the list of spans
+
+trace_file:
+    Optional, file written by the ``jsonl`` trace exporter, defaults to
+    ``<cachedir>/cloudflare_tunnel/traces.jsonl``
+
+fingerprint:
+    Optional, after a successful ``present`` run store a hash of its ingress rules, DNS targets
+    and tunnel id with the version of the tunnel configuration in the minion cache. A later run
+    with the same hash returns at once when the configuration version did not change, checked
+    with one request. Set to ``trust`` to skip that request as well. Defaults to ``False``
+
+fingerprint_verify_interval:
+    Optional, seconds after which a stored fingerprint is ignored and a full verification of
+    the tunnel, its DNS records and the connector is run, defaults to 3600
 """
+import concurrent.futures
+import contextlib
+import contextvars
+import hashlib
 import logging
+import os
+import re
+import time
+import uuid
+
+import salt.exceptions
+import salt.utils.atomicfile
+import salt.utils.files
+import salt.utils.json
+import salt.utils.state
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_cache as cf_tunnel_cache
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_ingress as cf_tunnel_ingress
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_metrics as cf_tunnel_metrics
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod as cf_tunnel_utils
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_profile as cf_tunnel_profile
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_trace as cf_tunnel_trace
 
 log = logging.getLogger(__name__)
 
 __virtualname__ = "cloudflare_tunnel"
 
+DEFAULT_MAX_WORKERS = 4
+
+# Seconds a fingerprint is trusted before a full verification is run
+FINGERPRINT_VERIFY_INTERVAL = 3600
+
+# Seconds a plan saved by a test run is kept
+PLAN_TTL = 86400
+
+PLAN_ID = re.compile(r"^[0-9a-f]{32}$")
+
 
 def __virtual__():
     if "cloudflare_tunnel.get_tunnel" not in __salt__:
@@ -46,7 +109,301 @@ def __virtual__():
     return __virtualname__
 
 
-def present(name, ingress):
+def _max_workers():
+    """
+    Returns the number of API calls the state may run at the same time, at least one
+    """
+    value = __salt__["config.get"]("cloudflare", {}).get("max_workers", DEFAULT_MAX_WORKERS)
+    try:
+        return max(1, int(value))
+    except (TypeError, ValueError):
+        log.warning("Invalid max_workers %r, using %s", value, DEFAULT_MAX_WORKERS)
+        return DEFAULT_MAX_WORKERS
+
+
+def _export_metrics(run):
+    """
+    Write the metrics of a state run to the Prometheus textfile, if one is configured
+
+    A metrics file that cannot be written is logged and does not change the state result.
+    """
+    path = __salt__["config.get"]("cloudflare", {}).get("prometheus_textfile")
+    if not path:
+        return
+
+    store_path = os.path.join(__opts__["cachedir"], "cloudflare_tunnel", "metrics.json")
+    try:
+        cf_tunnel_metrics.TextfileExporter(path, store_path).export(run)
+    except OSError as exc:
+        log.warning("Could not write the Cloudflare metrics to %s: %s", path, exc)
+
+
+def _profiler(run, profiling):
+    """
+    Returns a profiler for the run if profiling is enabled by the state or the configuration
+    """
+    if not (profiling or __salt__["config.get"]("cloudflare", {}).get("profiling")):
+        return contextlib.nullcontext()
+
+    directory = os.path.join(__opts__["cachedir"], "cloudflare_tunnel", "profiles")
+    return cf_tunnel_profile.StateProfiler(run, directory)
+
+
+def _tracer(state, name):
+    """
+    Returns the root span of a trace of the run if tracing is enabled
+
+    An exporter that cannot be loaded is logged and the run is not traced.
+    """
+    config = __salt__["config.get"]("cloudflare", {})
+    if not config.get("trace"):
+        return contextlib.nullcontext()
+
+    path = config.get("trace_file") or os.path.join(
+        __opts__["cachedir"], "cloudflare_tunnel", "traces.jsonl"
+    )
+    try:
+        exporter = cf_tunnel_trace.load_exporter(config["trace"], path)
+    except (ImportError, AttributeError, ValueError) as exc:
+        log.warning("Could not load the Cloudflare trace exporter %s: %s", config["trace"], exc)
+        return contextlib.nullcontext()
+
+    return cf_tunnel_trace.trace(f"cloudflare_tunnel.{state}", exporter, {"name": name})
+
+
+def _fingerprints():
+    """
+    Returns the cache holding the fingerprints of the ``present`` runs, or ``None`` unless
+    ``fingerprint`` is enabled
+    """
+    config = __salt__["config.get"]("cloudflare", {})
+    if not config.get("fingerprint"):
+        return None
+
+    interval = config.get("fingerprint_verify_interval", FINGERPRINT_VERIFY_INTERVAL)
+    return cf_tunnel_cache.InventoryCache(
+        os.path.join(__opts__["cachedir"], "cloudflare_tunnel"), ttls={"fingerprints": interval}
+    )
+
+
+def _fingerprint(name, ingress, tunnel_id):
+    """
+    Returns the hash of the desired state of a tunnel: its canonical ingress rules, the target
+    of the DNS record of each hostname and the tunnel id
+    """
+    rules = [
+        cf_tunnel_ingress.canonical_rule(rule)
+        for rule in cf_tunnel_ingress.with_catch_all(ingress)
+    ]
+    target = f"{tunnel_id}.cfargotunnel.com"
+    targets = [[hostname, target] for hostname in sorted({rule[0] for rule in rules if rule[0]})]
+
+    return hashlib.sha256(
+        salt.utils.json.dumps([name, tunnel_id, rules, targets]).encode()
+    ).hexdigest()
+
+
+def _fingerprint_matches(name, ingress, run):
+    """
+    Returns ``True`` if the last successful run stored the fingerprint of this desired state and
+    the version of the tunnel configuration is still the one it observed
+    """
+    fingerprints = _fingerprints()
+    stored = fingerprints.get("fingerprints", name) if fingerprints else None
+    if not stored or stored["hash"] != _fingerprint(name, ingress, stored["tunnel_id"]):
+        return False
+
+    if __salt__["config.get"]("cloudflare", {}).get("fingerprint") == "trust":
+        return True
+
+    with run.phase("lookup"):
+        try:
+            config = __salt__["cloudflare_tunnel.get_tunnel_config"](stored["tunnel_id"])
+        except salt.exceptions.SaltException as exc:
+            log.debug("Could not check the configuration version of tunnel %s: %s", name, exc)
+            return False
+
+    return bool(config) and config.get("version") == stored["version"]
+
+
+def _remember_fingerprint(name, ingress, tunnel_id, version, foreign_dns=()):
+    """
+    Store the fingerprint of the desired state that was just applied
+
+    Nothing is stored while records of its hostnames point elsewhere, so a later run with
+    ``repoint_dns`` still looks them up.
+    """
+    fingerprints = _fingerprints()
+    if foreign_dns:
+        _forget_fingerprint(name)
+    elif fingerprints and not __opts__["test"]:
+        fingerprints.set(
+            "fingerprints",
+            name,
+            {
+                "hash": _fingerprint(name, ingress, tunnel_id),
+                "tunnel_id": tunnel_id,
+                "version": version,
+            },
+        )
+
+
+def _forget_fingerprint(name):
+    fingerprints = _fingerprints()
+    if fingerprints and not __opts__["test"]:
+        fingerprints.invalidate("fingerprints", name)
+
+
+def _run_state(state, name, profiling, func, *args):
+    """
+    Run the body of a state, recording its metrics and trace and profiling it when asked to
+    """
+    run = cf_tunnel_metrics.StateRun(state, name)
+    try:
+        with _profiler(run, profiling) as profiler:
+            with _tracer(state, name) as root:
+                ret = func(*args, run)
+                if root:
+                    root.set_attribute("result", ret["result"])
+                    root.set_attribute("changes", len(ret["changes"]))
+        run.result = ret["result"] is not False
+
+        if profiler:
+            phases = ", ".join(f"{phase} {label}" for phase, label in profiler.phases().items())
+            ret["comment"] = "\n".join(
+                [
+                    ret["comment"],
+                    f"Profile written to {profiler.pstats_path} and {profiler.collapsed_path}",
+                ]
+                + ([f"Phases: {phases}"] if phases else [])
+            ).strip()
+
+        return ret
+    finally:
+        _export_metrics(run)
+
+
+def _run_concurrently(func, items):
+    """
+    Call ``func`` once for every item on a bounded thread pool
+
+    Returns ``(item, result, error)`` tuples in the order of ``items``. A Salt error raised for
+    one item is returned as its error and does not stop the calls for the other items.
+    """
+    if not items:
+        return []
+
+    max_workers = max(1, min(_max_workers(), len(items)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Each call runs in a copy of the current context so the loader dunders resolve
+        futures = [executor.submit(contextvars.copy_context().run, func, item) for item in items]
+
+    results = []
+    for item, future in zip(items, futures):
+        try:
+            results.append((item, future.result(), None))
+        except salt.exceptions.SaltException as exc:
+            log.error("Cloudflare call for %s failed: %s", item, exc)
+            results.append((item, None, exc))
+
+    return results
+
+
+def _run_parallel(*calls):
+    """
+    Run independent lookups at the same time on a bounded thread pool
+
+    Each call is a function without arguments, chaining the lookups that depend on each other.
+    Returns the result of every call in the order of ``calls``, so the time taken is the one of
+    the longest chain. The first error raised is raised again once every call has returned.
+    """
+    max_workers = max(1, min(_max_workers(), len(calls)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, call) for call in calls]
+
+    return [future.result() for future in futures]
+
+
+def _dns_ref(dns):
+    """
+    Returns what is needed to change a DNS record without looking it up again
+    """
+    return {"name": dns["name"], "id": dns["id"], "zone_id": dns["zone_id"]}
+
+
+def _is_cname(dns):
+    """
+    Returns whether a DNS record can belong to a tunnel
+
+    The snapshot also holds the A and AAAA records that keep a hostname from being created,
+    those are never changed or removed.
+    """
+    return bool(dns) and dns.get("type") == "CNAME"
+
+
+def _unique_hostnames(hostnames):
+    """
+    Returns the hostnames in their order without repeats, DNS names being case insensitive
+
+    Rules routing several paths of one hostname each name it, its record is still a single one.
+    """
+    unique = {}
+    for hostname in hostnames:
+        unique.setdefault(hostname.lower(), hostname)
+    return list(unique.values())
+
+
+def _hostname_collisions(states):
+    """
+    Find the hostnames several tunnels route, a hostname has a single DNS record
+
+    states
+        Dictionary of the ingress rules of each tunnel name
+
+    The first tunnel naming a hostname keeps it. Returns the ``(hostname, tunnel)`` pairs of each
+    later tunnel naming it, by tunnel name, those tunnels are not reconciled.
+    """
+    owners = {}
+    collisions = {}
+    for name, ingress in states.items():
+        hostnames = _unique_hostnames(rule["hostname"] for rule in ingress if "hostname" in rule)
+        taken = [
+            (hostname, owners[hostname.lower()])
+            for hostname in hostnames
+            if hostname.lower() in owners
+        ]
+        if taken:
+            collisions[name] = taken
+            continue
+
+        for hostname in hostnames:
+            owners[hostname.lower()] = name
+    return collisions
+
+
+def _remove_dns_records(records):
+    """
+    Remove DNS records already looked up, each one by its zone and id
+
+    Returns ``(name, result, error)`` tuples like ``_run_concurrently``
+    """
+    records = {dns["name"]: dns for dns in records}
+    return _run_concurrently(
+        lambda dns_name: __salt__["cloudflare_tunnel.remove_dns_by_id"](
+            records[dns_name]["zone_id"], records[dns_name]["id"]
+        ),
+        list(records),
+    )
+
+
+def _rule_change(rule):
+    """
+    Returns the part of an ingress rule shown in the changes
+    """
+    return {key: rule[key] for key in ("hostname", "service") if key in rule}
+
+
+def present(name, ingress, profiling=False, plan=None, repoint_dns=False):
     """
     Ensure the tunnel is present
 
@@ -63,6 +420,24 @@ def present(name, ingress):
         See `docs <https://developers.cloudflare.com/cloudflare-one/connections/connect-apps/
         install-and-setup/tunnel-guide/local/local-management/configuration-file>`_ for config details
 
+    The following parameters are optional:
+
+    profiling
+        Write a cProfile dump and a collapsed stack file of the run to the minion cachedir, their
+        path is added to the comment. Defaults to ``False``
+
+    plan
+        Id of a plan saved by an earlier run with ``test=True``. Its actions are applied without
+        looking the tunnel, its DNS records and the connector up again, as long as the tunnel
+        configuration version is still the one the plan was made from
+
+    repoint_dns
+        Point the CNAME records of the hostnames that route to another tunnel to this one.
+        Records already serving a hostname are otherwise left alone. Defaults to ``False``
+
+    Run with ``test=True``, the state lists every action it would take and saves them as a plan
+    under the minion cachedir, the comment gives its id.
+
     CLI Example:
 
     .. code-block:: yaml
@@ -78,128 +453,387 @@ def present(name, ingress):
                 - hostname: another.domain.com
                   service: http://127.0.0.1:8080
     """
-    ret = {"name": name, "changes": {}, "result": None, "comment": ""}
+    return _run_state("present", name, profiling, _present, name, ingress, plan, repoint_dns)
+
+
+def _plan_path(plan_id):
+    return os.path.join(__opts__["cachedir"], "cloudflare_tunnel", "plans", f"{plan_id}.json")
 
-    tunnel = __salt__["cloudflare_tunnel.get_tunnel"](name)
 
-    create_tunnel = True
-    create_dns = []
-    remove_dns = []
-    update_config = False
-    config_service = True
-    config_changes = {"old": [], "new": []}
+def _save_plan(plan):
+    """
+    Write a plan to the minion cachedir, dropping the plans older than ``PLAN_TTL``
+    """
+    path = _plan_path(plan["id"])
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+
+    for filename in os.listdir(directory):
+        old_path = os.path.join(directory, filename)
+        try:
+            if time.time() - os.path.getmtime(old_path) > PLAN_TTL:
+                os.remove(old_path)
+        except OSError:
+            pass
+
+    with salt.utils.atomicfile.atomic_open(path, "w") as fh_:
+        fh_.write(salt.utils.json.dumps(plan))
+
+
+def _load_plan(plan_id):
+    """
+    Returns a saved plan
+
+    Raises ``ArgumentValueError`` if there is no plan with this id.
+    """
+    if not PLAN_ID.match(str(plan_id)):
+        raise salt.exceptions.ArgumentValueError(f"Invalid plan id {plan_id}")
+
+    try:
+        with salt.utils.files.fopen(_plan_path(plan_id), "r") as fh_:
+            return salt.utils.json.loads(fh_.read())
+    except FileNotFoundError:
+        raise salt.exceptions.ArgumentValueError(f"Plan {plan_id} does not exist")
+
+
+def _remove_plan(plan_id):
+    try:
+        os.remove(_plan_path(plan_id))
+    except OSError:
+        pass
+
+
+def _make_plan(name, ingress, run, repoint_dns=False):
+    """
+    Look the tunnel, its configuration, its DNS records and the connector up and return every
+    action needed to reach the desired state
+
+    repoint_dns
+        Update the CNAME records of the hostnames that point to another tunnel, they are only
+        listed in ``foreign_dns`` otherwise
+
+    The plan only holds data that can be serialized, so it can be saved and applied later.
+    """
+    plan = {
+        "id": uuid.uuid4().hex,
+        "name": name,
+        "ingress": ingress,
+        "created": time.time(),
+        "tunnel_id": None,
+        "version": None,
+        "create_tunnel": True,
+        "update_config": False,
+        "config_changes": {"old": [], "new": []},
+        "create_dns": [],
+        "update_dns": [],
+        "remove_dns": [],
+        "foreign_dns": [],
+        "install_connector": True,
+    }
+
+    hostnames = _unique_hostnames(rule["hostname"] for rule in ingress if "hostname" in rule)
+
+    def _tunnel_and_config():
+        tunnel = __salt__["cloudflare_tunnel.get_tunnel"](name)
+        if not tunnel:
+            return None, None
+        return tunnel, __salt__["cloudflare_tunnel.get_tunnel_config"](tunnel["id"])
+
+    def _dns_snapshot():
+        # Read the DNS records of every zone involved once instead of once per hostname
+        if not hostnames:
+            return {}
+        return __salt__["cloudflare_tunnel.get_dns_snapshot"](hostnames)
+
+    # The tunnel configuration needs the tunnel id, the DNS records and the connector do not
+    with run.phase("lookup"):
+        (tunnel, config), dns_records, connector_installed = _run_parallel(
+            _tunnel_and_config, _dns_snapshot, __salt__["cloudflare_tunnel.is_connector_installed"]
+        )
+
+    plan["install_connector"] = not connector_installed
+    stale_hostnames = []
 
     if tunnel:
+        plan["tunnel_id"] = tunnel["id"]
         if tunnel["name"] == name:
-            create_tunnel = False
-
-        config = __salt__["cloudflare_tunnel.get_tunnel_config"](tunnel["id"])
+            plan["create_tunnel"] = False
 
         if config:
-            for rule in ingress:
-                if rule not in config["config"]["ingress"]:
-                    update_config = True
-                    config_changes["new"].append(
-                        {"hostname": rule["hostname"], "service": rule["service"]}
-                    )
-
-            # Check if there any existing rules that need to be removed
-            for rule in config["config"]["ingress"]:
-                if rule not in ingress:
-                    config_changes["old"].append(
-                        {"hostname": rule["hostname"], "service": rule["service"]}
-                    )
-                    update_config = True
-
-                if "hostname" in rule:
-                    if not any(rule["hostname"] in d.values() for d in ingress):
-                        dns = __salt__["cloudflare_tunnel.get_dns"](rule["hostname"])
-                        if dns:
-                            remove_dns.append(dns["name"])
+            plan["version"] = config.get("version")
+            run.count("ingress_rules_diffed", len(ingress) + len(config["config"]["ingress"]))
+            with run.phase("diff"):
+                diff = cf_tunnel_ingress.diff_ingress(
+                    cf_tunnel_ingress.with_catch_all(ingress), config["config"]["ingress"]
+                )
+
+            config_changes = plan["config_changes"]
+            config_changes["new"] = [_rule_change(rule) for rule in diff["added"]]
+            config_changes["old"] = [_rule_change(rule) for rule in diff["removed"]]
+            for old_rule, new_rule in diff["modified"]:
+                config_changes["old"].append(_rule_change(old_rule))
+                config_changes["new"].append(_rule_change(new_rule))
+            if diff["reordered"]:
+                config_changes["reordered"] = [_rule_change(rule) for rule in diff["reordered"]]
+
+            plan["update_config"] = bool(
+                diff["added"] or diff["removed"] or diff["modified"] or diff["reordered"]
+            )
+            stale_hostnames = diff["stale_hostnames"]
         else:
-            update_config = True
-            config_changes["new"] = ingress
+            plan["update_config"] = True
+            plan["config_changes"]["new"] = ingress
     else:
-        update_config = True
-        config_changes["new"] = ingress
+        plan["update_config"] = True
+        plan["config_changes"]["new"] = ingress
+
+    # Hostnames the configuration stops serving are only known after the diff, their zones are
+    # usually among the ones already read and memoized by the execution module
+    if stale_hostnames:
+        with run.phase("dns_lookup"):
+            dns_records = dict(
+                dns_records, **__salt__["cloudflare_tunnel.get_dns_snapshot"](stale_hostnames)
+            )
+
+    for hostname in stale_hostnames:
+        if _is_cname(dns_records.get(hostname)):
+            plan["remove_dns"].append(_dns_ref(dns_records[hostname]))
+
+    # Records of a tunnel that is about to be created point to another tunnel
+    target = None if plan["create_tunnel"] else f"{plan['tunnel_id']}.cfargotunnel.com"
+    for hostname in hostnames:
+        dns = dns_records.get(hostname)
+        if dns is None:
+            plan["create_dns"].append(hostname)
+        elif dns.get("content") != target:
+            if repoint_dns and _is_cname(dns):
+                plan["update_dns"].append(_dns_ref(dns))
+            else:
+                plan["foreign_dns"].append(hostname)
+
+    return plan
+
+
+def _plan_actions(plan):
+    """
+    Returns a line describing each action of the plan
+    """
+    actions = []
+    if plan["create_tunnel"]:
+        actions.append(f"Tunnel {plan['name']} will be created")
+    if plan["update_config"]:
+        actions.append("Tunnel config will be created/updated")
+    actions.extend(f"DNS {hostname} will be created" for hostname in plan["create_dns"])
+    actions.extend(f"DNS {dns['name']} will be updated" for dns in plan["update_dns"])
+    actions.extend(f"DNS {dns['name']} will be removed" for dns in plan["remove_dns"])
+    if plan["install_connector"]:
+        actions.append("Cloudflare connector will be installed")
 
-    for rule in ingress:
-        if "hostname" in rule:
-            dns = __salt__["cloudflare_tunnel.get_dns"](rule["hostname"])
+    return actions
 
-            if not dns:
-                create_dns.append(rule["hostname"])
 
-    if __salt__["cloudflare_tunnel.is_connector_installed"]():
-        config_service = False
+def _check_plan(plan, name, ingress, run):
+    """
+    Returns why a saved plan cannot be applied, or ``None`` if it can
 
-    if not (create_tunnel or create_dns or update_config or config_service or remove_dns):
-        ret["result"] = True
-        ret["comment"] = f"Cloudflare Tunnel {name} is already in the desired state"
+    Only the tunnel, when the plan creates it, or the version of its configuration is read
+    from Cloudflare.
+    """
+    planned = _fingerprint(plan["name"], plan["ingress"], None)
+    if plan["name"] != name or planned != _fingerprint(name, ingress, None):
+        return f"Plan {plan['id']} was made for another tunnel or other ingress rules"
 
-        return ret
+    if plan["create_tunnel"]:
+        with run.phase("lookup"):
+            tunnel = __salt__["cloudflare_tunnel.get_tunnel"](name)
+        if tunnel:
+            return f"Plan {plan['id']} is out of date, tunnel {name} was created since it was made"
+        return None
 
-    if create_tunnel:
-        if __opts__["test"]:
-            ret["comment"] = f"Tunnel {name} will be created"
+    if not plan["tunnel_id"]:
+        return None
+
+    with run.phase("lookup"):
+        config = __salt__["cloudflare_tunnel.get_tunnel_config"](plan["tunnel_id"])
+
+    version = config.get("version") if config else None
+    if version != plan["version"]:
+        return (
+            f"Plan {plan['id']} is out of date, the tunnel configuration changed since it was made"
+        )
+
+    return None
+
+
+def _present(name, ingress, plan_id, repoint_dns, run):
+    """
+    Ensure the tunnel is present, timing each phase in ``run``
+    """
+    ret = {"name": name, "changes": {}, "result": None, "comment": ""}
+
+    if plan_id:
+        try:
+            plan = _load_plan(plan_id)
+        except salt.exceptions.ArgumentValueError as exc:
+            ret["result"] = False
+            ret["comment"] = str(exc)
             return ret
 
-        tunnel = __salt__["cloudflare_tunnel.create_tunnel"](name)
+        error = _check_plan(plan, name, ingress, run)
+        if error:
+            ret["result"] = False
+            ret["comment"] = error
+            return ret
+    else:
+        aggregated = _aggregated_ret(name, ingress, run)
+        if aggregated:
+            return aggregated
 
-        ret["changes"].setdefault("tunnel created", name)
+        if _fingerprint_matches(name, ingress, run):
+            ret["result"] = True
+            ret["comment"] = f"Cloudflare Tunnel {name} is already in the desired state, unchanged"
+            return ret
+
+        plan = _make_plan(name, ingress, run, repoint_dns)
+
+    if not _review_plan(plan, ingress, ret):
+        if plan_id and not __opts__["test"]:
+            _remove_plan(plan_id)
+
+        return ret
+
+    ret = _apply_plan(plan, ingress, run, ret)
+    if plan_id:
+        _remove_plan(plan_id)
+
+    return ret
+
+
+def _review_plan(plan, ingress, ret, save=True):
+    """
+    Fill the state return of a plan without actions, or of a plan only shown in test mode
+
+    save
+        Save the plan shown in test mode, so it can be applied with the ``plan`` argument
+
+    Returns ``True`` if the actions of the plan are to be taken
+    """
+    actions = _plan_actions(plan)
+    if not actions:
         ret["result"] = True
-        ret["comment"] = f"Cloudflare tunnel {name} was created"
+        ret["comment"] = f"Cloudflare Tunnel {plan['name']} is already in the desired state"
+        _remember_fingerprint(
+            plan["name"], ingress, plan["tunnel_id"], plan["version"], plan["foreign_dns"]
+        )
+        return False
 
-    if update_config:
-        if __opts__["test"]:
-            ret["comment"] = "Tunnel config will be created/updated"
-            ret["changes"].setdefault("tunnel config", config_changes)
-            return ret
+    if __opts__["test"]:
+        if plan["update_config"]:
+            ret["changes"]["tunnel config"] = plan["config_changes"]
+        if save:
+            _save_plan(plan)
+            actions.append(f"Plan {plan['id']} saved, apply it with plan={plan['id']}")
+        ret["comment"] = "\n".join(actions)
+        return False
+
+    return True
 
-        __salt__["cloudflare_tunnel.create_tunnel_config"](tunnel["id"], {"ingress": ingress})
 
-        ret["changes"].setdefault("tunnel config", config_changes)
+def _create_tunnel(name):
+    """
+    Create the tunnel and return its id, raises ``CommandExecutionError`` if it already exists
+    """
+    tunnel = __salt__["cloudflare_tunnel.create_tunnel"](name)
+    if isinstance(tunnel, tuple):
+        raise salt.exceptions.CommandExecutionError(tunnel[1])
+
+    return tunnel["id"]
+
+
+def _apply_plan(plan, ingress, run, ret):
+    """
+    Take the actions of a plan
+    """
+    name = plan["name"]
+    tunnel_id = plan["tunnel_id"]
+    version = plan["version"]
+    errors = []
+
+    if plan["create_tunnel"]:
+        with run.phase("tunnel"):
+            try:
+                tunnel_id = _create_tunnel(name)
+            except salt.exceptions.CommandExecutionError as exc:
+                ret["result"] = False
+                ret["comment"] = f"Cloudflare tunnel {name} could not be created: {exc}"
+                _forget_fingerprint(name)
+                return ret
+
+        ret["changes"].setdefault("tunnel created", name)
         ret["result"] = True
+        ret["comment"] = f"Cloudflare tunnel {name} was created"
 
-    if create_dns:
-        if __opts__["test"]:
-            for dns in create_dns:
-                ret["comment"] = "\n".join([ret["comment"], f"DNS {dns} will be created"])
-            return ret
+    if plan["update_config"]:
+        with run.phase("config"):
+            config = __salt__["cloudflare_tunnel.create_tunnel_config"](
+                tunnel_id, {"ingress": ingress}
+            )
+        version = config.get("version") if config else None
 
-        for dns in create_dns:
-            dns = __salt__["cloudflare_tunnel.create_dns"](dns, tunnel["id"])
+        ret["changes"].setdefault("tunnel config", plan["config_changes"])
+        ret["result"] = True
 
+    if plan["create_dns"] or plan["update_dns"]:
+        # Records to update were looked up with the plan, they are overwritten by id
+        update_dns = {dns["name"]: dns for dns in plan["update_dns"]}
+
+        def _create_or_update_dns(hostname):
+            dns = update_dns.get(hostname)
+            if dns:
+                return __salt__["cloudflare_tunnel.update_dns_by_id"](
+                    dns["zone_id"], dns["id"], hostname, tunnel_id
+                )
+            return __salt__["cloudflare_tunnel.create_dns"](hostname, tunnel_id)
+
+        with run.phase("dns"):
+            created = _run_concurrently(
+                _create_or_update_dns, _unique_hostnames(plan["create_dns"] + list(update_dns))
+            )
+        for hostname, dns, error in created:
+            updated = hostname in update_dns
+            if error:
+                action = "updated" if updated else "created"
+                errors.append(f"DNS {hostname} could not be {action}: {error}")
+                continue
+
+            run.count("dns_records_changed")
             ret["changes"][dns["name"]] = {
                 "content": dns["content"],
                 "type": dns["type"],
                 "proxied": dns["proxied"],
                 "comment": dns["comment"],
-                "result": "Added",
+                "result": "Updated" if updated else "Added",
             }
             ret["result"] = True
 
-    if remove_dns:
-        if __opts__["test"]:
-            for dns in remove_dns:
-                ret["comment"] = "\n".join([ret["comment"], f"DNS {dns} will be removed"])
-            return ret
-
-        for hostname in remove_dns:
-            __salt__["cloudflare_tunnel.remove_dns"](hostname)
+    if plan["remove_dns"]:
+        with run.phase("dns"):
+            removed = _remove_dns_records(plan["remove_dns"])
+        for hostname, _, error in removed:
+            if error:
+                errors.append(f"DNS {hostname} could not be removed: {error}")
+                continue
 
+            run.count("dns_records_changed")
             ret["changes"][hostname] = {
                 "result": "Removed",
             }
             ret["result"] = True
 
-    if config_service:
-        if __opts__["test"]:
-            ret["comment"] = "Cloudflare connector will be installed"
-            return ret
-
-        if tunnel:
-            __salt__["cloudflare_tunnel.install_connector"](tunnel["id"])
+    if plan["install_connector"]:
+        if tunnel_id:
+            with run.phase("connector"):
+                __salt__["cloudflare_tunnel.install_connector"](tunnel_id)
 
             ret["changes"].setdefault("connector installed and started", True)
             ret["result"] = True
@@ -208,16 +842,265 @@ def present(name, ingress):
             ret["comment"] = "Tunnel not found, could not configure the connector"
             return ret
 
+    if errors:
+        ret["result"] = False
+        ret["comment"] = "\n".join([ret["comment"]] + errors).strip()
+        _forget_fingerprint(name)
+    else:
+        _remember_fingerprint(name, ingress, tunnel_id, version, plan["foreign_dns"])
+
     return ret
 
 
-def absent(name):
+def _aggregated_ret(name, ingress, run):
+    """
+    Returns the state return of a ``present`` state merged by ``mod_aggregate``, or ``None``
+
+    The first aggregated state to run reconciles every one of them and keeps the state return of
+    the others in ``__context__``, its run times the whole reconciliation.
+    """
+    pending = __context__.get("cloudflare_tunnel.aggregate")
+    if pending and pending.get(name) == ingress:
+        states = dict(pending)
+        pending.clear()
+        aggregated = __context__.setdefault("cloudflare_tunnel.aggregated", {})
+        for state_name, ret in _reconcile(states, run).items():
+            aggregated[state_name] = (states[state_name], ret)
+
+    ingress_ret = __context__.get("cloudflare_tunnel.aggregated", {}).pop(name, None)
+    if ingress_ret and ingress_ret[0] == ingress:
+        return ingress_ret[1]
+    return None
+
+
+def _reconcile(states, run, save_plans=True, repoint_dns=False):
+    """
+    Bring several tunnels to their desired state at once
+
+    states
+        Dictionary of the ingress rules of each tunnel name
+
+    save_plans
+        Save the plans shown in test mode, see ``_review_plan``
+
+    repoint_dns
+        Point the CNAME records routing to another tunnel to the one of the state, see
+        ``_make_plan``
+
+    Every plan is made before anything is written, so each zone is listed and read once for all
+    the tunnels. The tunnels and their configurations are then written at the same time and the
+    DNS changes of every tunnel are sent in one batch per zone. A tunnel that cannot be looked
+    up, or that routes a hostname an earlier tunnel already routes, fails on its own.
+
+    Returns the state return of each tunnel name
+    """
+    rets = {name: {"name": name, "changes": {}, "result": None, "comment": ""} for name in states}
+    collisions = _hostname_collisions(states)
+    names = []
+    for name, ingress in states.items():
+        if name in collisions:
+            rets[name]["result"] = False
+            rets[name]["comment"] = "\n".join(
+                f"Hostname {hostname} is already routed by Cloudflare Tunnel {owner}"
+                for hostname, owner in collisions[name]
+            )
+        elif _fingerprint_matches(name, ingress, run):
+            rets[name]["result"] = True
+            rets[name]["comment"] = (
+                f"Cloudflare Tunnel {name} is already in the desired state, unchanged"
+            )
+        else:
+            names.append(name)
+
+    # The tunnels and their configurations are read at the same time, the execution module
+    # memoizes them for the plans
+    with run.phase("lookup"):
+        tunnels = _run_concurrently(__salt__["cloudflare_tunnel.get_tunnel"], names)
+        _run_concurrently(
+            __salt__["cloudflare_tunnel.get_tunnel_config"],
+            [tunnel["id"] for _, tunnel, _ in tunnels if tunnel],
+        )
+
+    plans = {}
+    for name in names:
+        try:
+            plan = _make_plan(name, states[name], run, repoint_dns)
+        except salt.exceptions.SaltException as exc:
+            rets[name]["result"] = False
+            rets[name]["comment"] = f"Cloudflare Tunnel {name} could not be looked up: {exc}"
+            continue
+
+        if _review_plan(plan, states[name], rets[name], save=save_plans):
+            plans[name] = plan
+
+    if not plans:
+        return rets
+
+    errors = {name: [] for name in plans}
+
+    with run.phase("tunnel"):
+        created = _run_concurrently(
+            _create_tunnel,
+            [name for name, plan in plans.items() if plan["create_tunnel"]],
+        )
+    for name, tunnel_id, error in created:
+        if error:
+            rets[name]["result"] = False
+            rets[name]["comment"] = f"Cloudflare tunnel {name} could not be created: {error}"
+            _forget_fingerprint(name)
+            del plans[name]
+            continue
+
+        plans[name]["tunnel_id"] = tunnel_id
+        rets[name]["changes"]["tunnel created"] = name
+        rets[name]["comment"] = f"Cloudflare tunnel {name} was created"
+
+    with run.phase("config"):
+        written = _run_concurrently(
+            lambda name: __salt__["cloudflare_tunnel.create_tunnel_config"](
+                plans[name]["tunnel_id"], {"ingress": states[name]}
+            ),
+            [name for name, plan in plans.items() if plan["update_config"]],
+        )
+    for name, config, error in written:
+        if error:
+            errors[name].append(f"Tunnel config could not be written: {error}")
+            continue
+
+        plans[name]["version"] = config.get("version") if config else None
+        rets[name]["changes"]["tunnel config"] = plans[name]["config_changes"]
+
+    _apply_dns_batches(plans, run, rets, errors)
+
+    for name, plan in plans.items():
+        if plan["install_connector"]:
+            try:
+                with run.phase("connector"):
+                    __salt__["cloudflare_tunnel.install_connector"](plan["tunnel_id"])
+            except salt.exceptions.SaltException as exc:
+                errors[name].append(f"Cloudflare connector could not be installed: {exc}")
+            else:
+                rets[name]["changes"]["connector installed and started"] = True
+            # A single connector serves the minion, the other tunnels find it installed
+            break
+
+    for name, plan in plans.items():
+        ret = rets[name]
+        if errors[name]:
+            ret["result"] = False
+            ret["comment"] = "\n".join([ret["comment"]] + errors[name]).strip()
+            _forget_fingerprint(name)
+        else:
+            ret["result"] = True
+            _remember_fingerprint(
+                name, states[name], plan["tunnel_id"], plan["version"], plan["foreign_dns"]
+            )
+
+    return rets
+
+
+def _apply_dns_batches(plans, run, rets, errors):
+    """
+    Send the DNS changes of several plans in one batch per zone, reporting each record in the
+    state return of the tunnel it belongs to
+    """
+    batches = {}
+    owners = {}
+    records = {}
+
+    def _batch(zone_id):
+        return batches.setdefault(zone_id, {"creates": [], "updates": [], "deletes": []})
+
+    create_dns = [hostname for plan in plans.values() for hostname in plan["create_dns"]]
+    zones = {}
+    if create_dns:
+        with run.phase("dns_lookup"):
+            zones = __salt__["cloudflare_tunnel.get_zones"](create_dns)
+
+    # A record a tunnel stops routing can be repointed to another tunnel of the same run, one
+    # batch cannot both update and delete it
+    updated = {dns["id"] for plan in plans.values() for dns in plan["update_dns"]}
+
+    for name, plan in plans.items():
+        for hostname in plan["create_dns"]:
+            record = cf_tunnel_utils.tunnel_dns_record(hostname, plan["tunnel_id"])
+            _batch(zones[hostname]["id"])["creates"].append(record)
+            records[hostname.lower()] = record
+            owners["created", hostname.lower()] = name
+        for dns in plan["update_dns"]:
+            record = dict(
+                cf_tunnel_utils.tunnel_dns_record(dns["name"], plan["tunnel_id"]), id=dns["id"]
+            )
+            _batch(dns["zone_id"])["updates"].append(record)
+            records[dns["name"].lower()] = record
+            owners["updated", dns["name"].lower()] = name
+        for dns in plan["remove_dns"]:
+            if dns["id"] in updated:
+                continue
+            _batch(dns["zone_id"])["deletes"].append({"id": dns["id"], "name": dns["name"]})
+            owners["deleted", dns["name"].lower()] = name
+
+    if not batches:
+        return
+
+    with run.phase("dns"):
+        applied = _run_concurrently(
+            lambda zone_id: __salt__["cloudflare_tunnel.apply_dns_batch"](
+                zone_id, **batches[zone_id]
+            ),
+            list(batches),
+        )
+
+    for zone_id, results, error in applied:
+        if error:
+            # The whole zone failed, report each of its records
+            results = [
+                {"name": record["name"], "action": action, "result": False, "comment": str(error)}
+                for operation, action in (
+                    ("deletes", "deleted"),
+                    ("updates", "updated"),
+                    ("creates", "created"),
+                )
+                for record in batches[zone_id][operation]
+            ]
+
+        for result in results:
+            dns_name = result["name"]
+            name = owners.get((result["action"], str(dns_name).lower()))
+            if name is None:
+                continue
+
+            action = "removed" if result["action"] == "deleted" else result["action"]
+            if not result["result"]:
+                errors[name].append(f"DNS {dns_name} could not be {action}: {result['comment']}")
+                continue
+
+            run.count("dns_records_changed")
+            if action == "removed":
+                rets[name]["changes"][dns_name] = {"result": "Removed"}
+                continue
+
+            record = records[dns_name.lower()]
+            rets[name]["changes"][dns_name] = {
+                "content": record["content"],
+                "type": record["type"],
+                "proxied": record["proxied"],
+                "comment": record["comment"],
+                "result": "Updated" if action == "updated" else "Added",
+            }
+
+
+def absent(name, profiling=False):
     """
     Ensure tunnel is absent
 
     name
         This is the name of the Cloudflare Tunnel to delete
 
+    profiling
+        Write a cProfile dump and a collapsed stack file of the run to the minion cachedir, their
+        path is added to the comment. Defaults to ``False``
+
     CLI Example:
 
     .. code-block:: yaml
@@ -225,9 +1108,18 @@ def absent(name):
         cloudflare_tunnel.absent:
             - name: test_cf_tunnel
     """
+    return _run_state("absent", name, profiling, _absent, name)
+
+
+def _absent(name, run):
+    """
+    Ensure tunnel is absent, timing each phase in ``run``
+    """
     ret = {"name": name, "changes": {}, "result": None, "comment": ""}
+    _forget_fingerprint(name)
 
-    tunnel = __salt__["cloudflare_tunnel.get_tunnel"](name)
+    with run.phase("lookup"):
+        tunnel = __salt__["cloudflare_tunnel.get_tunnel"](name)
 
     if tunnel:
         tunnel_name = tunnel["name"]
@@ -237,28 +1129,56 @@ def absent(name):
 
         # Check to see if there is a tunnel config, which will contain a hostname that we will
         # need to delete from DNS
-        tunnel_config = __salt__["cloudflare_tunnel.get_tunnel_config"](tunnel["id"])
+        with run.phase("lookup"):
+            tunnel_config = __salt__["cloudflare_tunnel.get_tunnel_config"](tunnel["id"])
 
         if tunnel_config:
-            __salt__["cloudflare_tunnel.remove_connector"]()
+            with run.phase("connector"):
+                __salt__["cloudflare_tunnel.remove_connector"]()
             ret["changes"].setdefault("connector", "removed")
             ret["result"] = True
 
-            dns_changes = []
-            for rule in tunnel_config["config"]["ingress"]:
-                if "hostname" in rule:
-                    hostname = rule["hostname"]
+            hostnames = [
+                rule["hostname"]
+                for rule in tunnel_config["config"]["ingress"]
+                if "hostname" in rule
+            ]
+            dns_records = {}
+            if hostnames:
+                with run.phase("dns_lookup"):
+                    dns_records = __salt__["cloudflare_tunnel.get_dns_snapshot"](hostnames)
 
-                    dns = __salt__["cloudflare_tunnel.get_dns"](hostname)
-                    if dns:
-                        dns_name = dns["name"]
-                        __salt__["cloudflare_tunnel.remove_dns"](dns["name"])
-                        dns_changes.append(f"{dns_name} removed")
-                        ret["result"] = True
+            dns_changes = []
+            dns_errors = []
+            with run.phase("dns"):
+                removed = _remove_dns_records(
+                    [
+                        dns_records[hostname]
+                        for hostname in hostnames
+                        if _is_cname(dns_records.get(hostname))
+                    ]
+                )
+            for dns_name, _, error in removed:
+                if error:
+                    dns_errors.append(f"DNS {dns_name} could not be removed: {error}")
+                    continue
+
+                run.count("dns_records_changed")
+                dns_changes.append(f"{dns_name} removed")
+                ret["result"] = True
 
             ret["changes"]["dns"] = dns_changes
 
-        __salt__["cloudflare_tunnel.remove_tunnel"](tunnel["id"])
+            # Keep the tunnel so the records that are left can be removed on the next run
+            if dns_errors:
+                ret["result"] = False
+                ret["comment"] = "\n".join(
+                    [f"Cloudflare Tunnel {tunnel_name} was not removed"] + dns_errors
+                )
+                return ret
+
+        with run.phase("tunnel"):
+            __salt__["cloudflare_tunnel.remove_tunnel"](tunnel["id"])
         ret["comment"] = f"Cloudflare Tunnel {tunnel_name} has been removed"
         ret["changes"].setdefault("tunnel", f"removed {tunnel_name}")
         ret["result"] = True
@@ -267,3 +1187,244 @@ def absent(name):
         ret["result"] = True
 
     return ret
+
+
+def managed(name, tunnels, prune=False, profiling=False, repoint_dns=False):
+    """
+    Ensure a set of tunnels is present, reconciling all of them in one pass
+
+    The tunnels of the account are listed once and the DNS records of each zone read once for the
+    whole set. The tunnel configurations are then written at the same time and the DNS changes
+    sent in one batch per zone. A hostname has a single DNS record, the first tunnel of the set
+    naming it routes it and the later ones fail without being changed.
+
+    The following parameters are required:
+
+    name
+        Name of the set, the tunnels it manages are remembered under it in the minion cachedir
+
+    tunnels
+        Dictionary of the ingress rules of each tunnel name, see the ``ingress`` argument of
+        ``present``
+
+    The following parameters are optional:
+
+    prune
+        Remove the tunnels this state managed on an earlier run that are no longer in
+        ``tunnels``, with the DNS records pointing to them. Tunnels it never managed are left
+        alone and the connector is kept. Defaults to ``False``
+
+    repoint_dns
+        Point the CNAME records of the hostnames that route to another tunnel to the tunnel of
+        the set serving them, see the ``repoint_dns`` argument of ``present``. Defaults to
+        ``False``
+
+    profiling
+        Write a cProfile dump and a collapsed stack file of the run to the minion cachedir, their
+        path is added to the comment. Defaults to ``False``
+
+    CLI Example:
+
+    .. code-block:: yaml
+
+        web_tunnels:
+          cloudflare_tunnel.managed:
+            - tunnels:
+                blog:
+                  - hostname: blog.domain.com
+                    service: http://127.0.0.1:8000
+                shop:
+                  - hostname: shop.domain.com
+                    service: http://127.0.0.1:8080
+            - prune: True
+    """
+    return _run_state("managed", name, profiling, _managed, name, tunnels, prune, repoint_dns)
+
+
+def _managed_path(name):
+    digest = hashlib.sha256(name.encode()).hexdigest()
+    return os.path.join(__opts__["cachedir"], "cloudflare_tunnel", "managed", f"{digest}.json")
+
+
+def _load_managed(name):
+    """
+    Returns the names of the tunnels a ``managed`` state managed on its last run
+    """
+    try:
+        with salt.utils.files.fopen(_managed_path(name), "r") as fh_:
+            return salt.utils.json.loads(fh_.read())
+    except FileNotFoundError:
+        return []
+
+
+def _save_managed(name, tunnel_names):
+    path = _managed_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with salt.utils.atomicfile.atomic_open(path, "w") as fh_:
+        fh_.write(salt.utils.json.dumps(sorted(tunnel_names)))
+
+
+def _managed(name, tunnels, prune, repoint_dns, run):
+    """
+    Ensure a set of tunnels is present, timing each phase in ``run``
+    """
+    ret = {"name": name, "changes": {}, "result": True, "comment": ""}
+
+    # Looking each tunnel up by name afterwards is answered from the listing
+    with run.phase("lookup"):
+        listing = {
+            tunnel["name"]: tunnel for tunnel in __salt__["cloudflare_tunnel.list_tunnels"]()
+        }
+
+    rets = _reconcile(tunnels, run, save_plans=False, repoint_dns=repoint_dns)
+
+    comments = []
+    unchanged = 0
+    for tunnel_name, tunnel_ret in rets.items():
+        if tunnel_ret["changes"]:
+            ret["changes"][tunnel_name] = tunnel_ret["changes"]
+        if tunnel_ret["result"] is False:
+            ret["result"] = False
+        elif tunnel_ret["result"] is None and ret["result"]:
+            ret["result"] = None
+
+        if tunnel_ret["result"] is True and not tunnel_ret["changes"]:
+            unchanged += 1
+        else:
+            comments.extend(f"{tunnel_name}: {line}" for line in tunnel_ret["comment"].splitlines())
+
+    kept = []
+    if prune:
+        kept = _prune(name, tunnels, listing, run, ret, comments)
+
+    ret["comment"] = "\n".join(
+        [f"{unchanged} of {len(tunnels)} Cloudflare Tunnels are already in the desired state"]
+        + comments
+    )
+    if not __opts__["test"]:
+        _save_managed(name, list(tunnels) + kept)
+
+    return ret
+
+
+def _prune(name, tunnels, listing, run, ret, comments):
+    """
+    Remove the tunnels a ``managed`` state managed on an earlier run that are no longer in its
+    set, with the DNS records pointing to them
+
+    Returns the names of the tunnels that could not be removed, to be pruned on the next run
+    """
+    stale = [
+        tunnel_name
+        for tunnel_name in _load_managed(name)
+        if tunnel_name not in tunnels and tunnel_name in listing
+    ]
+    if not stale:
+        return []
+
+    if __opts__["test"]:
+        comments.extend(f"Tunnel {tunnel_name} will be removed" for tunnel_name in stale)
+        if ret["result"]:
+            ret["result"] = None
+        return stale
+
+    errors = {tunnel_name: [] for tunnel_name in stale}
+    rets = {tunnel_name: {"changes": {}} for tunnel_name in stale}
+
+    with run.phase("lookup"):
+        configs = _run_concurrently(
+            lambda tunnel_name: __salt__["cloudflare_tunnel.get_tunnel_config"](
+                listing[tunnel_name]["id"]
+            ),
+            stale,
+        )
+
+    hostnames = {}
+    for tunnel_name, config, error in configs:
+        if error:
+            errors[tunnel_name].append(f"Tunnel config could not be read: {error}")
+            continue
+        ingress = config["config"]["ingress"] if config else []
+        hostnames[tunnel_name] = _unique_hostnames(
+            rule["hostname"] for rule in ingress if "hostname" in rule
+        )
+
+    dns_records = {}
+    all_hostnames = [hostname for names in hostnames.values() for hostname in names]
+    if all_hostnames:
+        with run.phase("dns_lookup"):
+            dns_records = __salt__["cloudflare_tunnel.get_dns_snapshot"](all_hostnames)
+
+    # Only the records still pointing to the removed tunnel are removed with it
+    plans = {}
+    for tunnel_name, names in hostnames.items():
+        target = f"{listing[tunnel_name]['id']}.cfargotunnel.com"
+        plans[tunnel_name] = {
+            "tunnel_id": listing[tunnel_name]["id"],
+            "create_dns": [],
+            "update_dns": [],
+            "remove_dns": [
+                _dns_ref(dns_records[hostname])
+                for hostname in names
+                if hostname in dns_records and dns_records[hostname].get("content") == target
+            ],
+        }
+    _apply_dns_batches(plans, run, rets, errors)
+
+    with run.phase("tunnel"):
+        removed = _run_concurrently(
+            lambda tunnel_name: __salt__["cloudflare_tunnel.remove_tunnel"](
+                listing[tunnel_name]["id"]
+            ),
+            [tunnel_name for tunnel_name in stale if not errors[tunnel_name]],
+        )
+    for tunnel_name, _, error in removed:
+        if error:
+            errors[tunnel_name].append(f"Tunnel {tunnel_name} could not be removed: {error}")
+            continue
+
+        rets[tunnel_name]["changes"]["tunnel"] = f"removed {tunnel_name}"
+
+    for tunnel_name in stale:
+        if rets[tunnel_name]["changes"]:
+            ret["changes"][tunnel_name] = rets[tunnel_name]["changes"]
+        if errors[tunnel_name]:
+            ret["result"] = False
+            comments.extend(f"{tunnel_name}: {error}" for error in errors[tunnel_name])
+        else:
+            _forget_fingerprint(tunnel_name)
+
+    return [tunnel_name for tunnel_name in stale if errors[tunnel_name]]
+
+
+def mod_aggregate(low, chunks, running):
+    """
+    Merge every ``cloudflare_tunnel.present`` state of the run into one reconciliation
+
+    Enabled by setting ``state_aggregate`` in the minion config, or ``aggregate: True`` on the
+    states. The first of them to run looks every tunnel up before anything is written, so each
+    zone is listed and read once, and sends the DNS changes of every tunnel in one batch per
+    zone. Each state still returns its own result. States applying a saved ``plan`` or asking
+    to ``repoint_dns`` are left out.
+    """
+    if low.get("fun") != "present" or low.get("plan") or low.get("repoint_dns"):
+        return low
+
+    states = {}
+    for chunk in chunks:
+        if chunk.get("state") != low["state"] or chunk.get("fun") != "present":
+            continue
+        if "__agg__" in chunk or chunk.get("plan") or chunk.get("repoint_dns"):
+            continue
+        if chunk["name"] in states:
+            continue
+        if salt.utils.state.gen_tag(chunk) in running:
+            continue
+
+        chunk["__agg__"] = True
+        states[chunk["name"]] = chunk.get("ingress")
+
+    if len(states) > 1:
+        __context__["cloudflare_tunnel.aggregate"] = states
+
+    return low
@@ -0,0 +1,133 @@
+"""
+Persistent cache of the Cloudflare inventory used by the cloudflare_tunnel modules
+
+Tunnels, zones and DNS records are stored in one msgpack file under the minion cachedir so
+that separate salt-call processes can reuse what an earlier one fetched. Every entry expires
+after the time to live of its kind of entity.
+"""
+import logging
+import os
+import time
+
+import salt.utils.files
+import salt.utils.msgpack
+
+log = logging.getLogger(__name__)
+
+# Default seconds an entry of each kind of entity stays valid
+DEFAULT_TTLS = {
+    "tunnels": 3600,
+    "zones": 86400,
+    "dns": 300,
+    "fingerprints": 3600,
+}
+
+CACHE_FILE = "inventory.msgpack"
+
+
+class InventoryCache:
+    """
+    msgpack file holding ``{entity: {key: [stored_at, value]}}``
+
+    Writers take an exclusive lock on a separate lock file, read the current content, change
+    it and replace the file atomically, so readers never see a partial file and concurrent
+    writers do not lose each other's entries.
+    """
+
+    def __init__(self, cachedir, ttls=None):
+        self.cachedir = cachedir
+        self.path = os.path.join(cachedir, CACHE_FILE)
+        self.lock_path = f"{self.path}.lock"
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.hits = 0
+        self.misses = 0
+
+    def _read(self):
+        try:
+            with salt.utils.files.fopen(self.path, "rb") as fh_:
+                return salt.utils.msgpack.unpackb(fh_.read(), raw=False) or {}
+        except FileNotFoundError:
+            return {}
+        except Exception as exc:  # pylint: disable=broad-except
+            # A cache that cannot be read is treated as empty, it is rewritten on the next set
+            log.warning("Ignoring unreadable Cloudflare cache %s: %s", self.path, exc)
+            return {}
+
+    def _write(self, data):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with salt.utils.files.fopen(tmp_path, "wb") as fh_:
+            fh_.write(salt.utils.msgpack.packb(data))
+        os.replace(tmp_path, self.path)
+
+    def _update(self, func):
+        os.makedirs(self.cachedir, exist_ok=True)
+        with salt.utils.files.flopen(self.lock_path, "a"):
+            data = self._read()
+            func(data)
+            self._write(data)
+
+    def get(self, entity, key):
+        """
+        Returns the cached value or ``None`` if it is missing or expired
+        """
+        entry = self._read().get(entity, {}).get(key)
+        if entry is None or time.time() - entry[0] > self.ttls.get(entity, 0):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return entry[1]
+
+    def set(self, entity, key, value):
+        """
+        Store a value
+        """
+        self._update(lambda data: data.setdefault(entity, {}).update({key: [time.time(), value]}))
+
+    def invalidate(self, entity, key=None):
+        """
+        Drop one entry, or every entry of the entity when no key is given
+        """
+
+        def _invalidate(data):
+            if key is None:
+                data.pop(entity, None)
+            else:
+                data.get(entity, {}).pop(key, None)
+
+        self._update(_invalidate)
+
+    def clear(self):
+        """
+        Remove every entry
+        """
+        self._update(lambda data: data.clear())
+
+    def stats(self):
+        """
+        Returns the number of live and expired entries of each entity, the file size and the
+        hits and misses of this instance
+        """
+        now = time.time()
+        entities = {}
+        for entity, entries in self._read().items():
+            ttl = self.ttls.get(entity, 0)
+            expired = sum(1 for stored_at, _ in entries.values() if now - stored_at > ttl)
+            entities[entity] = {
+                "entries": len(entries) - expired,
+                "expired": expired,
+                "ttl": ttl,
+            }
+
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+
+        return {
+            "path": self.path,
+            "size": size,
+            "entities": entities,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,179 @@
+"""
+Record and replay of the requests sent to the Cloudflare API
+
+A cassette is a JSON lines file holding one interaction per line: the request sent (method,
+endpoint, identifiers, query parameters and body), its result or the CloudFlare error it
+failed with, and the seconds it took. Tokens and tunnel secrets are redacted before anything
+is written, so a cassette recorded against a real account can be shared.
+
+When replaying, each request is answered from the interactions recorded for the same request,
+in the order they were recorded, the last one answering any further repeat. The recorded time
+of each interaction can be waited for, to reproduce the latency of the recorded account.
+"""
+import copy
+import logging
+import os
+import threading
+import time
+
+import salt.exceptions
+import salt.utils.files
+import salt.utils.json
+
+log = logging.getLogger(__name__)
+
+MODES = ("record", "replay")
+LATENCIES = ("recorded", "zero")
+
+REDACTED = "REDACTED"
+
+# Keys of request bodies and results whose values are secrets
+SECRET_KEYS = (
+    "api_key",
+    "api_token",
+    "credentials_file",
+    "secret",
+    "token",
+    "tunnel_secret",
+    "tunnelsecret",
+)
+
+# Endpoints whose whole result is a secret
+SECRET_ENDPOINTS = ("accounts/cfd_tunnel/token",)
+
+
+def redact(value):
+    """
+    Returns a copy of the value with the values of the secret keys replaced
+    """
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if str(key).lower() in SECRET_KEYS else redact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    return value
+
+
+def _request_key(method, endpoint, identifiers, params, data):
+    return salt.utils.json.dumps(
+        [method.upper(), endpoint, list(identifiers), redact(params or {}), redact(data)],
+        sort_keys=True,
+    )
+
+
+class Cassette:
+    """
+    Interactions of one cassette file
+
+    path
+        JSON lines file the interactions are appended to or replayed from
+
+    mode
+        ``record`` to send the requests and append them to the file, ``replay`` to answer them
+        from the file without reaching the API
+
+    latency
+        ``recorded`` to wait the recorded time of each replayed interaction, ``zero`` to answer
+        at once
+    """
+
+    def __init__(self, path, mode="replay", latency="recorded"):
+        if mode not in MODES:
+            raise salt.exceptions.ArgumentValueError(
+                f"Unknown cassette mode {mode}, use one of {', '.join(MODES)}"
+            )
+        if latency not in LATENCIES:
+            raise salt.exceptions.ArgumentValueError(
+                f"Unknown cassette latency {latency}, use one of {', '.join(LATENCIES)}"
+            )
+
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._interactions = {}
+        self._played = {}
+
+        if mode == "replay":
+            self._load()
+
+    def _load(self):
+        try:
+            with salt.utils.files.fopen(self.path, "r") as fh_:
+                lines = fh_.readlines()
+        except FileNotFoundError:
+            raise salt.exceptions.CommandExecutionError(f"Cassette {self.path} does not exist")
+
+        for line in lines:
+            if not line.strip():
+                continue
+            interaction = salt.utils.json.loads(line)
+            request = interaction["request"]
+            key = _request_key(
+                request["method"],
+                request["endpoint"],
+                request["identifiers"],
+                request["params"],
+                request["data"],
+            )
+            self._interactions.setdefault(key, []).append(interaction)
+
+        log.debug("Loaded %s interactions from cassette %s", len(lines), self.path)
+
+    def record(
+        self, method, endpoint, identifiers, params, data, duration, result=None, error=None
+    ):
+        """
+        Append an interaction to the cassette
+
+        error
+            ``(code, message)`` of the CloudFlare error the request failed with
+        """
+        if endpoint in SECRET_ENDPOINTS and result is not None:
+            result = REDACTED
+
+        interaction = {
+            "request": {
+                "method": method.upper(),
+                "endpoint": endpoint,
+                "identifiers": list(identifiers),
+                "params": redact(params or {}),
+                "data": redact(data),
+            },
+            "response": {
+                "result": redact(result),
+                "error": list(error) if error else None,
+            },
+            "duration": duration,
+        }
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._lock, salt.utils.files.flopen(self.path, "a") as fh_:
+            fh_.write(salt.utils.json.dumps(interaction) + "\n")
+
+    def play(self, method, endpoint, identifiers, params, data):
+        """
+        Returns the ``(result, error)`` recorded for the request, after its recorded time when
+        the latency is replayed
+        """
+        key = _request_key(method, endpoint, identifiers, params, data)
+        interactions = self._interactions.get(key)
+        if not interactions:
+            raise salt.exceptions.CommandExecutionError(
+                f"Cassette {self.path} has no interaction for {method.upper()} {endpoint} "
+                f"{list(identifiers)} {params or {}}"
+            )
+
+        with self._lock:
+            played = self._played.get(key, 0)
+            self._played[key] = played + 1
+        interaction = interactions[min(played, len(interactions) - 1)]
+
+        if self.latency == "recorded":
+            time.sleep(interaction["duration"])
+
+        response = interaction["response"]
+        error = tuple(response["error"]) if response["error"] else None
+        return copy.deepcopy(response["result"]), error
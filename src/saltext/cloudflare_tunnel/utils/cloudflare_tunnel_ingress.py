@@ -0,0 +1,135 @@
+"""
+Comparison of the ingress rules of a tunnel configuration
+
+Rules are reduced to a canonical form, so that spelling differences the connector ignores do
+not show as changes, and indexed by hostname and path. Comparing two lists of rules then takes
+one pass over each.
+"""
+import hashlib
+import urllib.parse
+
+import salt.utils.json
+
+# Rule the execution module appends to every configuration that does not have it
+CATCH_ALL_RULE = {"service": "http_status:404"}
+
+
+def _normalize_service(service):
+    service = str(service or "").strip()
+    parts = urllib.parse.urlsplit(service)
+    if not parts.netloc:
+        return service
+
+    return urllib.parse.urlunsplit(
+        (parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip("/"), parts.query, "")
+    )
+
+
+def _hash(value):
+    if not value:
+        return None
+    return hashlib.sha256(salt.utils.json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+
+def canonical_rule(rule):
+    """
+    Returns the canonical form of an ingress rule
+
+    The hostname is lowercased without its trailing dot, the scheme and host of the service are
+    lowercased without a trailing slash and ``originRequest`` is replaced by a hash of its
+    content, which does not depend on the order of its keys.
+    """
+    return (
+        str(rule.get("hostname") or "").strip().lower().rstrip("."),
+        str(rule.get("path") or "").strip(),
+        _normalize_service(rule.get("service")),
+        _hash(rule.get("originRequest")),
+    )
+
+
+def _index(rules):
+    """
+    Returns ``{(hostname, path, occurrence): (canonical rule, rule)}`` in the order of the rules
+
+    The connector routes a request to the first matching rule, rules repeating a hostname and
+    path are told apart by their occurrence.
+    """
+    index = {}
+    occurrences = {}
+    for rule in rules:
+        canonical = canonical_rule(rule)
+        occurrence = occurrences.get(canonical[:2], 0)
+        occurrences[canonical[:2]] = occurrence + 1
+        index[canonical[:2] + (occurrence,)] = (canonical, rule)
+
+    return index
+
+
+def diff_ingress(desired, current):
+    """
+    Compare the desired ingress rules with the current ones
+
+    Returns a dictionary of:
+
+    added
+        Desired rules whose hostname and path have no current rule
+    removed
+        Current rules whose hostname and path have no desired rule
+    modified
+        ``(current, desired)`` pairs of rules with the same hostname and path but another
+        service or ``originRequest``
+    reordered
+        Desired rules found in both lists that are not at the same place among them
+    stale_hostnames
+        Hostnames of the current rules that no desired rule serves anymore
+    """
+    desired_index = _index(desired)
+    current_index = _index(current)
+
+    added = []
+    modified = []
+    kept = []
+    for key, (canonical, rule) in desired_index.items():
+        existing = current_index.get(key)
+        if existing is None:
+            added.append(rule)
+            continue
+
+        kept.append(key)
+        if existing[0] != canonical:
+            modified.append((existing[1], rule))
+
+    removed = [rule for key, (_, rule) in current_index.items() if key not in desired_index]
+
+    # Rules found in both lists, compared in the order of each
+    kept_keys = set(kept)
+    current_order = [key for key in current_index if key in kept_keys]
+    reordered = [
+        desired_index[key][1] for key, previous in zip(kept, current_order) if key != previous
+    ]
+
+    desired_hostnames = {key[0] for key in desired_index}
+    stale_hostnames = list(
+        dict.fromkeys(
+            rule["hostname"]
+            for key, (_, rule) in current_index.items()
+            if key[0] and key[0] not in desired_hostnames
+        )
+    )
+
+    return {
+        "added": added,
+        "removed": removed,
+        "modified": modified,
+        "reordered": reordered,
+        "stale_hostnames": stale_hostnames,
+    }
+
+
+def with_catch_all(rules):
+    """
+    Returns the rules as the execution module writes them, ending with the catch-all rule
+    """
+    if CATCH_ALL_RULE in rules:
+        return list(rules)
+    return list(rules) + [CATCH_ALL_RULE]
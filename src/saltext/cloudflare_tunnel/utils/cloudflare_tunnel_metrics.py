@@ -0,0 +1,259 @@
+"""
+Metrics of the cloudflare_tunnel states, written for the node_exporter textfile collector
+
+Each minion process only sees its own API requests, so the counters of every run are added to a
+store under the minion cachedir and the textfile is rendered from the whole store. Prometheus
+can then read it without any listener on the minion.
+"""
+import contextlib
+import logging
+import os
+import threading
+import time
+
+import salt.utils.atomicfile
+import salt.utils.files
+import salt.utils.json
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod as cf_tunnel_utils
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_trace as cf_tunnel_trace
+
+log = logging.getLogger(__name__)
+
+METRIC_PREFIX = "cloudflare_tunnel"
+
+# Counters of the API requests this process already added to the store
+_EXPORTED_API = {}
+_EXPORT_LOCK = threading.Lock()
+
+
+def _api_call_count():
+    return sum(call["count"] for call in cf_tunnel_utils.api_stats().values())
+
+
+class StateRun:
+    """
+    Timings and counters of one ``present`` or ``absent`` run
+    """
+
+    def __init__(self, state, name):
+        self.state = state
+        self.name = name
+        self.result = False
+        self.phases = {}
+        self.current_phase = None
+        self.counters = {"ingress_rules_diffed": 0, "dns_records_changed": 0}
+        self._started = time.monotonic()
+        self._api_calls = _api_call_count()
+
+    @contextlib.contextmanager
+    def phase(self, phase):
+        """
+        Time a phase of the run, a phase entered several times adds up
+
+        The phase is also a span of the trace of the run, if one is active.
+        """
+        started = time.monotonic()
+        self.current_phase = phase
+        try:
+            with cf_tunnel_trace.span(phase):
+                yield
+        finally:
+            self.current_phase = None
+            self.phases[phase] = self.phases.get(phase, 0.0) + time.monotonic() - started
+
+    def count(self, counter, value=1):
+        """
+        Add to one of the run counters
+        """
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def to_dict(self):
+        """
+        Returns the metrics of the run, the API calls are those sent since it started
+        """
+        return {
+            "state": self.state,
+            "name": self.name,
+            "result": bool(self.result),
+            "duration": time.monotonic() - self._started,
+            "finished": time.time(),
+            "api_calls": _api_call_count() - self._api_calls,
+            "phases": dict(self.phases),
+            "counters": dict(self.counters),
+        }
+
+
+def _api_delta(current, exported):
+    """
+    Returns the API counters gathered since they were last exported
+
+    Counters lower than what was exported were reset, they are all new.
+    """
+    delta = {}
+    for key, call in current.items():
+        previous = exported.get(key)
+        if previous is None or call["count"] < previous["count"]:
+            previous = {}
+
+        if call["count"] == previous.get("count", 0):
+            continue
+
+        delta[key] = {
+            counter: call[counter] - previous.get(counter, 0)
+            for counter in ("count", "errors", "retries", "latency_sum")
+        }
+        delta[key]["histogram"] = {
+            bound: count - previous.get("histogram", {}).get(bound, 0)
+            for bound, count in call["histogram"].items()
+        }
+
+    return delta
+
+
+def _merge_api(store, delta):
+    for key, call in delta.items():
+        stored = store.setdefault(key, {"histogram": {}})
+        for counter, value in call.items():
+            if counter == "histogram":
+                for bound, count in value.items():
+                    stored["histogram"][bound] = stored["histogram"].get(bound, 0) + count
+            else:
+                stored[counter] = stored.get(counter, 0) + value
+
+
+def _labels(**labels):
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels.items()
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def render(store):
+    """
+    Returns the store in the Prometheus text exposition format
+    """
+    lines = []
+
+    def _metric(name, metric_type, help_text, samples):
+        if not samples:
+            return
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} {metric_type}")
+        lines.extend(f"{METRIC_PREFIX}_{sample} {value}" for sample, value in samples)
+
+    api = [
+        (_labels(method=key.split(" ", 1)[0], endpoint=key.split(" ", 1)[1]), call)
+        for key, call in sorted(store.get("api", {}).items())
+    ]
+    histogram = []
+    for labels, call in api:
+        histogram.extend(
+            (f'api_request_duration_seconds_bucket{labels[:-1]},le="{bound}"}}', count)
+            for bound, count in call["histogram"].items()
+        )
+        histogram.append((f"api_request_duration_seconds_sum{labels}", call["latency_sum"]))
+        histogram.append((f"api_request_duration_seconds_count{labels}", call["count"]))
+    _metric(
+        "api_request_duration_seconds",
+        "histogram",
+        "Latency of the requests sent to the Cloudflare API, retries included",
+        histogram,
+    )
+    for counter, help_text in (
+        ("errors", "Requests to the Cloudflare API that failed"),
+        ("retries", "Requests to the Cloudflare API that were sent again"),
+    ):
+        name = f"api_request_{counter}_total"
+        samples = [(name + labels, call[counter]) for labels, call in api]
+        _metric(name, "counter", help_text, samples)
+
+    runs = [run for _, run in sorted(store.get("states", {}).items())]
+    for name, help_text, value in (
+        ("state_duration_seconds", "Duration of the last run", lambda run: run["duration"]),
+        ("state_result", "1 if the last run succeeded", lambda run: int(run["result"])),
+        ("state_last_run_timestamp_seconds", "End of the last run", lambda run: run["finished"]),
+        (
+            "state_api_calls",
+            "Requests sent to the Cloudflare API by the last run",
+            lambda run: run["api_calls"],
+        ),
+        (
+            "state_ingress_rules_diffed",
+            "Ingress rules compared by the last run",
+            lambda run: run["counters"].get("ingress_rules_diffed", 0),
+        ),
+        (
+            "state_dns_records_changed",
+            "DNS records created, updated or removed by the last run",
+            lambda run: run["counters"].get("dns_records_changed", 0),
+        ),
+    ):
+        samples = [
+            (name + _labels(state=run["state"], name=run["name"]), value(run)) for run in runs
+        ]
+        _metric(name, "gauge", help_text, samples)
+
+    _metric(
+        "state_phase_duration_seconds",
+        "gauge",
+        "Duration of each phase of the last run",
+        [
+            (
+                "state_phase_duration_seconds"
+                + _labels(state=run["state"], name=run["name"], phase=phase),
+                duration,
+            )
+            for run in runs
+            for phase, duration in sorted(run["phases"].items())
+        ],
+    )
+
+    return "\n".join(lines) + "\n"
+
+
+class TextfileExporter:
+    """
+    Adds the metrics of a run to the store and writes the textfile atomically
+
+    path
+        File read by the node_exporter textfile collector, it must end with ``.prom``
+
+    store_path
+        JSON file holding the metrics of every process, locked while it is updated
+    """
+
+    def __init__(self, path, store_path):
+        self.path = path
+        self.store_path = store_path
+
+    def export(self, run):
+        """
+        Write the metrics of ``run`` and of the API requests sent since the last export
+        """
+        api = cf_tunnel_utils.api_stats()
+
+        with _EXPORT_LOCK:
+            os.makedirs(os.path.dirname(self.store_path), exist_ok=True)
+            with salt.utils.files.flopen(self.store_path, "a+") as fh_:
+                fh_.seek(0)
+                try:
+                    store = salt.utils.json.loads(fh_.read() or "{}")
+                except ValueError:
+                    log.warning("Starting over the unreadable metrics store %s", self.store_path)
+                    store = {}
+
+                _merge_api(store.setdefault("api", {}), _api_delta(api, _EXPORTED_API))
+                store.setdefault("states", {})[f"{run.state}:{run.name}"] = run.to_dict()
+
+                fh_.seek(0)
+                fh_.truncate()
+                fh_.write(salt.utils.json.dumps(store))
+
+                with salt.utils.atomicfile.atomic_open(self.path, "w") as prom:
+                    prom.write(render(store))
+                # The temporary file is private, node_exporter may run as another user
+                os.chmod(self.path, 0o644)
+
+            _EXPORTED_API.clear()
+            _EXPORTED_API.update(api)
@@ -4,14 +4,25 @@ Utility module for connecting to Cloudflare to manage Zero Trust Tunnels
 :depends: Cloudflare python module
 """
 import base64
+import bisect
+import contextlib
+import copy
+import hashlib
 import logging
 import random
 import string
+import threading
+import time
 
 import salt.exceptions
+import salt.utils.files
+import salt.utils.json
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_cassette as cf_tunnel_cassette
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_trace as cf_tunnel_trace
 
 try:
     import CloudFlare
+    import requests
 
     HAS_LIBS = True
 except ImportError:
@@ -21,6 +32,62 @@ log = logging.getLogger(__name__)
 
 __virtualname__ = "cloudflare_tunnel"
 
+# Idle clients older than this many seconds are dropped from the pool
+POOL_IDLE_TIMEOUT = 300
+
+# Maximum number of idle clients kept in the pool across all tokens and profiles
+POOL_MAX_SIZE = 16
+
+# Cloudflare allows this many requests per period (in seconds) for each user
+RATE_LIMIT_REQUESTS = 1200
+RATE_LIMIT_PERIOD = 300
+
+# Number of requests that can be sent at once before the rate limiter starts pacing them
+RATE_LIMIT_BURST = 100
+
+# Cloudflare error codes, and HTTP status codes, of requests that were throttled
+THROTTLED_CODES = (429, 971, 1015)
+
+# Number of times a request is sent before a retryable error is returned
+RETRY_ATTEMPTS = 5
+
+# Seconds the first retry waits at most, doubled for every following retry up to the maximum
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30
+
+# Seconds after which a request is not retried anymore, counted from the first attempt
+RETRY_DEADLINE = 120
+
+# Number of zones requested per page when listing the zones of an account (API maximum)
+ZONES_PER_PAGE = 50
+
+# Number of tunnels requested per page when listing the tunnels of an account (API maximum)
+TUNNELS_PER_PAGE = 1000
+
+# Number of DNS records requested per page when listing a zone (API maximum)
+DNS_RECORDS_PER_PAGE = 5000000
+
+# Record types that route a hostname, a CNAME record cannot be created next to any of them
+ROUTING_RECORD_TYPES = ("A", "AAAA", "CNAME")
+
+# Maximum number of record changes sent in one request to the batch DNS endpoint
+DNS_BATCH_SIZE = 200
+
+# Seconds a zone index is used before it is rebuilt from the API
+ZONE_INDEX_TTL = 3600
+
+# A lookup that misses rebuilds the zone index only if it is older than this many seconds
+ZONE_INDEX_MISS_REFRESH = 10
+
+# Upper bounds in seconds of the buckets of the API latency histograms
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Profile settings that are passed through to the CloudFlare client constructor
+CLIENT_OPTIONS = {
+    "base_url": "base_url",
+    "request_timeout": "global_request_timeout",
+}
+
 
 def __virtual__():
     """
@@ -50,15 +117,33 @@ def _generate_secret():
     return base64_string
 
 
-def _get_client(api_token):
+def _client_options(profile):
+    """
+    Returns the CloudFlare client keyword arguments set in the profile
+
+    profile
+        Cloudflare configuration profile (the ``cloudflare`` config dictionary)
+    """
+    if not profile:
+        return {}
+
+    return {
+        kwarg: profile[option] for option, kwarg in CLIENT_OPTIONS.items() if option in profile
+    }
+
+
+def _get_client(api_token, profile=None):
     """
     Creates a cloudflare object to use for connecting to the api
 
     api_token
         Cloudflare API token that has permissions to edit cloudflare tunnels
+
+    profile
+        Cloudflare configuration profile, used for the client options
     """
     try:
-        client = CloudFlare.CloudFlare(token=api_token)
+        client = CloudFlare.CloudFlare(token=api_token, **_client_options(profile))
     except CloudFlare.exceptions.CloudFlareAPIError as exc:
         log.exception(exc)
         raise salt.exceptions.CommandExecutionError(exc)
@@ -66,7 +151,687 @@ def _get_client(api_token):
     return client
 
 
-def get_zone_id(api_token, domain_name):
+class ClientPool:
+    """
+    Per-process registry of Cloudflare clients keyed by API token and profile options
+
+    Each client keeps its HTTP session, and therefore its keep-alive connections, open
+    between calls. A client is checked out by one caller at a time so it is never shared
+    between threads. Clients idle for longer than ``idle_timeout`` are dropped, and no more
+    than ``max_size`` idle clients are kept, the least recently used going first.
+    """
+
+    def __init__(self, max_size=POOL_MAX_SIZE, idle_timeout=POOL_IDLE_TIMEOUT):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        # (key, client, released_at) tuples, least recently released first
+        self._idle = []
+        self._counters = {"created": 0, "reused": 0, "evicted": 0}
+
+    @staticmethod
+    def _key(api_token, profile):
+        return (api_token, tuple(sorted(_client_options(profile).items())))
+
+    def _evict_expired(self, now):
+        expired = 0
+        while self._idle and now - self._idle[0][2] > self.idle_timeout:
+            self._idle.pop(0)
+            expired += 1
+        self._counters["evicted"] += expired
+
+    def acquire(self, api_token, profile=None):
+        """
+        Check out a client for the token, creating one if none is idle
+        """
+        key = self._key(api_token, profile)
+
+        with self._lock:
+            self._evict_expired(time.monotonic())
+            for idx in range(len(self._idle) - 1, -1, -1):
+                if self._idle[idx][0] == key:
+                    client = self._idle.pop(idx)[1]
+                    self._counters["reused"] += 1
+                    return client
+
+        client = _get_client(api_token, profile)
+
+        with self._lock:
+            self._counters["created"] += 1
+
+        return client
+
+    def release(self, api_token, client, profile=None):
+        """
+        Return a client to the pool so later calls can reuse its connections
+        """
+        key = self._key(api_token, profile)
+
+        with self._lock:
+            now = time.monotonic()
+            self._evict_expired(now)
+            self._idle.append((key, client, now))
+            while len(self._idle) > self.max_size:
+                self._idle.pop(0)
+                self._counters["evicted"] += 1
+
+    @contextlib.contextmanager
+    def client(self, api_token, profile=None):
+        """
+        Context manager checking a client out of the pool for the duration of the block
+        """
+        client = self.acquire(api_token, profile)
+        try:
+            yield client
+        finally:
+            self.release(api_token, client, profile)
+
+    def stats(self):
+        """
+        Returns the pool counters
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats["idle"] = len(self._idle)
+
+        return stats
+
+    def clear(self):
+        """
+        Drop all idle clients and reset the counters
+        """
+        with self._lock:
+            self._idle = []
+            self._counters = {"created": 0, "reused": 0, "evicted": 0}
+
+
+_CLIENT_POOL = ClientPool()
+
+
+class TokenBucket:
+    """
+    Token bucket pacing the requests sent with one API token
+
+    The bucket holds up to ``burst`` tokens and is refilled so that no more than ``requests``
+    are sent in any ``period``. Every request takes a token. When none is left the caller is
+    given a place in the queue and sleeps until its token is due, instead of the request being
+    rejected by Cloudflare.
+
+    With a ``state_file`` the bucket is kept in that file, under an exclusive lock, so every
+    process on the minion that uses the same file shares it.
+    """
+
+    def __init__(
+        self,
+        requests=RATE_LIMIT_REQUESTS,
+        period=RATE_LIMIT_PERIOD,
+        burst=RATE_LIMIT_BURST,
+        state_file=None,
+        key=None,
+    ):
+        self.capacity = max(1, min(burst, requests))
+        # The burst is taken out of the refill so a full period never exceeds the limit
+        self.rate = max(requests - self.capacity, 1) / period
+        self.state_file = state_file
+        self.key = key or ""
+        self._lock = threading.Lock()
+        self._tokens = float(self.capacity)
+        self._updated = time.time()
+        self._counters = {"requests": 0, "delayed": 0, "wait_total": 0.0, "wait_max": 0.0}
+
+    def _reserve(self, tokens, updated, now):
+        """
+        Take a token and return the new bucket state and how long to wait for the token
+        """
+        tokens = min(self.capacity, tokens + max(0.0, now - updated) * self.rate) - 1
+        wait = -tokens / self.rate if tokens < 0 else 0.0
+
+        return tokens, now, wait
+
+    def _reserve_shared(self, now):
+        with salt.utils.files.flopen(self.state_file, "a+") as fh_:
+            fh_.seek(0)
+            try:
+                buckets = salt.utils.json.loads(fh_.read() or "{}")
+            except ValueError:
+                buckets = {}
+
+            tokens, updated = buckets.get(self.key, (self.capacity, now))
+            tokens, updated, wait = self._reserve(tokens, updated, now)
+            buckets[self.key] = (tokens, updated)
+
+            fh_.seek(0)
+            fh_.truncate()
+            fh_.write(salt.utils.json.dumps(buckets))
+
+        return wait
+
+    def acquire(self):
+        """
+        Wait for a token, returns the number of seconds spent waiting
+        """
+        with self._lock:
+            now = time.time()
+            if self.state_file:
+                wait = self._reserve_shared(now)
+            else:
+                self._tokens, self._updated, wait = self._reserve(self._tokens, self._updated, now)
+
+            self._counters["requests"] += 1
+            if wait:
+                self._counters["delayed"] += 1
+                self._counters["wait_total"] += wait
+                self._counters["wait_max"] = max(self._counters["wait_max"], wait)
+
+        if wait:
+            time.sleep(wait)
+
+        return wait
+
+    def stats(self):
+        """
+        Returns the number of requests, how many were delayed and the seconds they waited
+        """
+        with self._lock:
+            return dict(self._counters)
+
+
+_RATE_LIMITERS = {}
+_RATE_LIMITERS_LOCK = threading.Lock()
+
+
+def _rate_limiter(api_token, profile=None):
+    """
+    Returns the token bucket for the API token, or ``None`` when rate limiting is disabled
+
+    api_token
+        Cloudflare API token that has permissions to edit cloudflare tunnels
+
+    profile
+        Cloudflare configuration profile, the ``rate_limit``, ``rate_limit_period``,
+        ``rate_limit_burst`` and ``rate_limit_file`` settings configure the bucket
+    """
+    profile = profile or {}
+    requests = profile.get("rate_limit", RATE_LIMIT_REQUESTS)
+    if not requests:
+        return None
+
+    settings = (
+        requests,
+        profile.get("rate_limit_period", RATE_LIMIT_PERIOD),
+        profile.get("rate_limit_burst", RATE_LIMIT_BURST),
+        profile.get("rate_limit_file"),
+    )
+    # The token is only kept in memory, the shared state file is keyed by its digest
+    key = hashlib.sha256(api_token.encode()).hexdigest()[:16] if api_token else ""
+
+    with _RATE_LIMITERS_LOCK:
+        bucket = _RATE_LIMITERS.get((api_token, settings))
+        if bucket is None:
+            bucket = TokenBucket(*settings, key=key)
+            _RATE_LIMITERS[(api_token, settings)] = bucket
+
+    return bucket
+
+
+def _error_code(exc):
+    """
+    Returns the CloudFlare error code of a failed request, or its HTTP status when the
+    CloudFlare module raised the ``requests`` error of a response without a JSON body
+    """
+    if isinstance(exc, requests.exceptions.HTTPError):
+        return exc.response.status_code if exc.response is not None else 0
+    return int(exc)
+
+
+class RetryPolicy:
+    """
+    Decides whether a failed request is sent again and how long to wait before it
+
+    Throttled requests (429) are retried for every method. Server errors (5xx) and connection
+    failures are retried for GET, PUT and DELETE only, since a POST that failed that way may
+    have been applied. Validation and authentication errors are never retried.
+
+    The wait is drawn uniformly between zero and an exponentially growing cap (full jitter), so
+    minions that failed together do not retry together.
+    """
+
+    def __init__(
+        self,
+        attempts=RETRY_ATTEMPTS,
+        base_delay=RETRY_BASE_DELAY,
+        max_delay=RETRY_MAX_DELAY,
+        deadline=RETRY_DEADLINE,
+    ):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    @classmethod
+    def from_profile(cls, profile):
+        """
+        Build the policy from the ``retry_*`` settings of the profile
+        """
+        profile = profile or {}
+
+        return cls(
+            attempts=profile.get("retry_attempts", RETRY_ATTEMPTS),
+            base_delay=profile.get("retry_base_delay", RETRY_BASE_DELAY),
+            max_delay=profile.get("retry_max_delay", RETRY_MAX_DELAY),
+            deadline=profile.get("retry_deadline", RETRY_DEADLINE),
+        )
+
+    @staticmethod
+    def is_retryable(exc, method):
+        """
+        Returns ``True`` if the request that raised the CloudFlare or HTTP error can be sent again
+        """
+        code = _error_code(exc)
+        if code in THROTTLED_CODES:
+            return True
+
+        if method.upper() == "POST":
+            return False
+
+        if 500 <= code <= 599:
+            return True
+
+        # The CloudFlare module reports network failures with code 0
+        message = str(exc).lower()
+        return code == 0 and ("connection" in message or "timeout" in message)
+
+    def delay(self, exc, method, attempt, elapsed):
+        """
+        Returns the seconds to wait before sending the request again or ``None`` to give up
+
+        exc
+            CloudFlare or HTTP error raised by the request
+
+        method
+            HTTP method of the request
+
+        attempt
+            Number of retries already made
+
+        elapsed
+            Seconds since the first attempt
+        """
+        if attempt + 1 >= self.attempts or not self.is_retryable(exc, method):
+            return None
+
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        if elapsed + delay > self.deadline:
+            return None
+
+        return delay
+
+
+class SingleFlight:
+    """
+    Coalesces identical requests that are in flight at the same time
+
+    The first caller for a key sends the request, callers arriving with the same key while it
+    is running wait for it and get a copy of its response, or its error, instead of sending
+    the request again. Every caller gets its own copy, so changing one does not change the
+    others.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._counters = {"hits": 0, "misses": 0}
+
+    def do(self, key, func):
+        """
+        Call ``func`` unless a call for ``key`` is already running, then share its outcome
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {"done": threading.Event(), "result": None, "error": None, "waiters": 0}
+                self._calls[key] = call
+                self._counters["misses"] += 1
+            else:
+                call["waiters"] += 1
+                self._counters["hits"] += 1
+
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return copy.deepcopy(call["result"])
+
+        result = None
+        try:
+            result = func()
+            return result
+        except Exception as exc:
+            call["error"] = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                waiters = call["waiters"]
+            # The waiting callers copy a response the caller of the leader cannot change
+            if waiters and call["error"] is None:
+                call["result"] = copy.deepcopy(result)
+            call["done"].set()
+
+    def stats(self):
+        """
+        Returns the number of calls that shared a running request (hits) and that sent one
+        """
+        with self._lock:
+            return dict(self._counters)
+
+
+_SINGLE_FLIGHT = SingleFlight()
+
+
+class ApiMetrics:
+    """
+    Counts the requests sent to the API, their errors, retries and latency per HTTP method and
+    endpoint
+
+    Recording a request costs one lock and a bisect of the bucket bounds, so the metrics are
+    always collected.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def record(self, method, endpoint, duration, retries=0, error=False):
+        """
+        Add one request, ``duration`` covers every attempt and the waits between them
+        """
+        index = bisect.bisect_left(self.buckets, duration)
+
+        with self._lock:
+            call = self._calls.get((method, endpoint))
+            if call is None:
+                call = self._calls[(method, endpoint)] = {
+                    "count": 0,
+                    "errors": 0,
+                    "retries": 0,
+                    "latency_sum": 0.0,
+                    "latency_max": 0.0,
+                    "buckets": [0] * (len(self.buckets) + 1),
+                }
+
+            call["count"] += 1
+            call["errors"] += bool(error)
+            call["retries"] += retries
+            call["latency_sum"] += duration
+            call["latency_max"] = max(call["latency_max"], duration)
+            call["buckets"][index] += 1
+
+    def stats(self):
+        """
+        Returns the counters keyed by ``"<method> <endpoint>"``, the ``histogram`` maps each
+        bucket bound to the number of requests that took at most that long
+        """
+        with self._lock:
+            calls = {
+                key: dict(call, buckets=list(call["buckets"])) for key, call in self._calls.items()
+            }
+
+        stats = {}
+        for (method, endpoint), call in sorted(calls.items()):
+            histogram = {}
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), call.pop("buckets")):
+                total += count
+                histogram[str(bound)] = total
+
+            stats[f"{method} {endpoint}"] = dict(call, histogram=histogram)
+
+        return stats
+
+    def reset(self):
+        """
+        Set every counter back to zero
+        """
+        with self._lock:
+            self._calls.clear()
+
+
+_API_METRICS = ApiMetrics()
+
+# Cassettes keyed by path, mode and latency
+_CASSETTES = {}
+_CASSETTES_LOCK = threading.Lock()
+
+
+def api_stats(reset=False):
+    """
+    Returns the counters and latency histograms of the requests sent by this process
+
+    reset
+        Set the counters back to zero once they are read
+    """
+    stats = _API_METRICS.stats()
+    if reset:
+        _API_METRICS.reset()
+
+    return stats
+
+
+def client_stats():
+    """
+    Returns the counters of the client pool, the rate limiters and the request coalescing for
+    this process
+
+    ``pool.reused`` is the number of calls that were served by a client, and its open
+    connections, from an earlier call. ``rate_limit`` sums the counters of every token bucket.
+    ``single_flight.hits`` is the number of GET requests that shared an identical request
+    already in flight.
+    """
+    rate_limit = {"requests": 0, "delayed": 0, "wait_total": 0.0, "wait_max": 0.0}
+
+    with _RATE_LIMITERS_LOCK:
+        buckets = list(_RATE_LIMITERS.values())
+
+    for bucket in buckets:
+        for counter, value in bucket.stats().items():
+            if counter == "wait_max":
+                rate_limit[counter] = max(rate_limit[counter], value)
+            else:
+                rate_limit[counter] += value
+
+    return {
+        "pool": _CLIENT_POOL.stats(),
+        "rate_limit": rate_limit,
+        "single_flight": _SINGLE_FLIGHT.stats(),
+    }
+
+
+def _endpoint(client, endpoint):
+    """
+    Returns the client object for a slash separated endpoint path
+
+    Endpoints the installed CloudFlare module does not know about yet are registered on the
+    client, the way the module itself adds them.
+    """
+    parts = endpoint.split("/")
+    api = client
+    for depth, attr in enumerate(parts):
+        if not hasattr(api, attr):
+            client.add("AUTH", *parts[: depth + 1])
+        api = getattr(api, attr)
+
+    return api
+
+
+def _request(api_token, method, endpoint, *identifiers, profile=None, params=None, data=None):
+    """
+    Sends a request to the Cloudflare API using a pooled client
+
+    Identical GET requests running at the same time are sent once and share the response.
+
+    api_token
+        Cloudflare API token that has permissions to edit cloudflare tunnels
+
+    method
+        HTTP method (GET, POST, PUT, DELETE)
+
+    endpoint
+        API endpoint as a slash separated path of client attributes (zones/dns_records)
+
+    identifiers
+        Identifiers for the endpoint, in the order the client expects them
+
+    profile
+        Cloudflare configuration profile, used for the client options
+
+    params
+        Query string parameters
+
+    data
+        Request body
+    """
+    if method.upper() == "GET":
+        key = (
+            api_token,
+            tuple(sorted(_client_options(profile).items())),
+            endpoint,
+            identifiers,
+            tuple(sorted((params or {}).items())),
+        )
+        return _SINGLE_FLIGHT.do(
+            key,
+            lambda: _send(api_token, method, endpoint, identifiers, profile, params, data),
+        )
+
+    return _send(api_token, method, endpoint, identifiers, profile, params, data)
+
+
+def _cassette(profile):
+    """
+    Returns the cassette set in the profile, or ``None`` when requests go to the API directly
+
+    profile
+        Cloudflare configuration profile, the ``cassette``, ``cassette_mode`` and
+        ``cassette_latency`` settings select the cassette
+    """
+    path = (profile or {}).get("cassette")
+    if not path:
+        return None
+
+    settings = (
+        path,
+        profile.get("cassette_mode", "replay"),
+        profile.get("cassette_latency", "recorded"),
+    )
+    with _CASSETTES_LOCK:
+        cassette = _CASSETTES.get(settings)
+        if cassette is None:
+            cassette = cf_tunnel_cassette.Cassette(*settings)
+            _CASSETTES[settings] = cassette
+
+    return cassette
+
+
+def _transport(api_token, method, endpoint, identifiers, profile, params, data):
+    """
+    Sends one attempt of a request with a pooled client, or answers it from the cassette of
+    the profile when it is replayed
+    """
+    cassette = _cassette(profile)
+    if cassette and cassette.mode == "replay":
+        result, error = cassette.play(method, endpoint, identifiers, params, data)
+        if error:
+            raise CloudFlare.exceptions.CloudFlareAPIError(code=error[0], message=error[1])
+        return result
+
+    started = time.monotonic()
+    try:
+        with _CLIENT_POOL.client(api_token, profile) as client:
+            api = _endpoint(client, endpoint)
+            result = getattr(api, method.lower())(*identifiers, params=params, data=data)
+    except (CloudFlare.exceptions.CloudFlareAPIError, requests.exceptions.HTTPError) as exc:
+        if cassette:
+            cassette.record(
+                method,
+                endpoint,
+                identifiers,
+                params,
+                data,
+                time.monotonic() - started,
+                error=(_error_code(exc), str(exc)),
+            )
+        raise
+
+    if cassette:
+        cassette.record(
+            method, endpoint, identifiers, params, data, time.monotonic() - started, result=result
+        )
+    return result
+
+
+def _send(api_token, method, endpoint, identifiers, profile, params, data):
+    """
+    Sends a request, pacing it with the rate limiter and retrying it when the error allows
+    """
+    cassette = _cassette(profile)
+    # A replayed request does not reach the API, it does not count against the rate limit
+    bucket = None if cassette and cassette.mode == "replay" else _rate_limiter(api_token, profile)
+    policy = RetryPolicy.from_profile(profile)
+    started = time.monotonic()
+    attempt = 0
+    error = True
+    status = None
+
+    try:
+        while True:
+            if bucket:
+                wait = bucket.acquire()
+                if wait:
+                    log.debug("%s %s waited %.3fs for the rate limiter", method, endpoint, wait)
+
+            try:
+                result = _transport(api_token, method, endpoint, identifiers, profile, params, data)
+                error = False
+                status = 200
+                return result
+            except (CloudFlare.exceptions.CloudFlareAPIError, requests.exceptions.HTTPError) as exc:
+                status = _error_code(exc)
+                delay = policy.delay(exc, method, attempt, time.monotonic() - started)
+                if delay is None:
+                    log.exception(exc)
+                    raise salt.exceptions.CommandExecutionError(exc)
+
+                log.warning(
+                    "%s %s failed with %s (%s), retrying in %.2fs",
+                    method,
+                    endpoint,
+                    status,
+                    exc,
+                    delay,
+                )
+
+            time.sleep(delay)
+            attempt += 1
+    finally:
+        duration = time.monotonic() - started
+        _API_METRICS.record(method, endpoint, duration, attempt, error)
+        cf_tunnel_trace.add_span(
+            f"{method} {endpoint}",
+            duration,
+            status="error" if error else "ok",
+            attributes={
+                "method": method,
+                "endpoint": endpoint,
+                "status_code": status,
+                "retries": attempt,
+            },
+        )
+
+
+def get_zone_id(api_token, domain_name, profile=None):
     """
     Gets the zone for the specified domain name
 
@@ -75,19 +840,161 @@ def get_zone_id(api_token, domain_name):
 
     domain_name
         domain name to get zone for (something.example.com)
+
+    profile
+        Cloudflare configuration profile, used for the client options
     """
-    client = _get_client(api_token)
+    return _request(api_token, "GET", "zones", profile=profile, params={"name": domain_name})
 
-    try:
-        zone = client.zones.get(params={"name": domain_name})
-    except CloudFlare.exceptions.CloudFlareAPIError as exc:
-        log.exception(exc)
-        raise salt.exceptions.CommandExecutionError(exc)
+
+def list_zones(api_token, account=None, profile=None):
+    """
+    List every zone the token can see, following the pagination
+
+    api_token
+        Cloudflare API token that has permissions to edit cloudflare tunnels
+
+    account
+        Cloudflare Account ID, only zones of this account are listed when supplied
+
+    profile
+        Cloudflare configuration profile, used for the client options
+    """
+    params = {"page": 1, "per_page": ZONES_PER_PAGE}
+    if account:
+        params["account.id"] = account
+
+    zones = []
+    while True:
+        page = _request(api_token, "GET", "zones", profile=profile, params=dict(params))
+        zones.extend(page)
+        if len(page) < ZONES_PER_PAGE:
+            break
+        params["page"] += 1
+
+    return zones
+
+
+class ZoneIndex:
+    """
+    Zones stored in a trie keyed by their labels in reverse order
+
+    ``sub.example.co.uk`` is stored under ``uk -> co -> example -> sub`` so the zone for a
+    hostname is found by walking its labels from the right and keeping the deepest zone seen,
+    which is the longest matching suffix. Delegated subzones therefore win over their parent.
+    """
+
+    def __init__(self, zones=()):
+        self.built_at = time.monotonic()
+        self.size = 0
+        self._root = {"zone": None, "children": {}}
+
+        for zone in zones:
+            self.add(zone)
+
+    @staticmethod
+    def _labels(name):
+        return reversed(name.rstrip(".").lower().split("."))
+
+    def age(self):
+        """
+        Seconds since the index was built
+        """
+        return time.monotonic() - self.built_at
+
+    def add(self, zone):
+        """
+        Add a zone as returned by the API
+        """
+        node = self._root
+        for label in self._labels(zone["name"]):
+            node = node["children"].setdefault(label, {"zone": None, "children": {}})
+
+        if node["zone"] is None:
+            self.size += 1
+        node["zone"] = zone
+
+    def lookup(self, hostname):
+        """
+        Returns the zone with the longest suffix matching the hostname or ``None``
+        """
+        node = self._root
+        match = None
+        for label in self._labels(hostname):
+            node = node["children"].get(label)
+            if node is None:
+                break
+            if node["zone"] is not None:
+                match = node["zone"]
+
+        return match
+
+
+_ZONE_INDEXES = {}
+_ZONE_INDEXES_LOCK = threading.Lock()
+
+
+def get_zone_index(api_token, account=None, profile=None, refresh=False):
+    """
+    Returns the zone index of the account, building it if it is missing or expired
+
+    api_token
+        Cloudflare API token that has permissions to edit cloudflare tunnels
+
+    account
+        Cloudflare Account ID
+
+    profile
+        Cloudflare configuration profile, ``zone_index_ttl`` overrides the index lifetime
+
+    refresh
+        Rebuild the index even if it has not expired
+    """
+    key = (api_token, account)
+    ttl = (profile or {}).get("zone_index_ttl", ZONE_INDEX_TTL)
+
+    with _ZONE_INDEXES_LOCK:
+        index = _ZONE_INDEXES.get(key)
+
+    if refresh or index is None or index.age() > ttl:
+        index = ZoneIndex(list_zones(api_token, account, profile=profile))
+        log.debug("Built Cloudflare zone index with %s zones", index.size)
+
+        with _ZONE_INDEXES_LOCK:
+            _ZONE_INDEXES[key] = index
+
+    return index
+
+
+def find_zone(api_token, hostname, account=None, profile=None):
+    """
+    Find the zone a hostname belongs to by longest suffix match
+
+    A miss rebuilds the index once, so zones added since it was built are found.
+
+    api_token
+        Cloudflare API token that has permissions to edit cloudflare tunnels
+
+    hostname
+        DNS record name (something.example.com)
+
+    account
+        Cloudflare Account ID
+
+    profile
+        Cloudflare configuration profile, used for the client options
+    """
+    index = get_zone_index(api_token, account, profile=profile)
+    zone = index.lookup(hostname)
+
+    if zone is None and index.age() > ZONE_INDEX_MISS_REFRESH:
+        index = get_zone_index(api_token, account, profile=profile, refresh=True)
+        zone = index.lookup(hostname)
 
     return zone
 
 
-def get_tunnel_token(api_token, account, tunnel_id):
+def get_tunnel_token(api_token, account, tunnel_id, profile=None):
     """
     Gets the token used to associate cloudflared with a specific tunnel
 
@@ -99,19 +1006,16 @@ def get_tunnel_token(api_token, account, tunnel_id):
 
     tunnel_id
         ID of the tunnel
-    """
-    client = _get_client(api_token)
 
-    try:
-        token = client.accounts.cfd_tunnel.token.get(account, tunnel_id)
-    except CloudFlare.exceptions.CloudFlareAPIError as exc:
-        log.exception(exc)
-        raise salt.exceptions.CommandExecutionError(exc)
-
-    return token
+    profile
+        Cloudflare configuration profile, used for the client options
+    """
+    return _request(
+        api_token, "GET", "accounts/cfd_tunnel/token", account, tunnel_id, profile=profile
+    )
 
 
-def get_tunnel(api_token, account, tunnel_name):
+def get_tunnel(api_token, account, tunnel_name, profile=None):
     """
     Get a tunnel by name
 
@@ -123,21 +1027,49 @@ def get_tunnel(api_token, account, tunnel_name):
 
     tunnel_name
         Name for the new tunnel
+
+    profile
+        Cloudflare configuration profile, used for the client options
     """
-    client = _get_client(api_token)
+    return _request(
+        api_token,
+        "GET",
+        "accounts/cfd_tunnel",
+        account,
+        profile=profile,
+        params={"name": tunnel_name, "is_deleted": "false"},
+    )
 
-    try:
-        tunnel = client.accounts.cfd_tunnel.get(
-            account, params={"name": tunnel_name, "is_deleted": "false"}
+
+def list_tunnels(api_token, account, profile=None):
+    """
+    List every tunnel of the account that is not deleted, following the pagination
+
+    api_token
+        Cloudflare API token that has permissions to edit cloudflare tunnels
+
+    account
+        Cloudflare Account ID
+
+    profile
+        Cloudflare configuration profile, used for the client options
+    """
+    params = {"is_deleted": "false", "page": 1, "per_page": TUNNELS_PER_PAGE}
+
+    tunnels = []
+    while True:
+        page = _request(
+            api_token, "GET", "accounts/cfd_tunnel", account, profile=profile, params=dict(params)
         )
-    except CloudFlare.exceptions.CloudFlareAPIError as exc:
-        log.exception(exc)
-        raise salt.exceptions.CommandExecutionError(exc)
+        tunnels.extend(page)
+        if len(page) < TUNNELS_PER_PAGE:
+            break
+        params["page"] += 1
 
-    return tunnel
+    return tunnels
 
 
-def create_tunnel(api_token, account, tunnel_name):
+def create_tunnel(api_token, account, tunnel_name, profile=None):
     """
     Create a new tunnel
 
@@ -149,26 +1081,25 @@ def create_tunnel(api_token, account, tunnel_name):
 
     tunnel_name
         Name for the new tunnel
-    """
-    client = _get_client(api_token)
 
-    try:
-        tunnel = client.accounts.cfd_tunnel.post(
-            account,
-            data={
-                "name": tunnel_name,
-                "tunnel_secret": _generate_secret(),
-                "config_src": "cloudflare",
-            },
-        )
-    except CloudFlare.exceptions.CloudFlareAPIError as exc:
-        log.exception(exc)
-        raise salt.exceptions.CommandExecutionError(exc)
-
-    return tunnel
+    profile
+        Cloudflare configuration profile, used for the client options
+    """
+    return _request(
+        api_token,
+        "POST",
+        "accounts/cfd_tunnel",
+        account,
+        profile=profile,
+        data={
+            "name": tunnel_name,
+            "tunnel_secret": _generate_secret(),
+            "config_src": "cloudflare",
+        },
+    )
 
 
-def remove_tunnel(api_token, account, tunnel_id):
+def remove_tunnel(api_token, account, tunnel_id, profile=None):
     """
     Remove tunnel for the given tunnel_id
 
@@ -180,19 +1111,14 @@ def remove_tunnel(api_token, account, tunnel_id):
 
     tunnel_id
         ID of the tunnel
-    """
-    client = _get_client(api_token)
-
-    try:
-        tunnel = client.accounts.cfd_tunnel.delete(account, tunnel_id)
-    except CloudFlare.exceptions.CloudFlareAPIError as exc:
-        log.exception(exc)
-        raise salt.exceptions.CommandExecutionError(exc)
 
-    return tunnel
+    profile
+        Cloudflare configuration profile, used for the client options
+    """
+    return _request(api_token, "DELETE", "accounts/cfd_tunnel", account, tunnel_id, profile=profile)
 
 
-def get_dns(api_token, zone_id, dns_name):
+def get_dns(api_token, zone_id, dns_name, profile=None):
     """
     Get dns entry details
 
@@ -204,19 +1130,99 @@ def get_dns(api_token, zone_id, dns_name):
 
     dns_name
         DNS record name (something.example.com)
+
+    profile
+        Cloudflare configuration profile, used for the client options
     """
-    client = _get_client(api_token)
+    return _request(
+        api_token, "GET", "zones/dns_records", zone_id, profile=profile, params={"name": dns_name}
+    )
 
-    try:
-        dns = client.zones.dns_records.get(zone_id, params={"name": dns_name})
-    except CloudFlare.exceptions.CloudFlareAPIError as exc:
-        log.exception(exc)
-        raise salt.exceptions.CommandExecutionError(exc)
 
-    return dns
+def list_dns(api_token, zone_id, record_type="CNAME", profile=None):
+    """
+    List every DNS record of a type in a zone, following the pagination
 
+    api_token
+        Cloudflare API token that has permissions to edit cloudflare tunnels
+
+    zone_id
+        Cloudflare Zone ID
+
+    record_type
+        Only records of this type are listed, ``None`` lists all of them
+
+    profile
+        Cloudflare configuration profile, used for the client options
+    """
+    params = {"page": 1, "per_page": DNS_RECORDS_PER_PAGE}
+    if record_type:
+        params["type"] = record_type
+
+    records = []
+    while True:
+        page = _request(
+            api_token, "GET", "zones/dns_records", zone_id, profile=profile, params=dict(params)
+        )
+        records.extend(page)
+        if len(page) < DNS_RECORDS_PER_PAGE:
+            break
+        params["page"] += 1
+
+    return records
+
+
+def get_dns_snapshot(api_token, zone_id, record_types=ROUTING_RECORD_TYPES, profile=None):
+    """
+    Get the DNS records of a zone keyed by lower case record name
+
+    The whole zone is read with as few requests as the pagination allows, so looking up many
+    hostnames in the same zone costs one listing instead of one request per hostname.
+
+    api_token
+        Cloudflare API token that has permissions to edit cloudflare tunnels
+
+    zone_id
+        Cloudflare Zone ID
+
+    record_types
+        Only records of these types are included, ``None`` includes all of them. A single type
+        is filtered by the API, several are filtered from the listing of the whole zone
 
-def create_dns(api_token, zone_id, dns_data, dns_id=None):
+    profile
+        Cloudflare configuration profile, used for the client options
+    """
+    record_type = record_types[0] if record_types and len(record_types) == 1 else None
+
+    snapshot = {}
+    for record in list_dns(api_token, zone_id, record_type, profile=profile):
+        if record_types is None or record["type"] in record_types:
+            # A name holds either one CNAME record or its A and AAAA records, one is enough
+            snapshot.setdefault(record["name"].lower(), record)
+    return snapshot
+
+
+def tunnel_dns_record(hostname, tunnel_id):
+    """
+    Returns the CNAME record routing a hostname to a tunnel
+
+    hostname
+        DNS record name
+
+    tunnel_id
+        tunnel uuid
+    """
+    return {
+        "name": hostname,
+        "type": "CNAME",
+        "content": f"{tunnel_id}.cfargotunnel.com",
+        "ttl": 1,
+        "proxied": True,
+        "comment": "DNS managed by SaltStack",
+    }
+
+
+def create_dns(api_token, zone_id, dns_data, dns_id=None, profile=None):
     """
     Create a cloudflare dns entry
 
@@ -242,22 +1248,52 @@ def create_dns(api_token, zone_id, dns_data, dns_id=None):
     dns_id
         ID of the DNS entry to remove
         This argument is optional. If supplied then it will edit a dns entry
+
+    profile
+        Cloudflare configuration profile, used for the client options
     """
-    client = _get_client(api_token)
+    if dns_id:
+        return _request(
+            api_token, "PUT", "zones/dns_records", zone_id, dns_id, profile=profile, data=dns_data
+        )
 
-    try:
-        if dns_id:
-            dns = client.zones.dns_records.put(zone_id, dns_id, data=dns_data)
-        else:
-            dns = client.zones.dns_records.post(zone_id, data=dns_data)
-    except CloudFlare.exceptions.CloudFlareAPIError as exc:
-        log.exception(exc)
-        raise salt.exceptions.CommandExecutionError(exc)
+    return _request(api_token, "POST", "zones/dns_records", zone_id, profile=profile, data=dns_data)
 
-    return dns
 
+def batch_dns(api_token, zone_id, deletes=None, puts=None, posts=None, profile=None):
+    """
+    Apply several DNS record changes to a zone in one request
+
+    Cloudflare applies the deletes, then the puts, then the posts, and applies either all of
+    them or none of them.
+    See: https://developers.cloudflare.com/api/operations/dns-records-for-a-zone-batch-dns-records
 
-def remove_dns(api_token, zone_id, dns_id):
+    api_token
+        Cloudflare API token that has permissions to edit cloudflare tunnels
+
+    zone_id
+        Cloudflare Zone ID
+
+    deletes
+        List of ``{"id": ""}`` dictionaries of the records to remove
+
+    puts
+        List of complete records, including their ``id``, to overwrite
+
+    posts
+        List of records to create
+
+    profile
+        Cloudflare configuration profile, used for the client options
+    """
+    data = {"deletes": deletes or [], "puts": puts or [], "posts": posts or []}
+
+    return _request(
+        api_token, "POST", "zones/dns_records/batch", zone_id, profile=profile, data=data
+    )
+
+
+def remove_dns(api_token, zone_id, dns_id, profile=None):
     """
     Remove a cloudflare dns entry
 
@@ -269,19 +1305,14 @@ def remove_dns(api_token, zone_id, dns_id):
 
     dns_id
         ID of the DNS entry to remove
-    """
-    client = _get_client(api_token)
-
-    try:
-        dns = client.zones.dns_records.delete(zone_id, dns_id)
-    except CloudFlare.exceptions.CloudFlareAPIError as exc:
-        log.exception(exc)
-        raise salt.exceptions.CommandExecutionError(exc)
 
-    return dns
+    profile
+        Cloudflare configuration profile, used for the client options
+    """
+    return _request(api_token, "DELETE", "zones/dns_records", zone_id, dns_id, profile=profile)
 
 
-def get_tunnel_config(api_token, account, tunnel_id):
+def get_tunnel_config(api_token, account, tunnel_id, profile=None):
     """
     Get the config for the given tunnel_id
 
@@ -293,19 +1324,16 @@ def get_tunnel_config(api_token, account, tunnel_id):
 
     tunnel_id
         ID of the Cloudflare tunnel
-    """
-    client = _get_client(api_token)
-
-    try:
-        tunnel_config = client.accounts.cfd_tunnel.configurations.get(account, tunnel_id)
-    except CloudFlare.exceptions.CloudFlareAPIError as exc:
-        log.exception(exc)
-        raise salt.exceptions.CommandExecutionError(exc)
 
-    return tunnel_config
+    profile
+        Cloudflare configuration profile, used for the client options
+    """
+    return _request(
+        api_token, "GET", "accounts/cfd_tunnel/configurations", account, tunnel_id, profile=profile
+    )
 
 
-def create_tunnel_config(api_token, account, tunnel_id, config):
+def create_tunnel_config(api_token, account, tunnel_id, config, profile=None):
     """
     Create a Cloudflare Tunnel configuration for the given tunnel_id
 
@@ -321,15 +1349,16 @@ def create_tunnel_config(api_token, account, tunnel_id, config):
     config
         The tunnel configuration and ingress rules in JSON format
         See: https://api.cloudflare.com/#cloudflare-tunnel-configuration-properties
-    """
-    client = _get_client(api_token)
 
-    try:
-        tunnel_config = client.accounts.cfd_tunnel.configurations.put(
-            account, tunnel_id, data=config
-        )
-    except CloudFlare.exceptions.CloudFlareAPIError as exc:
-        log.exception(exc)
-        raise salt.exceptions.CommandExecutionError(exc)
-
-    return tunnel_config
+    profile
+        Cloudflare configuration profile, used for the client options
+    """
+    return _request(
+        api_token,
+        "PUT",
+        "accounts/cfd_tunnel/configurations",
+        account,
+        tunnel_id,
+        profile=profile,
+        data=config,
+    )
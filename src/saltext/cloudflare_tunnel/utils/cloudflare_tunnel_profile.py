@@ -0,0 +1,148 @@
+"""
+Profiling of the cloudflare_tunnel states
+
+The state function runs under cProfile while a sampler thread records the stacks of every
+thread running code of this extension, so that the calls sent from the worker threads are
+included. The samples are written in the collapsed stack format read by flame graph tools, each
+one under the phase of the run it was taken in and labelled ``api-bound`` when the thread was
+sending a request to the Cloudflare API or ``cpu-bound`` otherwise.
+"""
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
+
+import salt.utils.files
+import saltext.cloudflare_tunnel
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod as cf_tunnel_utils
+
+log = logging.getLogger(__name__)
+
+# Seconds between two samples of the thread stacks
+SAMPLE_INTERVAL = 0.005
+
+API_BOUND = "api-bound"
+CPU_BOUND = "cpu-bound"
+
+# Every request to the Cloudflare API is sent from this function
+_SEND_CODE = cf_tunnel_utils._send.__code__  # pylint: disable=protected-access
+
+_PACKAGE_ROOT = str(saltext.cloudflare_tunnel.PACKAGE_ROOT)
+
+
+def _safe_name(name):
+    return "".join(char if char.isalnum() or char in "-_." else "_" for char in name)
+
+
+def _frame_name(code):
+    filename = code.co_filename
+    if filename.startswith(_PACKAGE_ROOT):
+        filename = os.path.relpath(filename, _PACKAGE_ROOT)
+    else:
+        filename = os.path.basename(filename)
+
+    return f"{filename}:{code.co_name}"
+
+
+class StateProfiler:
+    """
+    Profile a state run, used as a context manager around the state function
+
+    run
+        ``StateRun`` of the state, its current phase is the parent of the samples
+
+    directory
+        Directory the ``.pstats`` and ``.collapsed`` files are written to
+    """
+
+    def __init__(self, run, directory, interval=SAMPLE_INTERVAL):
+        self.run = run
+        self.interval = interval
+        prefix = os.path.join(
+            directory, f"{run.state}-{_safe_name(run.name)}-{time.strftime('%Y%m%dT%H%M%S')}"
+        )
+        self.pstats_path = f"{prefix}.pstats"
+        self.collapsed_path = f"{prefix}.collapsed"
+        self.samples = {}
+        self._profile = cProfile.Profile()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(
+            target=self._sample_loop, name="cloudflare-tunnel-profiler", daemon=True
+        )
+
+    def __enter__(self):
+        self._sampler.start()
+        self._profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._profile.disable()
+        self._stop.set()
+        self._sampler.join()
+        self.write()
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        """
+        Record the stack of every thread running code of this extension
+        """
+        phase = self.run.current_phase or "other"
+        root = f"{self.run.state}({_safe_name(self.run.name)})"
+
+        for thread_id, frame in sys._current_frames().items():  # pylint: disable=protected-access
+            if thread_id == threading.get_ident():
+                continue
+
+            codes = []
+            while frame is not None:
+                codes.append(frame.f_code)
+                frame = frame.f_back
+            codes.reverse()
+
+            # The stack starts at the outermost frame of this extension
+            start = next(
+                (
+                    index
+                    for index, code in enumerate(codes)
+                    if code.co_filename.startswith(_PACKAGE_ROOT)
+                ),
+                None,
+            )
+            if start is None:
+                continue
+
+            label = API_BOUND if _SEND_CODE in codes else CPU_BOUND
+            stack = ";".join([root, phase, label] + [_frame_name(code) for code in codes[start:]])
+            self.samples[stack] = self.samples.get(stack, 0) + 1
+
+    def phases(self):
+        """
+        Returns the label of each phase, from the label most of its samples got
+        """
+        counts = {}
+        for stack, count in self.samples.items():
+            _, phase, label = stack.split(";", 3)[:3]
+            counts.setdefault(phase, {API_BOUND: 0, CPU_BOUND: 0})[label] += count
+
+        return {
+            phase: API_BOUND if labels[API_BOUND] >= labels[CPU_BOUND] else CPU_BOUND
+            for phase, labels in counts.items()
+        }
+
+    def write(self):
+        """
+        Write the cProfile dump and the collapsed stacks
+        """
+        os.makedirs(os.path.dirname(self.pstats_path), exist_ok=True)
+        self._profile.dump_stats(self.pstats_path)
+
+        with salt.utils.files.fopen(self.collapsed_path, "w") as fh_:
+            for stack, count in sorted(self.samples.items()):
+                fh_.write(f"{stack} {count}\n")
+
+        log.info("Profile of %s %s written to %s", self.run.state, self.run.name, self.pstats_path)
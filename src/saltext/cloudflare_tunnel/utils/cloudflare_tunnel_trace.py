@@ -0,0 +1,194 @@
+"""
+Tracing of the cloudflare_tunnel states
+
+A trace has a root span for the state run, a child span for each of its phases and a leaf span
+for each request sent to the Cloudflare API. The current span is held in a context variable, so
+the requests sent from the worker threads of a state, which run in a copy of its context, are
+attached to the phase that started them. Spans are only created while a trace is active.
+
+Finished traces are handed to an exporter, any object with an ``export(spans)`` method taking a
+list of span dictionaries shaped after OpenTelemetry spans.
+"""
+import contextlib
+import contextvars
+import importlib
+import logging
+import os
+import threading
+import time
+import uuid
+
+import salt.utils.files
+import salt.utils.json
+
+log = logging.getLogger(__name__)
+
+_CURRENT_SPAN = contextvars.ContextVar("cloudflare_tunnel_span", default=None)
+
+
+class Span:
+    """
+    Operation of a trace, timed from its creation to ``end``
+    """
+
+    def __init__(self, trace, name, parent=None, attributes=None):
+        self.trace = trace
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.status = "ok"
+        self.start_time = time.time()
+        self.duration = None
+        self._started = time.monotonic()
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self, duration=None):
+        """
+        Close the span and add it to its trace
+        """
+        self.duration = time.monotonic() - self._started if duration is None else duration
+        self.trace.add(self)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "end_time": self.start_time + self.duration,
+            "duration": self.duration,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class Trace:
+    """
+    Spans of one state run, collected from every thread
+    """
+
+    def __init__(self, exporter):
+        self.trace_id = uuid.uuid4().hex
+        self.exporter = exporter
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def export(self):
+        with self._lock:
+            spans = [span.to_dict() for span in self.spans]
+        self.exporter.export(spans)
+
+
+class JsonlFileExporter:
+    """
+    Appends one JSON line per span to a file, locked so that several processes can share it
+
+    path
+        File the spans are written to
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, spans):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with salt.utils.files.flopen(self.path, "a") as fh_:
+            for span in spans:
+                fh_.write(salt.utils.json.dumps(span) + "\n")
+
+
+class InMemoryExporter:
+    """
+    Keeps the spans of every exported trace in ``spans``
+    """
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+
+def load_exporter(exporter, path):
+    """
+    Returns the exporter named in the configuration
+
+    exporter
+        ``jsonl`` for the JSONL file exporter, or the dotted path of an exporter class that is
+        created without arguments
+
+    path
+        File written by the JSONL file exporter
+    """
+    if exporter in (True, "jsonl"):
+        return JsonlFileExporter(path)
+
+    module, _, name = exporter.rpartition(".")
+    return getattr(importlib.import_module(module), name)()
+
+
+@contextlib.contextmanager
+def trace(name, exporter, attributes=None):
+    """
+    Start a trace whose root span covers the block, it is exported once the block ends
+
+    An exporter that fails is logged, it does not change the outcome of the block.
+    """
+    root = Span(Trace(exporter), name, attributes=attributes)
+    token = _CURRENT_SPAN.set(root)
+    try:
+        yield root
+    except BaseException:
+        root.status = "error"
+        raise
+    finally:
+        _CURRENT_SPAN.reset(token)
+        root.end()
+        try:
+            root.trace.export()
+        except Exception as exc:  # pylint: disable=broad-except
+            log.warning("Could not export the trace of %s: %s", name, exc)
+
+
+@contextlib.contextmanager
+def span(name, attributes=None):
+    """
+    Child span of the current span covering the block, nothing is recorded outside a trace
+    """
+    parent = _CURRENT_SPAN.get()
+    if parent is None:
+        yield None
+        return
+
+    child = Span(parent.trace, name, parent, attributes)
+    token = _CURRENT_SPAN.set(child)
+    try:
+        yield child
+    except BaseException:
+        child.status = "error"
+        raise
+    finally:
+        _CURRENT_SPAN.reset(token)
+        child.end()
+
+
+def add_span(name, duration, status="ok", attributes=None):
+    """
+    Record an operation that already finished as a leaf of the current span
+    """
+    parent = _CURRENT_SPAN.get()
+    if parent is None:
+        return
+
+    leaf = Span(parent.trace, name, parent, attributes)
+    leaf.start_time -= duration
+    leaf.status = status
+    leaf.end(duration)
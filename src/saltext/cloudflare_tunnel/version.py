@@ -0,0 +1 @@
+__version__ = "0.1.dev26+g5f3cd8319.d20261017"
\ No newline at end of file
@@ -0,0 +1,124 @@
+"""
+Benchmark harness
+
+Each measurement records the wall time, the number of requests sent to the Cloudflare API and
+the peak memory allocated by Python while it ran. Memory is traced during the whole measurement,
+so the wall times include the overhead of ``tracemalloc`` and are only comparable with results
+recorded the same way. The emulator runs in a child process so its own work is not measured.
+
+The results are written to ``--benchmark-results`` and compared with ``baseline.json``. A result
+above its baseline by more than the tolerance of the metric fails the benchmark. Run with
+``--benchmark-update-baseline`` to store new results as the baseline.
+"""
+import pathlib
+import platform
+import time
+import tracemalloc
+
+import pytest
+import salt.utils.json
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod as cf_tunnel_utils
+from tests.support.cloudflare_emulator import emulator_process
+
+BASELINE = pathlib.Path(__file__).resolve().parent / "baseline.json"
+
+# Ratio of a result to its baseline above which it is reported as a regression. The API call
+# count does not depend on the machine, the wall time and memory do.
+TOLERANCE = {
+    "api_calls": 1.1,
+    "wall_time": 3.0,
+    "peak_memory": 1.5,
+}
+
+
+def _api_calls():
+    return sum(call["count"] for call in cf_tunnel_utils.api_stats().values())
+
+
+class BenchmarkRecorder:
+    """
+    Measures functions and compares the results with the baseline
+    """
+
+    def __init__(self, baseline):
+        self.baseline = baseline
+        self.results = {}
+
+    def measure(self, key, func, **info):
+        """
+        Call ``func`` and record its cost under ``key``, returns what ``func`` returned
+        """
+        api_calls = _api_calls()
+        tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            ret = func()
+        finally:
+            wall_time = time.perf_counter() - started
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        self.results[key] = dict(
+            info,
+            wall_time=round(wall_time, 4),
+            api_calls=_api_calls() - api_calls,
+            peak_memory=peak_memory,
+        )
+        return ret
+
+    def regressions(self, key):
+        """
+        Returns a message for each metric of ``key`` that regressed from the baseline
+        """
+        baseline = self.baseline.get(key)
+        if not baseline:
+            return []
+
+        return [
+            f"{key}: {metric} {self.results[key][metric]} exceeds the baseline {baseline[metric]}"
+            f" by more than {tolerance}x"
+            for metric, tolerance in TOLERANCE.items()
+            if self.results[key][metric] > baseline[metric] * tolerance
+        ]
+
+
+@pytest.fixture(autouse=True)
+def _require_benchmarks(request):
+    if not request.config.getoption("--run-benchmarks"):
+        pytest.skip("Benchmarks only run with --run-benchmarks")
+
+
+@pytest.fixture(scope="session")
+def benchmark_recorder(request):
+    baseline = {}
+    if BASELINE.exists():
+        baseline = salt.utils.json.loads(BASELINE.read_text())["results"]
+
+    recorder = BenchmarkRecorder(baseline)
+    yield recorder
+
+    if not recorder.results:
+        return
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": recorder.results,
+    }
+    results = pathlib.Path(request.config.getoption("--benchmark-results"))
+    results.parent.mkdir(parents=True, exist_ok=True)
+    results.write_text(salt.utils.json.dumps(report, indent=2, sort_keys=True) + "\n")
+
+    if request.config.getoption("--benchmark-update-baseline"):
+        report["results"] = dict(baseline, **recorder.results)
+        BASELINE.write_text(salt.utils.json.dumps(report, indent=2, sort_keys=True) + "\n")
+
+
+@pytest.fixture
+def emulator(request):
+    """
+    Base URL and account of an emulator running in a child process, holding the zones listed in
+    the ``ZONES`` attribute of the test module
+    """
+    with emulator_process(getattr(request.module, "ZONES", ())) as (base_url, account):
+        yield base_url, account
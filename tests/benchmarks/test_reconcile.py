@@ -0,0 +1,70 @@
+"""
+Cost of reconciling a tunnel against the number of ingress rules
+
+Every size runs the scenarios in order on a fresh emulator: creating everything, a run with
+nothing to change, a run where 10% of the hostnames changed and the removal of the tunnel. Each
+scenario starts with an empty ``__context__``, like a new ``salt-call``.
+"""
+import copy
+
+import pytest
+import saltext.cloudflare_tunnel.modules.cloudflare_tunnel_mod as cloudflare_tunnel_module
+import saltext.cloudflare_tunnel.states.cloudflare_tunnel_mod as cloudflare_tunnel_state
+from tests.support.loader import emulator_profile
+from tests.support.loader import loader_modules
+
+SIZES = (1, 10, 100, 1000, 5000)
+
+ZONES = tuple(f"zone{index}.example" for index in range(5))
+
+
+@pytest.fixture
+def configure_loader_modules(emulator, tmp_path):
+    return loader_modules(emulator_profile(*emulator), str(tmp_path))
+
+
+def _ingress(size, changed=0):
+    """
+    Returns ``size`` rules spread over the zones, the hostnames of the first ``changed`` ones
+    are renamed
+    """
+    rules = [
+        {
+            "hostname": f"host{index}{'-changed' if index < changed else ''}."
+            + ZONES[index % len(ZONES)],
+            "service": f"http://127.0.0.1:{8000 + index % 1000}",
+        }
+        for index in range(size)
+    ]
+    rules.append({"service": "http_status:404"})
+    return rules
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_reconcile(benchmark_recorder, size):
+    scenarios = [
+        ("present", "all-new", _ingress(size)),
+        ("present", "no-op", _ingress(size)),
+        ("present", "10%-changed", _ingress(size, changed=max(1, size // 10))),
+        ("absent", "teardown", None),
+    ]
+
+    regressions = []
+    for state, scenario, ingress in scenarios:
+        cloudflare_tunnel_module.__context__.clear()
+        if state == "present":
+            func = lambda: cloudflare_tunnel_state.present(  # pylint: disable=cell-var-from-loop
+                "benchmark", copy.deepcopy(ingress)
+            )
+        else:
+            func = lambda: cloudflare_tunnel_state.absent("benchmark")
+
+        key = f"{state}-{scenario}-{size}"
+        ret = benchmark_recorder.measure(key, func, state=state, scenario=scenario, rules=size)
+
+        assert ret["result"] is True, ret["comment"]
+        if scenario == "no-op":
+            assert ret["changes"] == {}
+        regressions.extend(benchmark_recorder.regressions(key))
+
+    assert not regressions, "\n".join(regressions)
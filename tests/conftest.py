@@ -1,8 +1,33 @@
 import os
+import pathlib
 
 import pytest
 from saltext.cloudflare_tunnel import PACKAGE_ROOT
 from saltfactories.utils import random_string
+from tests.support.cloudflare_emulator import CloudflareEmulator
+
+ARTIFACTS_DIR = pathlib.Path(__file__).resolve().parent.parent / "artifacts"
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmarks")
+    group.addoption(
+        "--run-benchmarks",
+        action="store_true",
+        default=False,
+        help="Run the benchmarks in tests/benchmarks, they are skipped otherwise",
+    )
+    group.addoption(
+        "--benchmark-results",
+        default=str(ARTIFACTS_DIR / "benchmark-results.json"),
+        help="File the benchmark results are written to",
+    )
+    group.addoption(
+        "--benchmark-update-baseline",
+        action="store_true",
+        default=False,
+        help="Store the benchmark results as the new baseline instead of comparing them to it",
+    )
 
 
 @pytest.fixture(scope="session")
@@ -26,3 +51,12 @@ def master(salt_factories):
 @pytest.fixture(scope="package")
 def minion(master):
     return master.get_salt_minion_daemon(random_string("minion-"))
+
+
+@pytest.fixture
+def cloudflare_emulator():
+    """
+    Local emulator of the Cloudflare API, see ``tests.support.cloudflare_emulator``
+    """
+    with CloudflareEmulator() as emulator:
+        yield emulator
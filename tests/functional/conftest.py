@@ -0,0 +1,7 @@
+import pytest
+from tests.support.loader import emulator_profile
+
+
+@pytest.fixture
+def cloudflare_profile(cloudflare_emulator):
+    return emulator_profile(cloudflare_emulator.base_url, cloudflare_emulator.account)
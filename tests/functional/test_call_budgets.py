@@ -0,0 +1,173 @@
+"""
+Number of requests the states send to the Cloudflare API, depending on the size of the ingress
+"""
+import pytest
+import saltext.cloudflare_tunnel.modules.cloudflare_tunnel_mod as cloudflare_tunnel_module
+import saltext.cloudflare_tunnel.states.cloudflare_tunnel_mod as cloudflare_tunnel_state
+from tests.support.call_recorder import CallRecorder
+from tests.support.loader import loader_modules
+
+ZONES = ("example.com", "example.org", "example.net")
+
+# Tunnel and tunnel configuration lookups
+TUNNEL_REQUESTS = 2
+
+
+def _ingress(size):
+    rules = [
+        {"hostname": f"app{index}.{ZONES[index % len(ZONES)]}", "service": "http://127.0.0.1:80"}
+        for index in range(size)
+    ]
+    return rules + [{"service": "http_status:404"}]
+
+
+@pytest.fixture
+def configure_loader_modules(cloudflare_profile, tmp_path):
+    return loader_modules(cloudflare_profile, str(tmp_path))
+
+
+@pytest.fixture
+def zones(cloudflare_emulator):
+    return [cloudflare_emulator.add_zone(zone) for zone in ZONES]
+
+
+def _record(func, *args):
+    cloudflare_tunnel_module.__context__.clear()
+    with CallRecorder(cloudflare_tunnel_state.__salt__) as recorder:
+        ret = func(*args)
+    assert ret["result"] is True, ret["comment"]
+    return recorder
+
+
+@pytest.mark.parametrize("size", [1, 10, 60])
+def test_present_no_changes_scales_with_zones(zones, size):
+    cloudflare_tunnel_state.present("blog", _ingress(size))
+
+    recorder = _record(cloudflare_tunnel_state.present, "blog", _ingress(size))
+
+    # Zones are listed at most once and each zone is read with one request
+    assert recorder.count() <= TUNNEL_REQUESTS + 1 + len(zones), recorder.tree()
+    assert recorder.count(method="GET", endpoint="zones") <= 1, recorder.tree()
+    assert recorder.count(endpoint="zones/dns_records") == min(size, len(zones)), recorder.tree()
+    assert recorder.count(method="GET", endpoint="zones/dns_records") == recorder.count(
+        endpoint="zones/dns_records"
+    )
+    assert recorder.duplicates() == {}
+
+
+def test_present_no_changes_independent_of_hostnames(zones):  # pylint: disable=unused-argument
+    counts = []
+    for size in (10, 100):
+        cloudflare_tunnel_state.present(f"blog{size}", _ingress(size))
+        counts.append(_record(cloudflare_tunnel_state.present, f"blog{size}", _ingress(size)))
+
+    # The lookups run concurrently, only the requests sent matter and not their order
+    assert sorted(counts[0].sequence()) == sorted(counts[1].sequence())
+
+
+def test_present_new_tunnel(zones):
+    size = 30
+
+    recorder = _record(cloudflare_tunnel_state.present, "blog", _ingress(size))
+
+    assert recorder.count(method="POST", endpoint="accounts/cfd_tunnel") == 1
+    assert recorder.count(method="PUT", endpoint="accounts/cfd_tunnel/configurations") == 1
+    assert recorder.count(method="GET", endpoint="zones") <= 1
+    # Each new hostname is looked up and created, nothing else grows with the ingress
+    assert recorder.count(function="cloudflare_tunnel.create_dns") <= 2 * size, recorder.tree()
+    # Tunnel creation and configuration write, zone listing and one snapshot per zone
+    fixed = TUNNEL_REQUESTS + 2 + 1 + len(zones)
+    assert recorder.count() <= 2 * size + fixed, recorder.tree()
+
+
+def test_absent(zones):
+    size = 30
+    cloudflare_tunnel_state.present("blog", _ingress(size))
+
+    recorder = _record(cloudflare_tunnel_state.absent, "blog")
+
+    assert recorder.count(method="DELETE", endpoint="zones/dns_records") == size
+    assert recorder.count(method="DELETE", endpoint="accounts/cfd_tunnel") == 1
+    # Records are removed by id, without looking each one up again
+    assert recorder.count(method="GET", endpoint="zones/dns_records") == len(zones)
+    # Tunnel removal, zone listing and one snapshot per zone
+    fixed = TUNNEL_REQUESTS + 1 + 1 + len(zones)
+    assert recorder.count() <= size + fixed, recorder.tree()
+
+
+def test_get_dns_snapshot_one_request_per_zone(zones):
+    hostnames = [rule["hostname"] for rule in _ingress(50)[:-1]]
+    cloudflare_tunnel_module.__context__.clear()
+
+    with CallRecorder() as recorder:
+        cloudflare_tunnel_module.get_dns_snapshot(hostnames)
+
+    assert recorder.count(method="GET", endpoint="zones/dns_records") == len(zones)
+    assert [call["name"] for call in recorder.calls if call["parent"] is None].count(
+        "get_dns_snapshot"
+    ) == len(zones)
+
+
+@pytest.mark.usefixtures("zones")
+def test_present_fingerprint_one_request(cloudflare_profile):
+    cloudflare_profile["fingerprint"] = True
+    cloudflare_tunnel_state.present("blog", _ingress(60))
+
+    recorder = _record(cloudflare_tunnel_state.present, "blog", _ingress(60))
+
+    assert recorder.sequence() == ["GET accounts/cfd_tunnel/configurations"]
+
+
+def test_present_aggregated_scales_with_zones(zones):
+    count = 20
+    chunks = [
+        {
+            "state": "cloudflare_tunnel",
+            "__id__": f"tunnel{index}",
+            "name": f"tunnel{index}",
+            "fun": "present",
+            "ingress": [
+                {"hostname": f"t{index}.{zone}", "service": "http://127.0.0.1:80"} for zone in ZONES
+            ],
+        }
+        for index in range(count)
+    ]
+    cloudflare_tunnel_module.__context__.clear()
+
+    with CallRecorder(cloudflare_tunnel_state.__salt__) as recorder:
+        cloudflare_tunnel_state.mod_aggregate(chunks[0], chunks, {})
+        rets = [
+            cloudflare_tunnel_state.present(chunk["name"], chunk["ingress"]) for chunk in chunks
+        ]
+
+    assert [ret["result"] for ret in rets] == [True] * count
+    assert [len(ret["changes"]) for ret in rets] == [2 + len(ZONES)] * count
+    # Each zone is read once and changed with one batch, whatever the number of states
+    assert recorder.count(method="GET", endpoint="zones") <= 1, recorder.tree()
+    assert recorder.count(method="GET", endpoint="zones/dns_records") == len(zones)
+    assert recorder.count(method="POST", endpoint="zones/dns_records/batch") == len(zones)
+    assert recorder.count(method="POST", endpoint="zones/dns_records") == 0
+
+
+def test_managed_scales_with_zones(zones):
+    count = 30
+    tunnels = {
+        f"tunnel{index}": [
+            {"hostname": f"t{index}.{zone}", "service": "http://127.0.0.1:80"} for zone in ZONES
+        ]
+        for index in range(count)
+    }
+
+    recorder = _record(cloudflare_tunnel_state.managed, "web", tunnels)
+
+    # One listing instead of one lookup per tunnel, each zone read once and changed in one batch
+    assert recorder.count(method="GET", endpoint="accounts/cfd_tunnel") == 1, recorder.tree()
+    assert recorder.count(method="GET", endpoint="zones/dns_records") == len(zones)
+    assert recorder.count(method="POST", endpoint="zones/dns_records/batch") == len(zones)
+    assert recorder.count(method="POST", endpoint="accounts/cfd_tunnel") == count
+
+    recorder = _record(cloudflare_tunnel_state.managed, "web", tunnels)
+
+    # Listing, zones, one snapshot per zone and the configuration of each tunnel
+    assert recorder.count() <= 1 + 1 + len(zones) + count, recorder.tree()
+    assert recorder.duplicates() == {}
@@ -0,0 +1,48 @@
+import pytest
+import saltext.cloudflare_tunnel.modules.cloudflare_tunnel_mod as cloudflare_tunnel_module
+import saltext.cloudflare_tunnel.states.cloudflare_tunnel_mod as cloudflare_tunnel_state
+from tests.support.loader import loader_modules
+
+ingress = [
+    {"hostname": "app.example.com", "service": "http://127.0.0.1:8000"},
+    {"hostname": "www.example.org", "service": "http://127.0.0.1:8081"},
+    {"service": "http_status:404"},
+]
+
+
+@pytest.fixture
+def configure_loader_modules(cloudflare_profile, tmp_path):
+    return loader_modules(cloudflare_profile, str(tmp_path))
+
+
+def _run_states():
+    rets = []
+    for func, args in (
+        (cloudflare_tunnel_state.present, ("blog", [dict(rule) for rule in ingress])),
+        (cloudflare_tunnel_state.present, ("blog", [dict(rule) for rule in ingress])),
+        (cloudflare_tunnel_state.absent, ("blog",)),
+    ):
+        cloudflare_tunnel_module.__context__.clear()
+        ret = func(*args)
+        rets.append((ret["result"], ret["changes"]))
+    return rets
+
+
+def test_replay_without_api(cloudflare_emulator, cloudflare_profile, tmp_path):
+    cloudflare_emulator.add_zone("example.com")
+    cloudflare_emulator.add_zone("example.org")
+    cassette = str(tmp_path / "cassette.jsonl")
+
+    cloudflare_profile.update(cassette=cassette, cassette_mode="record")
+    recorded = _run_states()
+    sent = len(cloudflare_emulator.requests)
+
+    cloudflare_emulator.stop()
+    cloudflare_profile.update(cassette_mode="replay", cassette_latency="zero")
+    replayed = _run_states()
+
+    assert [result for result, _ in recorded] == [True, True, True]
+    assert replayed == recorded
+    assert len(cloudflare_emulator.requests) == sent
+    with open(cassette, encoding="utf-8") as fh_:
+        assert cloudflare_profile["api_token"] not in fh_.read()
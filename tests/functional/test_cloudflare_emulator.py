@@ -0,0 +1,288 @@
+from unittest.mock import patch
+
+import pytest
+import salt.exceptions
+import saltext.cloudflare_tunnel.modules.cloudflare_tunnel_mod as cloudflare_tunnel_module
+import saltext.cloudflare_tunnel.states.cloudflare_tunnel_mod as cloudflare_tunnel_state
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod as cf_tunnel_utils
+from tests.support.cloudflare_emulator import CloudflareEmulator
+from tests.support.loader import loader_modules
+
+ingress = [
+    {"hostname": "app.example.com", "service": "http://127.0.0.1:8000"},
+    {"hostname": "api.example.com", "service": "http://127.0.0.1:8080"},
+    {"hostname": "www.example.org", "service": "http://127.0.0.1:8081"},
+]
+
+
+@pytest.fixture
+def configure_loader_modules(cloudflare_profile, tmp_path):
+    return loader_modules(cloudflare_profile, str(tmp_path))
+
+
+@pytest.fixture
+def zones(cloudflare_emulator):
+    return [
+        cloudflare_emulator.add_zone("example.com"),
+        cloudflare_emulator.add_zone("example.org"),
+    ]
+
+
+def test_present_then_no_changes(cloudflare_emulator, zones):  # pylint: disable=unused-argument
+    ret = cloudflare_tunnel_state.present("blog", [dict(rule) for rule in ingress])
+
+    assert ret["result"] is True
+    tunnel = cloudflare_tunnel_module.get_tunnel("blog")
+    assert tunnel["name"] == "blog"
+    assert {record["name"] for record in cloudflare_emulator.records()} == {
+        "app.example.com",
+        "api.example.com",
+        "www.example.org",
+    }
+    assert {record["content"] for record in cloudflare_emulator.records()} == {
+        f"{tunnel['id']}.cfargotunnel.com"
+    }
+    assert cloudflare_emulator.configurations[tunnel["id"]]["config"]["ingress"][-1] == {
+        "service": "http_status:404"
+    }
+
+    cloudflare_tunnel_module.__context__.clear()
+    ret = cloudflare_tunnel_state.present(
+        "blog", [dict(rule) for rule in ingress] + [{"service": "http_status:404"}]
+    )
+
+    assert ret["changes"] == {}
+    assert ret["comment"] == "Cloudflare Tunnel blog is already in the desired state"
+
+
+def test_absent(cloudflare_emulator, zones):  # pylint: disable=unused-argument
+    cloudflare_tunnel_state.present("blog", [dict(rule) for rule in ingress])
+    cloudflare_tunnel_module.__context__.clear()
+
+    ret = cloudflare_tunnel_state.absent("blog")
+
+    assert ret["result"] is True
+    assert cloudflare_emulator.records() == []
+    assert cloudflare_tunnel_module.get_tunnel("blog") is False
+
+
+def test_address_record_left_alone(cloudflare_emulator, zones):  # pylint: disable=unused-argument
+    cloudflare_emulator.add_dns("api.example.com", "198.51.100.4", record_type="A")
+
+    ret = cloudflare_tunnel_state.present("blog", [dict(rule) for rule in ingress])
+
+    assert ret["result"] is True
+    assert "api.example.com" not in ret["changes"]
+    cloudflare_tunnel_module.__context__.clear()
+    ret = cloudflare_tunnel_state.absent("blog")
+
+    assert ret["result"] is True
+    assert [
+        (record["name"], record["type"], record["content"])
+        for record in cloudflare_emulator.records()
+    ] == [("api.example.com", "A", "198.51.100.4")]
+
+
+def test_aggregate_repeated_hostname(cloudflare_emulator, zones):  # pylint: disable=unused-argument
+    states = {
+        "blog": [
+            {"hostname": "app.example.com", "path": "/api", "service": "http://127.0.0.1:8080"},
+            {"hostname": "app.example.com", "service": "http://127.0.0.1:8000"},
+            {"hostname": "www.example.org", "service": "http://127.0.0.1:8081"},
+        ],
+        "shop": [
+            {"hostname": "shop.example.com", "service": "http://127.0.0.1:9000"},
+            {"hostname": "APP.example.com", "service": "http://127.0.0.1:9001"},
+        ],
+    }
+    chunks = [
+        {
+            "state": "cloudflare_tunnel",
+            "__id__": name,
+            "name": name,
+            "fun": "present",
+            "ingress": ingress,
+        }
+        for name, ingress in states.items()
+    ]
+
+    cloudflare_tunnel_state.mod_aggregate(chunks[0], chunks, {})
+    rets = {name: cloudflare_tunnel_state.present(name, states[name]) for name in states}
+
+    assert rets["blog"]["result"] is True
+    assert rets["shop"]["result"] is False
+    assert rets["shop"]["comment"] == (
+        "Hostname APP.example.com is already routed by Cloudflare Tunnel blog"
+    )
+    blog = cloudflare_tunnel_module.get_tunnel("blog")
+    assert sorted(
+        (record["name"], record["content"]) for record in cloudflare_emulator.records()
+    ) == [
+        ("app.example.com", f"{blog['id']}.cfargotunnel.com"),
+        ("www.example.org", f"{blog['id']}.cfargotunnel.com"),
+    ]
+    assert cloudflare_tunnel_module.get_tunnel("shop") is False
+
+
+def test_managed_hostname_moved(cloudflare_emulator, zones):  # pylint: disable=unused-argument
+    ret = cloudflare_tunnel_state.managed("web", {"blog": [ingress[0]], "shop": [ingress[1]]})
+    assert ret["result"] is True
+
+    cloudflare_tunnel_module.__context__.clear()
+    ret = cloudflare_tunnel_state.managed(
+        "web", {"blog": [ingress[1]], "shop": [ingress[0]]}, repoint_dns=True
+    )
+
+    assert ret["result"] is True, ret["comment"]
+    assert {
+        record["name"]: record["content"] for record in cloudflare_emulator.records()
+    } == {
+        "app.example.com": f"{cloudflare_tunnel_module.get_tunnel('shop')['id']}.cfargotunnel.com",
+        "api.example.com": f"{cloudflare_tunnel_module.get_tunnel('blog')['id']}.cfargotunnel.com",
+    }
+
+
+def test_managed_prune(cloudflare_emulator, zones):  # pylint: disable=unused-argument
+    tunnels = {
+        "blog": [ingress[0]],
+        "api": [ingress[1]],
+        "www": [ingress[2]],
+    }
+    unmanaged = cloudflare_emulator.add_tunnel("unmanaged")
+    ret = cloudflare_tunnel_state.managed("web", tunnels)
+    assert ret["result"] is True
+    www = cloudflare_tunnel_module.get_tunnel("www")
+
+    cloudflare_tunnel_module.__context__.clear()
+    ret = cloudflare_tunnel_state.managed(
+        "web", {name: tunnels[name] for name in ("blog", "api")}, prune=True
+    )
+
+    assert ret["result"] is True
+    assert ret["changes"] == {
+        "www": {"www.example.org": {"result": "Removed"}, "tunnel": "removed www"}
+    }
+    assert cloudflare_emulator.tunnels[www["id"]]["deleted_at"]
+    assert not cloudflare_emulator.tunnels[unmanaged["id"]]["deleted_at"]
+    assert {record["name"] for record in cloudflare_emulator.records()} == {
+        "app.example.com",
+        "api.example.com",
+    }
+
+
+def test_managed_repeated_hostname(cloudflare_emulator, zones):  # pylint: disable=unused-argument
+    tunnels = {
+        "blog": [
+            {"hostname": "app.example.com", "path": "/api", "service": "http://127.0.0.1:8080"},
+            {"hostname": "app.example.com", "service": "http://127.0.0.1:8000"},
+        ],
+        "shop": [ingress[1], {"hostname": "app.example.com", "service": "http://127.0.0.1:9000"}],
+        "www": [ingress[2]],
+    }
+
+    ret = cloudflare_tunnel_state.managed("web", tunnels)
+
+    assert ret["result"] is False
+    assert ret["comment"].splitlines() == [
+        "0 of 3 Cloudflare Tunnels are already in the desired state",
+        "blog: Cloudflare tunnel blog was created",
+        "shop: Hostname app.example.com is already routed by Cloudflare Tunnel blog",
+        "www: Cloudflare tunnel www was created",
+    ]
+    assert {record["name"] for record in cloudflare_emulator.records()} == {
+        "app.example.com",
+        "www.example.org",
+    }
+
+    # The repeated hostname of a pruned tunnel is removed once
+    cloudflare_tunnel_module.__context__.clear()
+    ret = cloudflare_tunnel_state.managed("web", {"www": tunnels["www"]}, prune=True)
+
+    assert ret["result"] is True, ret["comment"]
+    assert ret["changes"]["blog"] == {
+        "app.example.com": {"result": "Removed"},
+        "tunnel": "removed blog",
+    }
+    assert {record["name"] for record in cloudflare_emulator.records()} == {"www.example.org"}
+
+
+def test_list_zones_paginates(cloudflare_emulator, cloudflare_profile):
+    for index in range(120):
+        cloudflare_emulator.add_zone(f"zone{index}.com")
+
+    zones = cf_tunnel_utils.list_zones(
+        cloudflare_profile["api_token"], cloudflare_emulator.account, profile=cloudflare_profile
+    )
+
+    assert len(zones) == 120
+    assert [request["params"]["page"] for request in cloudflare_emulator.requests] == [
+        "1",
+        "2",
+        "3",
+    ]
+
+
+def test_list_tunnels_paginates(cloudflare_emulator, cloudflare_profile):
+    for index in range(5):
+        cloudflare_emulator.add_tunnel(f"tunnel{index}")
+
+    with patch.object(cf_tunnel_utils, "TUNNELS_PER_PAGE", 2):
+        tunnels = cf_tunnel_utils.list_tunnels(
+            cloudflare_profile["api_token"], cloudflare_emulator.account, profile=cloudflare_profile
+        )
+
+    assert [tunnel["name"] for tunnel in tunnels] == [f"tunnel{index}" for index in range(5)]
+    assert [request["params"]["page"] for request in cloudflare_emulator.requests] == [
+        "1",
+        "2",
+        "3",
+    ]
+
+
+def test_throttled_request_retried(cloudflare_emulator, cloudflare_profile, zones):
+    cloudflare_emulator.throttle(times=2, method="GET", path="dns_records")
+
+    records = cf_tunnel_utils.list_dns(
+        cloudflare_profile["api_token"], zones[0]["id"], profile=cloudflare_profile
+    )
+
+    assert records == []
+    assert [request["status"] for request in cloudflare_emulator.requests] == [429, 429, 200]
+
+
+def test_injected_fault_on_post_not_retried(cloudflare_emulator, cloudflare_profile, zones):
+    cloudflare_emulator.inject_fault(status=502, method="POST")
+    record = {"name": "app.example.com", "type": "CNAME", "content": "target.example.net"}
+
+    with pytest.raises(salt.exceptions.CommandExecutionError):
+        cf_tunnel_utils.create_dns(
+            cloudflare_profile["api_token"], zones[0]["id"], record, profile=cloudflare_profile
+        )
+
+    assert cloudflare_emulator.records() == []
+    assert len(cloudflare_emulator.requests) == 1
+
+
+def test_batch_is_atomic(cloudflare_emulator, cloudflare_profile, zones):
+    existing = cloudflare_emulator.add_dns("app.example.com", "target.example.net")
+
+    with pytest.raises(salt.exceptions.CommandExecutionError):
+        cf_tunnel_utils.batch_dns(
+            cloudflare_profile["api_token"],
+            zones[0]["id"],
+            deletes=[{"id": existing["id"]}],
+            posts=[{"name": "app.example.org", "type": "CNAME", "content": "target.example.net"}],
+            profile=cloudflare_profile,
+        )
+
+    assert [record["id"] for record in cloudflare_emulator.records()] == [existing["id"]]
+
+
+def test_rate_limit(cloudflare_profile):
+    with CloudflareEmulator(rate_limit=2, latency=(0, 0.01), seed=1) as emulator:
+        profile = dict(cloudflare_profile, base_url=emulator.base_url, retry_attempts=1)
+        for _ in range(2):
+            cf_tunnel_utils.get_zone_id(profile["api_token"], "example.com", profile=profile)
+
+        with pytest.raises(salt.exceptions.CommandExecutionError, match="throttling"):
+            cf_tunnel_utils.get_zone_id(profile["api_token"], "example.com", profile=profile)
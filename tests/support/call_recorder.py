@@ -0,0 +1,211 @@
+"""
+Recording of the calls the cloudflare_tunnel modules make to the Cloudflare API
+
+``CallRecorder`` wraps the public functions of ``saltext.cloudflare_tunnel.utils`` and the
+function sending the requests, and optionally the execution functions a state module reaches
+through ``__salt__``. Every call is recorded with the call it was made from, so the requests
+sent by an execution or state function can be counted and tests can assert how the number of
+requests grows with the size of the inventory.
+
+.. code-block:: python
+
+    with CallRecorder(cloudflare_tunnel_state.__salt__) as recorder:
+        cloudflare_tunnel_state.present("blog", ingress)
+
+    assert recorder.count(method="GET", endpoint="zones/dns_records") <= len(zones)
+"""
+import contextvars
+import functools
+import inspect
+import threading
+import time
+
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod as cf_tunnel_utils
+
+# Functions of the utils module that do not call the API
+IGNORED_FUNCTIONS = ("api_stats", "client_stats")
+
+_CURRENT_CALL = contextvars.ContextVar("cloudflare_tunnel_recorded_call", default=None)
+
+
+class CallRecorder:
+    """
+    Context manager recording the calls made while it is active
+
+    salt
+        ``__salt__`` dictionary of a state module, its ``cloudflare_tunnel.*`` functions are
+        recorded as the outermost calls
+    """
+
+    def __init__(self, salt=None):
+        self.salt = salt
+        self.calls = []
+        self.requests = []
+        self._lock = threading.Lock()
+        self._originals = {}
+        self._salt_originals = {}
+
+    def __enter__(self):
+        for name, func in inspect.getmembers(cf_tunnel_utils, inspect.isfunction):
+            if name.startswith("_") or name in IGNORED_FUNCTIONS:
+                continue
+            if func.__module__ != cf_tunnel_utils.__name__:
+                continue
+            self._originals[name] = func
+            setattr(cf_tunnel_utils, name, self._wrap("utils", name, func))
+
+        send = cf_tunnel_utils._send  # pylint: disable=protected-access
+        self._originals["_send"] = send
+        cf_tunnel_utils._send = self._wrap_send(send)  # pylint: disable=protected-access
+
+        for key, func in list((self.salt or {}).items()):
+            if key.startswith("cloudflare_tunnel."):
+                self._salt_originals[key] = func
+                self.salt[key] = self._wrap("salt", key, func)
+
+        return self
+
+    def __exit__(self, *exc_info):
+        for name, func in self._originals.items():
+            setattr(cf_tunnel_utils, name, func)
+        self._originals.clear()
+
+        for key, func in self._salt_originals.items():
+            self.salt[key] = func
+        self._salt_originals.clear()
+
+    def _record(self, record, collection):
+        with self._lock:
+            record["index"] = len(collection)
+            collection.append(record)
+        return record
+
+    def _wrap(self, kind, name, func):
+        @functools.wraps(func)
+        def _recorded(*args, **kwargs):
+            parent = _CURRENT_CALL.get()
+            call = self._record(
+                {
+                    "kind": kind,
+                    "name": name,
+                    "args": args,
+                    "kwargs": {key: value for key, value in kwargs.items() if key != "profile"},
+                    "parent": parent["index"] if parent else None,
+                    "function": parent["function"] if parent else name,
+                    "requests": 0,
+                    "duration": None,
+                },
+                self.calls,
+            )
+            token = _CURRENT_CALL.set(call)
+            started = time.monotonic()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                call["duration"] = time.monotonic() - started
+                _CURRENT_CALL.reset(token)
+
+        return _recorded
+
+    def _wrap_send(self, send):
+        @functools.wraps(send)
+        def _recorded(api_token, method, endpoint, identifiers, profile, params, data):
+            caller = _CURRENT_CALL.get()
+            self._record(
+                {
+                    "method": method.upper(),
+                    "endpoint": endpoint,
+                    "identifiers": tuple(identifiers),
+                    "params": dict(params or {}),
+                    "caller": caller["name"] if caller else None,
+                    "function": caller["function"] if caller else None,
+                },
+                self.requests,
+            )
+
+            # Every call the request was made from gets it added to its count
+            index = caller["index"] if caller else None
+            while index is not None:
+                with self._lock:
+                    self.calls[index]["requests"] += 1
+                index = self.calls[index]["parent"]
+
+            return send(api_token, method, endpoint, identifiers, profile, params, data)
+
+        return _recorded
+
+    def _matching(self, method=None, endpoint=None, function=None):
+        return [
+            request
+            for request in self.requests
+            if (method is None or request["method"] == method.upper())
+            and (endpoint is None or request["endpoint"] == endpoint)
+            and (function is None or request["function"] == function)
+        ]
+
+    def count(self, method=None, endpoint=None, function=None):
+        """
+        Returns the number of requests sent, optionally only those with the given method, to
+        the given endpoint or made from the given outermost function
+        """
+        return len(self._matching(method, endpoint, function))
+
+    def sequence(self, function=None):
+        """
+        Returns the requests in the order they were sent, as ``METHOD endpoint`` strings
+        """
+        return [
+            f"{request['method']} {request['endpoint']}"
+            for request in self._matching(function=function)
+        ]
+
+    def by_function(self):
+        """
+        Returns the number of requests made from each outermost function
+        """
+        counts = {}
+        for request in self.requests:
+            counts[request["function"]] = counts.get(request["function"], 0) + 1
+        return counts
+
+    def duplicates(self):
+        """
+        Returns the GET requests that were sent more than once with the same arguments
+        """
+        seen = {}
+        for request in self._matching(method="GET"):
+            key = (
+                request["endpoint"],
+                request["identifiers"],
+                tuple(sorted(request["params"].items())),
+            )
+            seen[key] = seen.get(key, 0) + 1
+        return {key: count for key, count in seen.items() if count > 1}
+
+    def tree(self):
+        """
+        Returns the recorded calls as an indented tree with the requests each one made, to be
+        shown when an assertion fails
+
+        Sibling calls of the same function are shown once with the number of calls.
+        """
+        children = {}
+        for call in self.calls:
+            children.setdefault(call["parent"], []).append(call)
+
+        lines = []
+
+        def _walk(parents, depth):
+            siblings = {}
+            for parent in parents:
+                for call in children.get(parent, []):
+                    siblings.setdefault(call["name"], []).append(call)
+
+            for name, calls in siblings.items():
+                times = f" x{len(calls)}" if len(calls) > 1 else ""
+                requests = sum(call["requests"] for call in calls)
+                lines.append(f"{'  ' * depth}{name}{times} ({requests} requests)")
+                _walk([call["index"] for call in calls], depth + 1)
+
+        _walk([None], 0)
+        return "\n".join(lines)
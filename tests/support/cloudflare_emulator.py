@@ -0,0 +1,773 @@
+"""
+In-process emulator of the Cloudflare v4 API endpoints used by this extension
+
+The emulator keeps zones, DNS records, tunnels, tunnel configurations and connections in memory
+and serves them over HTTP on a local port, so the real ``CloudFlare`` client can be pointed at it
+with the ``base_url`` setting and the whole stack runs without any network.
+
+It paginates list endpoints the way Cloudflare does, can answer with rate limit errors once a
+number of requests per window is exceeded, adds a configurable latency to every request and
+injects faults on matching requests.
+
+.. code-block:: python
+
+    with CloudflareEmulator() as emulator:
+        emulator.add_zone("example.com")
+        profile = {"api_token": "token", "account": emulator.account, "base_url": emulator.base_url}
+
+``emulator_process`` runs it in a child process instead, so that it does not share the memory
+and the interpreter lock of the code measured against it.
+"""
+import base64
+import contextlib
+import copy
+import http.server
+import json
+import multiprocessing
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+
+API_PATH = "/client/v4"
+
+# Largest page size each list endpoint accepts
+MAX_PER_PAGE = {
+    "zones": 50,
+    "dns_records": 5000000,
+    "cfd_tunnel": 1000,
+}
+
+DEFAULT_PER_PAGE = {
+    "zones": 20,
+    "dns_records": 100,
+    "cfd_tunnel": 20,
+}
+
+
+class ApiError(Exception):
+    """
+    Error answered to the client with its HTTP status and Cloudflare error code
+    """
+
+    def __init__(self, status, code, message):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+def _now():
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000000Z", time.gmtime())
+
+
+def _paginate(items, params, resource):
+    try:
+        page = max(1, int(params.get("page", 1)))
+        per_page = int(params.get("per_page", DEFAULT_PER_PAGE[resource]))
+    except ValueError as exc:
+        raise ApiError(400, 1001, f"Invalid pagination: {exc}") from exc
+
+    if not 1 <= per_page <= MAX_PER_PAGE[resource]:
+        raise ApiError(400, 1001, f"per_page must be between 1 and {MAX_PER_PAGE[resource]}")
+
+    start = (page - 1) * per_page
+    result = items[start : start + per_page]
+    return result, {
+        "page": page,
+        "per_page": per_page,
+        "count": len(result),
+        "total_count": len(items),
+        "total_pages": (len(items) + per_page - 1) // per_page,
+    }
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        status, payload = self.server.emulator.dispatch(
+            self.command, self.path, body, self.headers.get("Authorization")
+        )
+
+        content = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+class CloudflareEmulator:
+    """
+    Stateful stand-in for the Cloudflare API
+
+    token
+        API token the requests must carry, any token is accepted when it is ``None``
+
+    account
+        Account ID of the tunnels, generated when not supplied
+
+    latency
+        Seconds added to every request, or a ``(minimum, maximum)`` tuple to draw it from
+
+    rate_limit
+        Requests allowed per ``rate_limit_period`` seconds for each token, the requests over the
+        limit are answered with a ``429`` status and the ``971`` error code
+
+    seed
+        Seed of the random generator used for the latency and the faults
+    """
+
+    def __init__(
+        self,
+        token=None,
+        account=None,
+        latency=0,
+        rate_limit=None,
+        rate_limit_period=300,
+        seed=None,
+    ):
+        self.token = token
+        self.account = account or uuid.uuid4().hex
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rate_limit_period = rate_limit_period
+        self.zones = {}
+        self.dns_records = {}
+        self.tunnels = {}
+        self.configurations = {}
+        self.connections = {}
+        self.requests = []
+        self.faults = []
+        self._random = random.Random(seed)
+        self._sent = {}
+        self._lock = threading.RLock()
+        self._server = None
+        self._thread = None
+        self._routes = [
+            ("GET", r"/zones", self._list_zones),
+            ("GET", r"/zones/(?P<zone_id>[^/]+)", self._get_zone),
+            ("GET", r"/zones/(?P<zone_id>[^/]+)/dns_records", self._list_dns),
+            ("POST", r"/zones/(?P<zone_id>[^/]+)/dns_records", self._create_dns),
+            ("POST", r"/zones/(?P<zone_id>[^/]+)/dns_records/batch", self._batch_dns),
+            ("GET", r"/zones/(?P<zone_id>[^/]+)/dns_records/(?P<record_id>[^/]+)", self._get_dns),
+            ("PUT", r"/zones/(?P<zone_id>[^/]+)/dns_records/(?P<record_id>[^/]+)", self._put_dns),
+            (
+                "PATCH",
+                r"/zones/(?P<zone_id>[^/]+)/dns_records/(?P<record_id>[^/]+)",
+                self._patch_dns,
+            ),
+            (
+                "DELETE",
+                r"/zones/(?P<zone_id>[^/]+)/dns_records/(?P<record_id>[^/]+)",
+                self._delete_dns,
+            ),
+            ("GET", r"/accounts/(?P<account>[^/]+)/cfd_tunnel", self._list_tunnels),
+            ("POST", r"/accounts/(?P<account>[^/]+)/cfd_tunnel", self._create_tunnel),
+            (
+                "GET",
+                r"/accounts/(?P<account>[^/]+)/cfd_tunnel/(?P<tunnel_id>[^/]+)",
+                self._get_tunnel,
+            ),
+            (
+                "DELETE",
+                r"/accounts/(?P<account>[^/]+)/cfd_tunnel/(?P<tunnel_id>[^/]+)",
+                self._delete_tunnel,
+            ),
+            (
+                "GET",
+                r"/accounts/(?P<account>[^/]+)/cfd_tunnel/(?P<tunnel_id>[^/]+)/configurations",
+                self._get_configuration,
+            ),
+            (
+                "PUT",
+                r"/accounts/(?P<account>[^/]+)/cfd_tunnel/(?P<tunnel_id>[^/]+)/configurations",
+                self._put_configuration,
+            ),
+            (
+                "GET",
+                r"/accounts/(?P<account>[^/]+)/cfd_tunnel/(?P<tunnel_id>[^/]+)/token",
+                self._get_token,
+            ),
+            (
+                "GET",
+                r"/accounts/(?P<account>[^/]+)/cfd_tunnel/(?P<tunnel_id>[^/]+)/connections",
+                self._list_connections,
+            ),
+            (
+                "DELETE",
+                r"/accounts/(?P<account>[^/]+)/cfd_tunnel/(?P<tunnel_id>[^/]+)/connections",
+                self._delete_connections,
+            ),
+        ]
+
+    # Server
+
+    def start(self):
+        """
+        Serve the API on a free local port
+        """
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.emulator = self
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}{API_PATH}"
+
+    # Inventory
+
+    def add_zone(self, name, account=None, status="active"):
+        """
+        Add a zone, returns it
+        """
+        with self._lock:
+            zone = {
+                "id": uuid.uuid4().hex,
+                "name": name,
+                "status": status,
+                "account": {"id": account or self.account},
+                "created_on": _now(),
+            }
+            self.zones[zone["id"]] = zone
+            self.dns_records[zone["id"]] = {}
+            return copy.deepcopy(zone)
+
+    def add_dns(self, name, content, record_type="CNAME", proxied=True, comment=None):
+        """
+        Add a DNS record to the zone the name belongs to, returns it
+        """
+        with self._lock:
+            zone = self._zone_for(name)
+            return copy.deepcopy(
+                self._store_dns(
+                    zone,
+                    {
+                        "name": name,
+                        "type": record_type,
+                        "content": content,
+                        "proxied": proxied,
+                        "comment": comment,
+                    },
+                )
+            )
+
+    def add_tunnel(self, name, account=None):
+        """
+        Add a tunnel, returns it
+        """
+        with self._lock:
+            tunnel = self._store_tunnel(
+                account or self.account, {"name": name, "config_src": "cloudflare"}
+            )
+            return self._public_tunnel(tunnel)
+
+    def add_connection(self, tunnel_id, colo_name="DFW"):
+        """
+        Add a connector connection to a tunnel, which makes it healthy
+        """
+        with self._lock:
+            connection = {
+                "id": str(uuid.uuid4()),
+                "colo_name": colo_name,
+                "is_pending_reconnect": False,
+                "opened_at": _now(),
+                "origin_ip": "127.0.0.1",
+                "client_version": "2024.1.0",
+            }
+            self.connections.setdefault(tunnel_id, []).append(connection)
+            self.tunnels[tunnel_id]["status"] = "healthy"
+            self.tunnels[tunnel_id]["connections"] = list(self.connections[tunnel_id])
+            return copy.deepcopy(connection)
+
+    def records(self, zone_name=None):
+        """
+        Returns the DNS records, of one zone if its name is supplied
+        """
+        with self._lock:
+            return copy.deepcopy(
+                [
+                    record
+                    for zone_id, records in self.dns_records.items()
+                    if zone_name is None or self.zones[zone_id]["name"] == zone_name
+                    for record in records.values()
+                ]
+            )
+
+    # Faults
+
+    def inject_fault(
+        self, status=500, code=None, message=None, method=None, path=None, times=1, probability=1
+    ):
+        """
+        Answer matching requests with an error
+
+        method
+            HTTP method the fault applies to, any method when ``None``
+
+        path
+            Regular expression searched in the path, below ``/client/v4``, of the request
+
+        times
+            Number of requests answered with the error, ``None`` for no limit
+
+        probability
+            Chance a matching request is answered with the error
+        """
+        with self._lock:
+            self.faults.append(
+                {
+                    "status": status,
+                    "code": code or status,
+                    "message": message or http.HTTPStatus(status).phrase,
+                    "method": method,
+                    "path": re.compile(path) if path else None,
+                    "times": times,
+                    "probability": probability,
+                }
+            )
+
+    def throttle(self, times=1, method=None, path=None):
+        """
+        Answer the next matching requests with a rate limit error
+        """
+        self.inject_fault(
+            status=429,
+            code=971,
+            message="Please wait and consider throttling your request speed",
+            method=method,
+            path=path,
+            times=times,
+        )
+
+    def clear_faults(self):
+        with self._lock:
+            self.faults.clear()
+
+    # Dispatch
+
+    def dispatch(self, method, raw_path, body, authorization):
+        """
+        Answer one request, returns the HTTP status and the JSON payload
+        """
+        started = time.monotonic()
+        url = urllib.parse.urlsplit(raw_path)
+        path = url.path[len(API_PATH) :] if url.path.startswith(API_PATH) else url.path
+        params = dict(urllib.parse.parse_qsl(url.query))
+
+        latency = self.latency
+        if isinstance(latency, (tuple, list)):
+            with self._lock:
+                latency = self._random.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+
+        try:
+            self._check_token(authorization)
+            self._check_faults(method, path)
+            data = json.loads(body) if body else {}
+            handler, arguments = self._route(method, path)
+            with self._lock:
+                result = handler(params=params, data=data, **arguments)
+            result_info = None
+            if isinstance(result, tuple):
+                result, result_info = result
+            status = 200
+            payload = {"success": True, "errors": [], "messages": [], "result": result}
+            if result_info:
+                payload["result_info"] = result_info
+        except ApiError as exc:
+            status = exc.status
+            payload = {
+                "success": False,
+                "errors": [{"code": exc.code, "message": exc.message}],
+                "messages": [],
+                "result": None,
+            }
+        except ValueError as exc:
+            status = 400
+            payload = {
+                "success": False,
+                "errors": [{"code": 6007, "message": f"Malformed JSON in request body: {exc}"}],
+                "messages": [],
+                "result": None,
+            }
+
+        with self._lock:
+            self.requests.append(
+                {
+                    "method": method,
+                    "path": path,
+                    "params": params,
+                    "status": status,
+                    "duration": time.monotonic() - started,
+                }
+            )
+
+        return status, payload
+
+    def _check_token(self, authorization):
+        token = (authorization or "").replace("Bearer ", "", 1)
+        if self.token is not None and token != self.token:
+            raise ApiError(403, 10000, "Authentication error")
+
+        if self.rate_limit is None:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            sent = [at for at in self._sent.get(token, []) if now - at < self.rate_limit_period]
+            if len(sent) >= self.rate_limit:
+                self._sent[token] = sent
+                raise ApiError(429, 971, "Please wait and consider throttling your request speed")
+            sent.append(now)
+            self._sent[token] = sent
+
+    def _check_faults(self, method, path):
+        with self._lock:
+            for fault in self.faults:
+                if fault["times"] is not None and fault["times"] <= 0:
+                    continue
+                if fault["method"] and fault["method"] != method:
+                    continue
+                if fault["path"] and not fault["path"].search(path):
+                    continue
+                if self._random.random() >= fault["probability"]:
+                    continue
+
+                if fault["times"] is not None:
+                    fault["times"] -= 1
+                raise ApiError(fault["status"], fault["code"], fault["message"])
+
+    def _route(self, method, path):
+        for route_method, pattern, handler in self._routes:
+            match = re.fullmatch(pattern, path)
+            if match and route_method == method:
+                return handler, match.groupdict()
+
+        raise ApiError(
+            404, 7003, f"Could not route to {path}, perhaps your object identifier is invalid?"
+        )
+
+    # Zones
+
+    def _zone(self, zone_id):
+        if zone_id not in self.zones:
+            raise ApiError(404, 7003, "Could not route to /zones, invalid zone identifier")
+        return self.zones[zone_id]
+
+    def _zone_for(self, name):
+        zones = [
+            zone
+            for zone in self.zones.values()
+            if name.lower() == zone["name"] or name.lower().endswith("." + zone["name"])
+        ]
+        if not zones:
+            raise ApiError(400, 1004, f"DNS Validation Error: {name} is not in a zone")
+        return max(zones, key=lambda zone: len(zone["name"]))
+
+    def _list_zones(self, params, data):
+        zones = [
+            zone
+            for zone in self.zones.values()
+            if ("name" not in params or zone["name"] == params["name"].lower())
+            and ("account.id" not in params or zone["account"]["id"] == params["account.id"])
+        ]
+        result, result_info = _paginate(
+            sorted(zones, key=lambda zone: zone["name"]), params, "zones"
+        )
+        return copy.deepcopy(result), result_info
+
+    def _get_zone(self, params, data, zone_id):
+        return copy.deepcopy(self._zone(zone_id))
+
+    # DNS records
+
+    def _record(self, zone_id, record_id):
+        records = self.dns_records[self._zone(zone_id)["id"]]
+        if record_id not in records:
+            raise ApiError(404, 81044, "Record does not exist.")
+        return records[record_id]
+
+    def _validate_dns(self, zone, records, record, record_id=None):
+        for field in ("name", "type", "content"):
+            if not record.get(field):
+                raise ApiError(400, 1004, f"DNS Validation Error: {field} is required")
+
+        name = record["name"].lower().rstrip(".")
+        if name != zone["name"] and not name.endswith("." + zone["name"]):
+            raise ApiError(400, 1004, f"DNS Validation Error: {name} is not in {zone['name']}")
+
+        for other in records.values():
+            if other["id"] == record_id or other["name"] != name:
+                continue
+            if "CNAME" in (other["type"], record["type"]):
+                raise ApiError(
+                    400, 81053, "An A, AAAA, or CNAME record with that host already exists."
+                )
+
+        return name
+
+    def _store_dns(self, zone, record, record_id=None, records=None):
+        records = self.dns_records[zone["id"]] if records is None else records
+        name = self._validate_dns(zone, records, record, record_id)
+        existing = records.get(record_id, {})
+        stored = {
+            "id": record_id or uuid.uuid4().hex,
+            "zone_id": zone["id"],
+            "zone_name": zone["name"],
+            "name": name,
+            "type": record["type"],
+            "content": record["content"],
+            "proxiable": True,
+            "proxied": bool(record.get("proxied", False)),
+            "ttl": record.get("ttl", 1),
+            "comment": record.get("comment"),
+            "tags": record.get("tags", []),
+            "meta": {"auto_added": False, "source": "primary"},
+            "created_on": existing.get("created_on", _now()),
+            "modified_on": _now(),
+        }
+        records[stored["id"]] = stored
+        return stored
+
+    def _list_dns(self, params, data, zone_id):
+        records = [
+            record
+            for record in self.dns_records[self._zone(zone_id)["id"]].values()
+            if ("name" not in params or record["name"] == params["name"].lower())
+            and ("type" not in params or record["type"] == params["type"])
+        ]
+        result, result_info = _paginate(
+            sorted(records, key=lambda record: (record["name"], record["type"])),
+            params,
+            "dns_records",
+        )
+        return copy.deepcopy(result), result_info
+
+    def _create_dns(self, params, data, zone_id):
+        return copy.deepcopy(self._store_dns(self._zone(zone_id), data))
+
+    def _get_dns(self, params, data, zone_id, record_id):
+        return copy.deepcopy(self._record(zone_id, record_id))
+
+    def _put_dns(self, params, data, zone_id, record_id):
+        self._record(zone_id, record_id)
+        return copy.deepcopy(self._store_dns(self._zone(zone_id), data, record_id))
+
+    def _patch_dns(self, params, data, zone_id, record_id):
+        record = dict(self._record(zone_id, record_id), **data)
+        return copy.deepcopy(self._store_dns(self._zone(zone_id), record, record_id))
+
+    def _delete_dns(self, params, data, zone_id, record_id):
+        self._record(zone_id, record_id)
+        del self.dns_records[zone_id][record_id]
+        return {"id": record_id}
+
+    def _batch_dns(self, params, data, zone_id):
+        zone = self._zone(zone_id)
+        # The batch is applied to a copy, which replaces the zone only if every change succeeded
+        records = copy.deepcopy(self.dns_records[zone_id])
+        result = {"deletes": [], "patches": [], "puts": [], "posts": []}
+
+        for change in data.get("deletes") or []:
+            if change.get("id") not in records:
+                raise ApiError(400, 81044, f"Record {change.get('id')} does not exist.")
+            result["deletes"].append(records.pop(change["id"]))
+        for change in data.get("patches") or []:
+            if change.get("id") not in records:
+                raise ApiError(400, 81044, f"Record {change.get('id')} does not exist.")
+            record = dict(records[change["id"]], **change)
+            result["patches"].append(self._store_dns(zone, record, change["id"], records))
+        for change in data.get("puts") or []:
+            if change.get("id") not in records:
+                raise ApiError(400, 81044, f"Record {change.get('id')} does not exist.")
+            result["puts"].append(self._store_dns(zone, change, change["id"], records))
+        for change in data.get("posts") or []:
+            result["posts"].append(self._store_dns(zone, change, records=records))
+
+        self.dns_records[zone_id] = records
+        return copy.deepcopy(result)
+
+    # Tunnels
+
+    def _tunnel(self, account, tunnel_id):
+        tunnel = self.tunnels.get(tunnel_id)
+        if tunnel is None or tunnel["account_tag"] != account or tunnel["deleted_at"]:
+            raise ApiError(404, 1003, "Tunnel not found")
+        return tunnel
+
+    def _store_tunnel(self, account, data):
+        if not data.get("name"):
+            raise ApiError(400, 1001, "Tunnel name is required")
+
+        for tunnel in self.tunnels.values():
+            if (
+                tunnel["account_tag"] == account
+                and tunnel["name"] == data["name"]
+                and not tunnel["deleted_at"]
+            ):
+                raise ApiError(409, 1013, "You already have a tunnel with this name")
+
+        tunnel = {
+            "id": str(uuid.uuid4()),
+            "account_tag": account,
+            "name": data["name"],
+            "status": "inactive",
+            "tun_type": "cfd_tunnel",
+            "remote_config": data.get("config_src") == "cloudflare",
+            "created_at": _now(),
+            "deleted_at": None,
+            "connections": [],
+            "metadata": {},
+            "credentials_file": {"TunnelSecret": data.get("tunnel_secret") or ""},
+        }
+        self.tunnels[tunnel["id"]] = tunnel
+        return tunnel
+
+    @staticmethod
+    def _public_tunnel(tunnel):
+        return copy.deepcopy(
+            {key: value for key, value in tunnel.items() if key != "credentials_file"}
+        )
+
+    def _list_tunnels(self, params, data, account):
+        tunnels = [
+            tunnel
+            for tunnel in self.tunnels.values()
+            if tunnel["account_tag"] == account
+            and ("name" not in params or tunnel["name"] == params["name"])
+            and (params.get("is_deleted") != "false" or not tunnel["deleted_at"])
+        ]
+        result, result_info = _paginate(
+            sorted(tunnels, key=lambda tunnel: tunnel["created_at"]), params, "cfd_tunnel"
+        )
+        return [self._public_tunnel(tunnel) for tunnel in result], result_info
+
+    def _create_tunnel(self, params, data, account):
+        return self._public_tunnel(self._store_tunnel(account, data))
+
+    def _get_tunnel(self, params, data, account, tunnel_id):
+        return self._public_tunnel(self._tunnel(account, tunnel_id))
+
+    def _delete_tunnel(self, params, data, account, tunnel_id):
+        tunnel = self._tunnel(account, tunnel_id)
+        if self.connections.get(tunnel_id):
+            raise ApiError(400, 1022, "Cannot delete a tunnel with active connections")
+
+        tunnel["deleted_at"] = _now()
+        tunnel["status"] = "deleted"
+        return self._public_tunnel(tunnel)
+
+    def _get_configuration(self, params, data, account, tunnel_id):
+        self._tunnel(account, tunnel_id)
+        return copy.deepcopy(
+            self.configurations.get(
+                tunnel_id,
+                {
+                    "account_id": account,
+                    "tunnel_id": tunnel_id,
+                    "version": 0,
+                    "config": None,
+                    "source": "cloudflare",
+                    "created_at": None,
+                },
+            )
+        )
+
+    def _put_configuration(self, params, data, account, tunnel_id):
+        self._tunnel(account, tunnel_id)
+        config = data.get("config")
+        if not isinstance(config, dict) or not config.get("ingress"):
+            raise ApiError(400, 1055, "Failed to validate the configuration: ingress is required")
+        if "hostname" in config["ingress"][-1]:
+            raise ApiError(
+                400, 1055, "Failed to validate the configuration: the last rule must match all"
+            )
+
+        previous = self.configurations.get(tunnel_id, {"version": 0})
+        self.configurations[tunnel_id] = {
+            "account_id": account,
+            "tunnel_id": tunnel_id,
+            "version": previous["version"] + 1,
+            "config": copy.deepcopy(config),
+            "source": "cloudflare",
+            "created_at": _now(),
+        }
+        return copy.deepcopy(self.configurations[tunnel_id])
+
+    def _get_token(self, params, data, account, tunnel_id):
+        tunnel = self._tunnel(account, tunnel_id)
+        token = {"a": account, "t": tunnel_id, "s": tunnel["credentials_file"]["TunnelSecret"]}
+        return base64.b64encode(json.dumps(token).encode()).decode()
+
+    def _list_connections(self, params, data, account, tunnel_id):
+        self._tunnel(account, tunnel_id)
+        connections = self.connections.get(tunnel_id)
+        if not connections:
+            return []
+
+        # Every connection is reported as coming from one cloudflared client
+        return [{"id": tunnel_id, "version": "2024.1.0", "conns": copy.deepcopy(connections)}]
+
+    def _delete_connections(self, params, data, account, tunnel_id):
+        tunnel = self._tunnel(account, tunnel_id)
+        self.connections.pop(tunnel_id, None)
+        tunnel["connections"] = []
+        tunnel["status"] = "inactive"
+        return None
+
+
+def _serve(queue, zones, settings):
+    emulator = CloudflareEmulator(**settings).start()
+    for zone in zones:
+        emulator.add_zone(zone)
+    queue.put((emulator.base_url, emulator.account))
+    threading.Event().wait()
+
+
+@contextlib.contextmanager
+def emulator_process(zones=(), **settings):
+    """
+    Run an emulator holding ``zones`` in a child process, yields its base URL and account
+
+    settings
+        Arguments of ``CloudflareEmulator``
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(queue, list(zones), settings))
+    process.daemon = True
+    process.start()
+    try:
+        yield queue.get(timeout=30)
+    finally:
+        process.terminate()
+        process.join()
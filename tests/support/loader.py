@@ -0,0 +1,79 @@
+"""
+Loader dunders wiring the cloudflare_tunnel state module to the execution module, so that
+tests can run the states against the Cloudflare API emulator
+"""
+from unittest.mock import MagicMock
+
+import saltext.cloudflare_tunnel.modules.cloudflare_tunnel_mod as cloudflare_tunnel_module
+import saltext.cloudflare_tunnel.states.cloudflare_tunnel_mod as cloudflare_tunnel_state
+
+# Execution functions the state module calls
+STATE_FUNCTIONS = (
+    "get_tunnel",
+    "list_tunnels",
+    "get_tunnel_config",
+    "get_dns_snapshot",
+    "get_zones",
+    "create_tunnel",
+    "create_tunnel_config",
+    "create_dns",
+    "remove_dns_by_id",
+    "update_dns_by_id",
+    "apply_dns_batch",
+    "remove_tunnel",
+    "is_connector_installed",
+    "install_connector",
+    "remove_connector",
+)
+
+
+def emulator_profile(base_url, account, **settings):
+    """
+    Returns a ``cloudflare`` profile pointing at the emulator, with the rate limiter disabled
+    """
+    return dict(
+        {
+            "api_token": "AS0KLASDOK1201KASD1KJ1239ASKJD123",
+            "account": account,
+            "base_url": base_url,
+            "rate_limit": 0,
+            "retry_base_delay": 0.01,
+        },
+        **settings,
+    )
+
+
+def loader_modules(profile, cachedir):
+    """
+    Returns the ``configure_loader_modules`` dictionary for the execution and state modules
+
+    The connector service is reported as installed.
+    """
+
+    def _config_get(key, default=None):
+        return profile if key == "cloudflare" else default
+
+    module_salt = {
+        "config.get": _config_get,
+        "service.available": MagicMock(return_value=True),
+        "cmd.run": MagicMock(
+            side_effect=lambda cmd: f"cloudflared service {cmd.split()[2]}ed successfully"
+        ),
+    }
+    state_salt = {
+        f"cloudflare_tunnel.{function}": getattr(cloudflare_tunnel_module, function)
+        for function in STATE_FUNCTIONS
+    }
+    state_salt["config.get"] = _config_get
+
+    return {
+        cloudflare_tunnel_module: {
+            "__salt__": module_salt,
+            "__opts__": {"cachedir": cachedir},
+            "__context__": {},
+        },
+        cloudflare_tunnel_state: {
+            "__salt__": state_salt,
+            "__opts__": {"test": False, "cachedir": cachedir},
+        },
+    }
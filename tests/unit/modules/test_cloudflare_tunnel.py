@@ -119,6 +119,63 @@ def test_remove_dns(mock_get_zone_id):  # pylint: disable=unused-argument
             assert cloudflare_tunnel_module.remove_dns("test.example.com") is True
 
 
+def test_remove_dns_by_id():
+    with patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.get_dns"
+    ) as mock_get_dns, patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.remove_dns",
+        MagicMock(return_value={"id": "372e67954025e0ba6aaa6d586b9e0b59"}),
+    ) as mock_remove:
+        assert (
+            cloudflare_tunnel_module.remove_dns_by_id(
+                "023e105f4ecef8ad9ca31a8372d0c353", "372e67954025e0ba6aaa6d586b9e0b59"
+            )
+            is True
+        )
+
+    mock_get_dns.assert_not_called()
+    assert mock_remove.call_args.args[1:] == (
+        "023e105f4ecef8ad9ca31a8372d0c353",
+        "372e67954025e0ba6aaa6d586b9e0b59",
+    )
+
+
+def test_update_dns_by_id():
+    mock_dns = {
+        "id": "372e67954025e0ba6aaa6d586b9e0b59",
+        "type": "CNAME",
+        "name": "test.example.com",
+        "content": "134129123912SADASD91231SAD.cfargotunnel.com",
+        "proxied": True,
+        "comment": "DNS managed by SaltStack",
+        "zone_id": "023e105f4ecef8ad9ca31a8372d0c353",
+    }
+
+    with patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.get_dns"
+    ) as mock_get_dns, patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.create_dns",
+        MagicMock(return_value=mock_dns),
+    ) as mock_create:
+        assert (
+            cloudflare_tunnel_module.update_dns_by_id(
+                "023e105f4ecef8ad9ca31a8372d0c353",
+                "372e67954025e0ba6aaa6d586b9e0b59",
+                "test.example.com",
+                "134129123912SADASD91231SAD",
+            )
+            == mock_dns
+        )
+
+    mock_get_dns.assert_not_called()
+    _, zone_id, dns_data, dns_id = mock_create.call_args.args
+    assert (zone_id, dns_id) == (
+        "023e105f4ecef8ad9ca31a8372d0c353",
+        "372e67954025e0ba6aaa6d586b9e0b59",
+    )
+    assert dns_data["content"] == "134129123912SADASD91231SAD.cfargotunnel.com"
+
+
 def test_create_dns_if_does_not_exist(mock_get_zone_id):  # pylint: disable=unused-argument
     mock_dns = {
         "id": "372e67954025e0ba6aaa6d586b9e0b59",
@@ -485,6 +542,7 @@ def test_get_tunnel_config():
                 {"service": "http_status:404"},
             ],
         },
+        "version": 15,
     }
 
     with patch(
@@ -542,6 +600,7 @@ def test_create_tunnel_config():
                 {"service": "http_status:404"},
             ],
         },
+        "version": 15,
     }
 
     with patch(
@@ -652,3 +711,439 @@ def test_remove_connector_failed():
             salt.exceptions.CommandExecutionError, match="Error uninstalling connector"
         ):
             cloudflare_tunnel_module.remove_connector()
+
+
+def test_client_stats():
+    mock_stats = {
+        "pool": {"created": 1, "reused": 59, "evicted": 0, "idle": 1},
+        "rate_limit": {"requests": 60, "delayed": 2, "wait_total": 0.5, "wait_max": 0.3},
+    }
+
+    with patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.client_stats",
+        MagicMock(return_value=mock_stats),
+    ):
+        assert cloudflare_tunnel_module.client_stats() == mock_stats
+
+
+def test_get_zone_id_longest_suffix():
+    mock_zone = {
+        "id": "023e105f4ecef8ad9ca31a8372d0c353",
+        "name": "example.co.uk",
+        "status": "active",
+        "paused": False,
+    }
+
+    with patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.find_zone",
+        MagicMock(return_value=mock_zone),
+    ) as mock_find_zone:
+        assert cloudflare_tunnel_module._get_zone_id("a.b.example.co.uk") == {
+            "id": "023e105f4ecef8ad9ca31a8372d0c353",
+            "name": "example.co.uk",
+            "status": "active",
+        }
+        assert mock_find_zone.call_args.args[1] == "a.b.example.co.uk"
+
+
+def test_get_zone_id_no_zone():
+    with patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.find_zone",
+        MagicMock(return_value=None),
+    ):
+        assert cloudflare_tunnel_module._get_zone_id("test.example.org") is False
+
+
+def test_get_dns_snapshot():
+    zones = {
+        "test.example.com": {"id": "1234ABC", "name": "example.com", "status": "active"},
+        "test-2.example.com": {"id": "1234ABC", "name": "example.com", "status": "active"},
+        "test.example.org": {"id": "5678DEF", "name": "example.org", "status": "active"},
+    }
+    mock_dns = {
+        "id": "372e67954025e0ba6aaa6d586b9e0b59",
+        "type": "CNAME",
+        "name": "test.example.com",
+        "content": "f70ff985-a4ef-4643-bbbc-4a0ed4fc8415.cfargotunnel.com",
+        "proxiable": True,
+        "proxied": True,
+        "comment": "DNS managed by SaltStack",
+        "ttl": 1,
+        "zone_id": "1234ABC",
+        "zone_name": "example.com",
+    }
+
+    with patch(
+        "saltext.cloudflare_tunnel.modules.cloudflare_tunnel_mod._get_zone_id",
+        MagicMock(side_effect=zones.get),
+    ):
+        with patch(
+            "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.get_dns_snapshot",
+            MagicMock(side_effect=[{"test.example.com": mock_dns}, {}]),
+        ) as mock_snapshot:
+            assert cloudflare_tunnel_module.get_dns_snapshot(list(zones)) == {
+                "test.example.com": {
+                    "id": "372e67954025e0ba6aaa6d586b9e0b59",
+                    "name": "test.example.com",
+                    "type": "CNAME",
+                    "content": "f70ff985-a4ef-4643-bbbc-4a0ed4fc8415.cfargotunnel.com",
+                    "proxied": True,
+                    "zone_id": "1234ABC",
+                    "comment": "DNS managed by SaltStack",
+                }
+            }
+            assert mock_snapshot.call_count == 2
+
+
+def test_get_dns_snapshot_no_zone():
+    with patch(
+        "saltext.cloudflare_tunnel.modules.cloudflare_tunnel_mod._get_zone_id",
+        MagicMock(return_value=False),
+    ):
+        with pytest.raises(salt.exceptions.ArgumentValueError):
+            cloudflare_tunnel_module.get_dns_snapshot(["test.example.com"])
+
+
+def test_apply_dns_batch():
+    create = {
+        "name": "test.example.com",
+        "type": "CNAME",
+        "content": "f70ff985-a4ef-4643-bbbc-4a0ed4fc8415.cfargotunnel.com",
+        "proxied": True,
+    }
+    update = dict(create, id="372e67954025e0ba6aaa6d586b9e0b59", name="test-2.example.com")
+    mock_response = {
+        "deletes": [{"id": "023e105f4ecef8ad9ca31a8372d0c353", "name": "old.example.com"}],
+        "puts": [update],
+        "posts": [dict(create, id="9a7806061c88ada191ed06f989cc3dac")],
+    }
+
+    with patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.batch_dns",
+        MagicMock(return_value=mock_response),
+    ) as mock_batch:
+        assert cloudflare_tunnel_module.apply_dns_batch(
+            "1234ABC",
+            creates=[create],
+            updates=[update],
+            deletes=["023e105f4ecef8ad9ca31a8372d0c353"],
+        ) == [
+            {
+                "name": "old.example.com",
+                "id": "023e105f4ecef8ad9ca31a8372d0c353",
+                "action": "deleted",
+                "result": True,
+            },
+            {
+                "name": "test-2.example.com",
+                "id": "372e67954025e0ba6aaa6d586b9e0b59",
+                "action": "updated",
+                "result": True,
+            },
+            {
+                "name": "test.example.com",
+                "id": "9a7806061c88ada191ed06f989cc3dac",
+                "action": "created",
+                "result": True,
+            },
+        ]
+        assert mock_batch.call_count == 1
+
+
+def test_apply_dns_batch_chunks():
+    creates = [
+        {"name": f"test-{idx}.example.com", "type": "CNAME", "content": "target"}
+        for idx in range(5)
+    ]
+
+    with patch.dict(
+        cloudflare_tunnel_module.__salt__,
+        {"config.get": MagicMock(return_value={"api_token": "token", "dns_batch_size": 2})},
+    ):
+        with patch(
+            "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.batch_dns",
+            MagicMock(
+                side_effect=[
+                    {"posts": creates[0:2]},
+                    salt.exceptions.CommandExecutionError("Record already exists"),
+                    {"posts": creates[4:5]},
+                ]
+            ),
+        ) as mock_batch:
+            results = cloudflare_tunnel_module.apply_dns_batch("1234ABC", creates=creates)
+
+    assert mock_batch.call_count == 3
+    assert [result["result"] for result in results] == [True, True, False, False, True]
+    assert results[2]["comment"] == "Record already exists"
+    assert results[3]["name"] == "test-3.example.com"
+
+
+def test_lookups_memoized_in_context():
+    mock_tunnel = [
+        {
+            "id": "f70ff985-a4ef-4643-bbbc-4a0ed4fc8415",
+            "account_tag": "699d98642c564d2e855e9661899b7252",
+            "name": "blog",
+            "status": "healthy",
+        }
+    ]
+    mock_config = {
+        "tunnel_id": "f70ff985-a4ef-4643-bbbc-4a0ed4fc8415",
+        "config": {"ingress": [{"service": "http_status:404"}]},
+    }
+    mock_zone = {"id": "1234ABC", "name": "example.com", "status": "active"}
+    mock_config_get = MagicMock(return_value={"api_token": "token", "account": "account"})
+
+    with patch.dict(cloudflare_tunnel_module.__salt__, {"config.get": mock_config_get}):
+        with patch(
+            "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.get_tunnel",
+            MagicMock(return_value=mock_tunnel),
+        ) as mock_get_tunnel, patch(
+            "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.get_tunnel_config",
+            MagicMock(return_value=mock_config),
+        ) as mock_get_config, patch(
+            "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.find_zone",
+            MagicMock(return_value=mock_zone),
+        ) as mock_find_zone:
+            for _ in range(3):
+                tunnel = cloudflare_tunnel_module.get_tunnel("blog")
+                cloudflare_tunnel_module.get_tunnel_config(tunnel["id"])
+                cloudflare_tunnel_module._get_zone_id("test.example.com")
+
+    assert mock_config_get.call_count == 1
+    assert mock_get_tunnel.call_count == 1
+    assert mock_get_config.call_count == 1
+    assert mock_find_zone.call_count == 1
+
+
+def test_list_tunnels_memoizes_lookups():
+    mock_tunnels = [
+        {
+            "id": "f70ff985-a4ef-4643-bbbc-4a0ed4fc8415",
+            "account_tag": "699d98642c564d2e855e9661899b7252",
+            "name": "blog",
+            "status": "healthy",
+        }
+    ]
+    mock_created = dict(mock_tunnels[0], id="a1b2c3", name="shop", status="inactive")
+
+    with patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.list_tunnels",
+        MagicMock(return_value=mock_tunnels),
+    ) as mock_list_tunnels, patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.get_tunnel"
+    ) as mock_get_tunnel, patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.create_tunnel",
+        MagicMock(return_value=mock_created),
+    ):
+        assert cloudflare_tunnel_module.list_tunnels() == mock_tunnels
+        assert cloudflare_tunnel_module.get_tunnel("blog") == mock_tunnels[0]
+        assert cloudflare_tunnel_module.get_tunnel("shop") is False
+        assert cloudflare_tunnel_module.create_tunnel("shop") == mock_created
+        assert cloudflare_tunnel_module.get_tunnel("shop") == mock_created
+        assert cloudflare_tunnel_module.list_tunnels() == mock_tunnels + [mock_created]
+
+    mock_list_tunnels.assert_called_once()
+    mock_get_tunnel.assert_not_called()
+
+
+def test_context_memo_invalidated_on_write():
+    mock_config = {
+        "tunnel_id": "f70ff985-a4ef-4643-bbbc-4a0ed4fc8415",
+        "config": {"ingress": [{"service": "http_status:404"}]},
+    }
+
+    with patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.get_tunnel_config",
+        MagicMock(return_value=mock_config),
+    ) as mock_get_config, patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.create_tunnel_config",
+        MagicMock(return_value=mock_config),
+    ):
+        cloudflare_tunnel_module.get_tunnel_config("f70ff985-a4ef-4643-bbbc-4a0ed4fc8415")
+        cloudflare_tunnel_module.create_tunnel_config(
+            "f70ff985-a4ef-4643-bbbc-4a0ed4fc8415", {"ingress": []}
+        )
+        cloudflare_tunnel_module.get_tunnel_config("f70ff985-a4ef-4643-bbbc-4a0ed4fc8415")
+
+    assert mock_get_config.call_count == 2
+
+
+def test_dns_snapshot_memoized_until_zone_written():
+    mock_zone = {"id": "1234ABC", "name": "example.com", "status": "active"}
+    mock_dns = {
+        "id": "1",
+        "name": "test.example.com",
+        "type": "CNAME",
+        "content": "f70ff985-a4ef-4643-bbbc-4a0ed4fc8415.cfargotunnel.com",
+        "proxied": True,
+        "zone_id": "1234ABC",
+        "comment": "DNS managed by SaltStack",
+    }
+
+    with patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.find_zone",
+        MagicMock(return_value=mock_zone),
+    ), patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.get_dns_snapshot",
+        MagicMock(return_value={}),
+    ) as mock_snapshot, patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.get_dns",
+        MagicMock(return_value=[]),
+    ), patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.create_dns",
+        MagicMock(return_value=mock_dns),
+    ):
+        cloudflare_tunnel_module.get_dns_snapshot(["test.example.com"])
+        cloudflare_tunnel_module.get_dns_snapshot(["other.example.com"])
+        assert mock_snapshot.call_count == 1
+
+        cloudflare_tunnel_module.create_dns(
+            "test.example.com", "f70ff985-a4ef-4643-bbbc-4a0ed4fc8415"
+        )
+        cloudflare_tunnel_module.get_dns_snapshot(["test.example.com"])
+
+    assert mock_snapshot.call_count == 2
+
+
+def test_dns_snapshot_kept_when_record_unchanged():
+    mock_zone = {"id": "1234ABC", "name": "example.com", "status": "active"}
+    mock_dns = {
+        "id": "1",
+        "name": "test.example.com",
+        "type": "CNAME",
+        "content": "f70ff985-a4ef-4643-bbbc-4a0ed4fc8415.cfargotunnel.com",
+        "proxied": True,
+        "zone_id": "1234ABC",
+        "comment": "DNS managed by SaltStack",
+    }
+
+    with patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.find_zone",
+        MagicMock(return_value=mock_zone),
+    ), patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.get_dns_snapshot",
+        MagicMock(return_value={"test.example.com": mock_dns}),
+    ) as mock_snapshot, patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.get_dns",
+        MagicMock(return_value=[mock_dns]),
+    ), patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.create_dns", MagicMock()
+    ) as mock_create_dns:
+        cloudflare_tunnel_module.get_dns_snapshot(["test.example.com"])
+        cloudflare_tunnel_module.create_dns(
+            "test.example.com", "f70ff985-a4ef-4643-bbbc-4a0ed4fc8415"
+        )
+        cloudflare_tunnel_module.get_dns_snapshot(["test.example.com"])
+
+    mock_create_dns.assert_not_called()
+    assert mock_snapshot.call_count == 1
+
+
+def test_context_memo_expires():
+    with patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.get_tunnel",
+        MagicMock(return_value=[]),
+    ) as mock_get_tunnel:
+        cloudflare_tunnel_module.get_tunnel("blog")
+        with patch.object(cloudflare_tunnel_module, "CONTEXT_CACHE_TTL", -1):
+            cloudflare_tunnel_module.get_tunnel("blog")
+
+    assert mock_get_tunnel.call_count == 2
+
+
+def test_disk_cache_shared_between_runs(tmp_path):
+    mock_tunnel = [
+        {
+            "id": "f70ff985-a4ef-4643-bbbc-4a0ed4fc8415",
+            "account_tag": "699d98642c564d2e855e9661899b7252",
+            "name": "blog",
+            "status": "healthy",
+        }
+    ]
+    mock_zone = {"id": "1234ABC", "name": "example.com", "status": "active"}
+    mock_config_get = MagicMock(
+        return_value={"api_token": "token", "account": "account", "disk_cache": True}
+    )
+
+    with patch.dict(
+        cloudflare_tunnel_module.__salt__, {"config.get": mock_config_get}
+    ), patch.dict(cloudflare_tunnel_module.__opts__, {"cachedir": str(tmp_path)}), patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.get_tunnel",
+        MagicMock(return_value=mock_tunnel),
+    ) as mock_get_tunnel, patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.find_zone",
+        MagicMock(return_value=mock_zone),
+    ) as mock_find_zone, patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.get_dns_snapshot",
+        MagicMock(return_value={}),
+    ) as mock_snapshot:
+        for _ in range(2):
+            # Every salt-call run starts with an empty __context__
+            cloudflare_tunnel_module.__context__.clear()
+            cloudflare_tunnel_module.get_tunnel("blog")
+            cloudflare_tunnel_module.get_dns_snapshot(["test.example.com"])
+
+        stats = cloudflare_tunnel_module.cache_stats()
+
+    assert mock_get_tunnel.call_count == 1
+    assert mock_find_zone.call_count == 1
+    assert mock_snapshot.call_count == 1
+    assert stats["enabled"] is True
+    assert stats["hits"] == 3
+    assert {entity: info["entries"] for entity, info in stats["entities"].items()} == {
+        "tunnels": 1,
+        "zones": 1,
+        "dns": 1,
+    }
+
+
+def test_disk_cache_invalidated_on_write(tmp_path):
+    mock_config_get = MagicMock(
+        return_value={"api_token": "token", "account": "account", "disk_cache": True}
+    )
+
+    with patch.dict(
+        cloudflare_tunnel_module.__salt__, {"config.get": mock_config_get}
+    ), patch.dict(cloudflare_tunnel_module.__opts__, {"cachedir": str(tmp_path)}), patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.batch_dns",
+        MagicMock(return_value={}),
+    ):
+        cache = cloudflare_tunnel_module._inventory_cache()
+        cache.set("dns", "1234ABC", {})
+        cache.set("dns", "5678DEF", {})
+        cache.set("tunnels", "account:blog", {"id": "1234"})
+
+        cloudflare_tunnel_module.apply_dns_batch("1234ABC", deletes=["372e6795"])
+
+        assert cache.get("dns", "1234ABC") is None
+        assert cache.get("dns", "5678DEF") == {}
+        assert cache.get("tunnels", "account:blog") == {"id": "1234"}
+
+
+def test_cache_clear(tmp_path):
+    with patch.dict(cloudflare_tunnel_module.__opts__, {"cachedir": str(tmp_path)}):
+        cache = cloudflare_tunnel_module._inventory_cache()
+        cache.set("dns", "1234ABC", {})
+        cache.set("tunnels", "account:blog", {"id": "1234"})
+
+        assert cloudflare_tunnel_module.cache_clear("dns") is True
+        assert list(cloudflare_tunnel_module.cache_stats()["entities"]) == ["tunnels"]
+
+        assert cloudflare_tunnel_module.cache_clear() is True
+        assert cloudflare_tunnel_module.cache_stats()["entities"] == {}
+
+        with pytest.raises(salt.exceptions.ArgumentValueError):
+            cloudflare_tunnel_module.cache_clear("configs")
+
+
+def test_stats():
+    mock_stats = {"GET zones": {"count": 1, "errors": 0, "retries": 0}}
+
+    with patch(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod.api_stats",
+        MagicMock(return_value=mock_stats),
+    ) as mock_api_stats:
+        assert cloudflare_tunnel_module.stats(reset=True) == mock_stats
+
+    mock_api_stats.assert_called_once_with(reset=True)
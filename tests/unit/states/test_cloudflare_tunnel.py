@@ -1,7 +1,11 @@
+import threading
+import time
 from unittest.mock import MagicMock
 from unittest.mock import patch
 
 import pytest
+import salt.exceptions
+import salt.utils.json
 import saltext.cloudflare_tunnel.modules.cloudflare_tunnel_mod as cloudflare_tunnel_module
 import saltext.cloudflare_tunnel.states.cloudflare_tunnel_mod as cloudflare_tunnel_state
 
@@ -100,7 +104,7 @@ def configure_loader_modules():
         },
         cloudflare_tunnel_state: {
             "__salt__": {
-                # "cloudflare_tunnel.example_function": cloudflare_tunnel_module.example_function,
+                "config.get": MagicMock(return_value={"max_workers": 4}),
             },
         },
     }
@@ -136,7 +140,7 @@ def test_present():
         {
             "cloudflare_tunnel.get_tunnel": MagicMock(return_value=False),
             "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=False),
-            "cloudflare_tunnel.get_dns": MagicMock(return_value=False),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(return_value={}),
             "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=False),
             "cloudflare_tunnel.create_tunnel": MagicMock(return_value=mock_tunnel),
             "cloudflare_tunnel.create_tunnel_config": MagicMock(return_value=mock_config),
@@ -197,7 +201,7 @@ def test_present_multiple_dns():
         {
             "cloudflare_tunnel.get_tunnel": MagicMock(return_value=False),
             "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=False),
-            "cloudflare_tunnel.get_dns": MagicMock(return_value=False),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(return_value={}),
             "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=False),
             "cloudflare_tunnel.create_tunnel": MagicMock(return_value=mock_tunnel),
             "cloudflare_tunnel.create_tunnel_config": MagicMock(return_value=mock_config_multiple),
@@ -212,6 +216,32 @@ def test_present_multiple_dns():
             )
 
 
+def test_present_hostname_with_several_paths():
+    ingress = [
+        {"hostname": "test.example.com", "path": "/api", "service": "https://localhost:8080"},
+        {"hostname": "test.example.com", "service": "https://localhost:8000"},
+        {"service": "http_status:404"},
+    ]
+    mock_create_dns = MagicMock(return_value=mock_dns)
+
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "cloudflare_tunnel.get_tunnel": MagicMock(return_value=mock_tunnel),
+            "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(return_value={}),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
+            "cloudflare_tunnel.create_tunnel_config": MagicMock(return_value=mock_config),
+            "cloudflare_tunnel.create_dns": mock_create_dns,
+        },
+    ), patch.dict(cloudflare_tunnel_state.__opts__, {"test": False}):
+        ret = cloudflare_tunnel_state.present("cf_tunnel_example", ingress)
+
+    assert ret["result"] is True, ret["comment"]
+    assert ret["changes"]["test.example.com"]["result"] == "Added"
+    mock_create_dns.assert_called_once_with("test.example.com", mock_tunnel["id"])
+
+
 def test_present_update_ingress_dns():
     expected_result = {
         "name": "cf_tunnel_example",
@@ -267,11 +297,13 @@ def test_present_update_ingress_dns():
         {
             "cloudflare_tunnel.get_tunnel": MagicMock(return_value=mock_tunnel),
             "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config),
-            "cloudflare_tunnel.get_dns": MagicMock(side_effect=[mock_dns, False, mock_dns]),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(
+                return_value={"test.example.com": mock_dns}
+            ),
             "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
             "cloudflare_tunnel.create_tunnel_config": MagicMock(return_value=updated_mock_config),
             "cloudflare_tunnel.create_dns": MagicMock(return_value=updated_mock_dns),
-            "cloudflare_tunnel.remove_dns": MagicMock(return_value=True),
+            "cloudflare_tunnel.remove_dns_by_id": MagicMock(return_value=True),
         },
     ):
         with patch.dict(cloudflare_tunnel_state.__opts__, {"test": False}):
@@ -317,10 +349,12 @@ def test_present_remove_ingress_rule():
         {
             "cloudflare_tunnel.get_tunnel": MagicMock(return_value=mock_tunnel),
             "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config),
-            "cloudflare_tunnel.get_dns": MagicMock(return_value=mock_dns),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(
+                return_value={"test.example.com": mock_dns}
+            ),
             "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
             "cloudflare_tunnel.create_tunnel_config": MagicMock(return_value=updated_mock_config),
-            "cloudflare_tunnel.remove_dns": MagicMock(return_value=True),
+            "cloudflare_tunnel.remove_dns_by_id": MagicMock(return_value=True),
         },
     ):
         with patch.dict(cloudflare_tunnel_state.__opts__, {"test": False}):
@@ -365,7 +399,9 @@ def test_present_update_ingress_rule():
         {
             "cloudflare_tunnel.get_tunnel": MagicMock(return_value=mock_tunnel),
             "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config),
-            "cloudflare_tunnel.get_dns": MagicMock(return_value=mock_dns),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(
+                return_value={"test.example.com": mock_dns}
+            ),
             "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
             "cloudflare_tunnel.create_tunnel_config": MagicMock(return_value=updated_mock_config),
         },
@@ -377,6 +413,96 @@ def test_present_update_ingress_rule():
             )
 
 
+def test_present_update_dns_by_id():
+    other_tunnel_dns = dict(mock_dns, content="other.cfargotunnel.com")
+    mock_create_dns = MagicMock()
+    mock_update_dns_by_id = MagicMock(return_value=mock_dns)
+
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "cloudflare_tunnel.get_tunnel": MagicMock(return_value=mock_tunnel),
+            "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(
+                return_value={"test.example.com": other_tunnel_dns}
+            ),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
+            "cloudflare_tunnel.create_dns": mock_create_dns,
+            "cloudflare_tunnel.update_dns_by_id": mock_update_dns_by_id,
+        },
+    ):
+        with patch.dict(cloudflare_tunnel_state.__opts__, {"test": False}):
+            ret = cloudflare_tunnel_state.present(
+                "cf_tunnel_example", ingress_rules, repoint_dns=True
+            )
+
+    assert ret["changes"]["test.example.com"]["result"] == "Updated"
+    mock_update_dns_by_id.assert_called_once_with(
+        mock_dns["zone_id"], mock_dns["id"], "test.example.com", mock_tunnel["id"]
+    )
+    mock_create_dns.assert_not_called()
+
+
+@pytest.mark.parametrize("tunnel", [mock_tunnel, False])
+def test_present_foreign_dns_left_alone(tmp_path, tunnel):
+    other_tunnel_dns = dict(mock_dns, content="other.cfargotunnel.com")
+    address_dns = dict(mock_dns, name="test-2.example.com", type="A", content="198.51.100.4")
+    mock_update_dns_by_id = MagicMock()
+    mock_create_dns = MagicMock()
+
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "config.get": MagicMock(return_value={"fingerprint": True}),
+            "cloudflare_tunnel.get_tunnel": MagicMock(return_value=tunnel),
+            "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config_multiple),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(
+                return_value={
+                    "test.example.com": other_tunnel_dns,
+                    "test-2.example.com": address_dns,
+                    "test-3.example.com": dict(mock_dns, name="test-3.example.com"),
+                }
+            ),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
+            "cloudflare_tunnel.create_tunnel": MagicMock(return_value=mock_tunnel),
+            "cloudflare_tunnel.create_tunnel_config": MagicMock(return_value=mock_config_multiple),
+            "cloudflare_tunnel.create_dns": mock_create_dns,
+            "cloudflare_tunnel.update_dns_by_id": mock_update_dns_by_id,
+        },
+    ), patch.dict(cloudflare_tunnel_state.__opts__, {"test": False, "cachedir": str(tmp_path)}):
+        ret = cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules_multiple)
+        stored = cloudflare_tunnel_state._fingerprints().get("fingerprints", "cf_tunnel_example")
+
+    assert ret["result"] is True
+    mock_update_dns_by_id.assert_not_called()
+    mock_create_dns.assert_not_called()
+    # A later run with repoint_dns must still look the records up
+    assert stored is None
+
+
+def test_present_repoint_dns_spares_other_record_types():
+    address_dns = dict(mock_dns, type="A", content="198.51.100.4")
+    mock_update_dns_by_id = MagicMock()
+
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "cloudflare_tunnel.get_tunnel": MagicMock(return_value=mock_tunnel),
+            "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(
+                return_value={"test.example.com": address_dns}
+            ),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
+            "cloudflare_tunnel.update_dns_by_id": mock_update_dns_by_id,
+        },
+    ), patch.dict(cloudflare_tunnel_state.__opts__, {"test": False}):
+        ret = cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules, repoint_dns=True)
+
+    assert ret["result"] is True
+    assert ret["changes"] == {}
+    mock_update_dns_by_id.assert_not_called()
+
+
 def test_present_no_changes():
     expected_result = {
         "name": "cf_tunnel_example",
@@ -390,7 +516,9 @@ def test_present_no_changes():
         {
             "cloudflare_tunnel.get_tunnel": MagicMock(return_value=mock_tunnel),
             "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config),
-            "cloudflare_tunnel.get_dns": MagicMock(return_value=mock_dns),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(
+                return_value={"test.example.com": mock_dns}
+            ),
             "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
         },
     ):
@@ -401,134 +529,351 @@ def test_present_no_changes():
             )
 
 
-def test_present_create_tunnel_test_mode():
-    expected_result = {
-        "name": "cf_tunnel_example",
-        "changes": {},
-        "result": None,
-        "comment": "Tunnel cf_tunnel_example will be created",
-    }
-
+def test_present_no_changes_without_catch_all():
     with patch.dict(
         cloudflare_tunnel_state.__salt__,
         {
-            "cloudflare_tunnel.get_tunnel": MagicMock(return_value=False),
-            "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=False),
-            "cloudflare_tunnel.get_dns": MagicMock(return_value=False),
-            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=False),
+            "cloudflare_tunnel.get_tunnel": MagicMock(return_value=mock_tunnel),
+            "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(
+                return_value={"test.example.com": mock_dns}
+            ),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
         },
     ):
-        with patch.dict(cloudflare_tunnel_state.__opts__, {"test": True}):
-            assert (
-                cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules)
-                == expected_result
+        with patch.dict(cloudflare_tunnel_state.__opts__, {"test": False}):
+            ret = cloudflare_tunnel_state.present(
+                "cf_tunnel_example",
+                [{"hostname": "test.example.com", "service": "https://LOCALHOST:8000/"}],
             )
 
+    assert ret["changes"] == {}
+    assert ret["result"] is True
 
-def test_present_create_config_test_mode():
-    expected_result = {
-        "name": "cf_tunnel_example",
-        "changes": {
-            "tunnel config": {
-                "old": [],
-                "new": [
-                    {"hostname": "test.example.com", "service": "https://localhost:8000"},
-                    {"service": "http_status:404"},
-                ],
-            },
+
+def test_present_reordered_ingress_rules():
+    reordered_rules = [ingress_rules_multiple[1], ingress_rules_multiple[0]]
+    reordered_rules.extend(ingress_rules_multiple[2:])
+    mock_create_tunnel_config = MagicMock(return_value=mock_config_multiple)
+
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "cloudflare_tunnel.get_tunnel": MagicMock(return_value=mock_tunnel),
+            "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config_multiple),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(
+                return_value={dns["name"]: dns for dns in mock_dns_multiple}
+            ),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
+            "cloudflare_tunnel.create_tunnel_config": mock_create_tunnel_config,
         },
-        "result": None,
-        "comment": "Tunnel config will be created/updated",
+    ):
+        with patch.dict(cloudflare_tunnel_state.__opts__, {"test": False}):
+            ret = cloudflare_tunnel_state.present("cf_tunnel_example", reordered_rules)
+
+    assert ret["changes"] == {
+        "tunnel config": {
+            "old": [],
+            "new": [],
+            "reordered": [
+                {"hostname": "test-2.example.com", "service": "https://localhost:443"},
+                {"hostname": "test.example.com", "service": "https://localhost:8000"},
+            ],
+        }
     }
+    mock_create_tunnel_config.assert_called_once()
+
+
+def _test_mode_actions(ret, cachedir):
+    """
+    Returns the actions listed in the comment of a test run, checking the plan it saved
+    """
+    *actions, saved = ret["comment"].split("\n")
+    plan_id = saved.split()[1]
+    assert saved == f"Plan {plan_id} saved, apply it with plan={plan_id}"
+    assert (cachedir / "cloudflare_tunnel" / "plans" / f"{plan_id}.json").exists()
+    return actions
 
+
+def test_present_create_tunnel_test_mode(tmp_path):
     with patch.dict(
         cloudflare_tunnel_state.__salt__,
         {
-            "cloudflare_tunnel.get_tunnel": MagicMock(return_value=mock_tunnel),
+            "cloudflare_tunnel.get_tunnel": MagicMock(return_value=False),
             "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=False),
-            "cloudflare_tunnel.get_dns": MagicMock(return_value=False),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(return_value={}),
             "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=False),
         },
     ):
-        with patch.dict(cloudflare_tunnel_state.__opts__, {"test": True}):
-            assert (
-                cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules)
-                == expected_result
-            )
+        with patch.dict(
+            cloudflare_tunnel_state.__opts__, {"test": True, "cachedir": str(tmp_path)}
+        ):
+            ret = cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules)
+
+    assert ret["result"] is None
+    assert ret["changes"] == {"tunnel config": {"old": [], "new": ingress_rules}}
+    assert _test_mode_actions(ret, tmp_path) == [
+        "Tunnel cf_tunnel_example will be created",
+        "Tunnel config will be created/updated",
+        "DNS test.example.com will be created",
+        "Cloudflare connector will be installed",
+    ]
 
 
-def test_present_create_dns_test_mode():
-    expected_result = {
-        "name": "cf_tunnel_example",
-        "changes": {},
-        "result": None,
-        "comment": "\nDNS test.example.com will be created",
+def test_present_create_config_test_mode(tmp_path):
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "cloudflare_tunnel.get_tunnel": MagicMock(return_value=mock_tunnel),
+            "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=False),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(return_value={}),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
+        },
+    ):
+        with patch.dict(
+            cloudflare_tunnel_state.__opts__, {"test": True, "cachedir": str(tmp_path)}
+        ):
+            ret = cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules)
+
+    assert ret["result"] is None
+    assert ret["changes"] == {
+        "tunnel config": {
+            "old": [],
+            "new": [
+                {"hostname": "test.example.com", "service": "https://localhost:8000"},
+                {"service": "http_status:404"},
+            ],
+        },
     }
+    assert _test_mode_actions(ret, tmp_path) == [
+        "Tunnel config will be created/updated",
+        "DNS test.example.com will be created",
+    ]
 
+
+def test_present_create_dns_test_mode(tmp_path):
     with patch.dict(
         cloudflare_tunnel_state.__salt__,
         {
             "cloudflare_tunnel.get_tunnel": MagicMock(return_value=mock_tunnel),
             "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config),
-            "cloudflare_tunnel.get_dns": MagicMock(return_value=False),
-            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=False),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(return_value={}),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
         },
     ):
-        with patch.dict(cloudflare_tunnel_state.__opts__, {"test": True}):
-            assert (
-                cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules)
-                == expected_result
-            )
+        with patch.dict(
+            cloudflare_tunnel_state.__opts__, {"test": True, "cachedir": str(tmp_path)}
+        ):
+            ret = cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules)
 
+    assert ret["changes"] == {}
+    assert _test_mode_actions(ret, tmp_path) == ["DNS test.example.com will be created"]
 
-def test_present_create_dns_multiple_test_mode():
-    expected_result = {
-        "name": "cf_tunnel_example",
-        "changes": {},
-        "result": None,
-        "comment": "\nDNS test.example.com will be created\nDNS test-2.example.com will be created\
-\nDNS test-3.example.com will be created",
-    }
+
+def test_present_create_dns_multiple_test_mode(tmp_path):
+    other_tunnel_dns = dict(mock_dns_multiple[0], content="other.cfargotunnel.com")
 
     with patch.dict(
         cloudflare_tunnel_state.__salt__,
         {
             "cloudflare_tunnel.get_tunnel": MagicMock(return_value=mock_tunnel),
             "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config_multiple),
-            "cloudflare_tunnel.get_dns": MagicMock(return_value=False),
-            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=False),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(
+                return_value={"test.example.com": other_tunnel_dns}
+            ),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
         },
     ):
-        with patch.dict(cloudflare_tunnel_state.__opts__, {"test": True}):
-            assert (
-                cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules_multiple)
-                == expected_result
+        with patch.dict(
+            cloudflare_tunnel_state.__opts__, {"test": True, "cachedir": str(tmp_path)}
+        ):
+            ret = cloudflare_tunnel_state.present(
+                "cf_tunnel_example", ingress_rules_multiple, repoint_dns=True
             )
 
+    assert _test_mode_actions(ret, tmp_path) == [
+        "DNS test-2.example.com will be created",
+        "DNS test-3.example.com will be created",
+        "DNS test.example.com will be updated",
+    ]
 
-def test_present_install_connector_test_mode():
-    expected_result = {
-        "name": "cf_tunnel_example",
-        "changes": {},
-        "result": None,
-        "comment": "Cloudflare connector will be installed",
-    }
+
+def test_present_repeated_hostname_test_mode(tmp_path):
+    ingress = [
+        {"hostname": "test.example.com", "path": "/api", "service": "https://localhost:8080"},
+        {"hostname": "Test.example.com", "service": "https://localhost:8000"},
+    ]
 
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "cloudflare_tunnel.get_tunnel": MagicMock(return_value=False),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(return_value={}),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
+        },
+    ), patch.dict(cloudflare_tunnel_state.__opts__, {"test": True, "cachedir": str(tmp_path)}):
+        ret = cloudflare_tunnel_state.present("cf_tunnel_example", ingress)
+
+    assert _test_mode_actions(ret, tmp_path) == [
+        "Tunnel cf_tunnel_example will be created",
+        "Tunnel config will be created/updated",
+        "DNS test.example.com will be created",
+    ]
+
+
+def test_present_install_connector_test_mode(tmp_path):
     with patch.dict(
         cloudflare_tunnel_state.__salt__,
         {
             "cloudflare_tunnel.get_tunnel": MagicMock(return_value=mock_tunnel),
             "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config),
-            "cloudflare_tunnel.get_dns": MagicMock(return_value=mock_dns),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(
+                return_value={"test.example.com": mock_dns}
+            ),
             "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=False),
         },
     ):
+        with patch.dict(
+            cloudflare_tunnel_state.__opts__, {"test": True, "cachedir": str(tmp_path)}
+        ):
+            ret = cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules)
+
+    assert _test_mode_actions(ret, tmp_path) == ["Cloudflare connector will be installed"]
+
+
+def test_present_apply_saved_plan(tmp_path):
+    mock_get_tunnel = MagicMock(return_value=mock_tunnel)
+    mock_get_tunnel_config = MagicMock(return_value=dict(mock_config, version=7))
+    mock_get_dns_snapshot = MagicMock(return_value={})
+    mock_create_dns = MagicMock(return_value=mock_dns)
+
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "cloudflare_tunnel.get_tunnel": mock_get_tunnel,
+            "cloudflare_tunnel.get_tunnel_config": mock_get_tunnel_config,
+            "cloudflare_tunnel.get_dns_snapshot": mock_get_dns_snapshot,
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
+            "cloudflare_tunnel.create_dns": mock_create_dns,
+        },
+    ), patch.dict(cloudflare_tunnel_state.__opts__, {"cachedir": str(tmp_path)}):
         with patch.dict(cloudflare_tunnel_state.__opts__, {"test": True}):
-            assert (
-                cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules)
-                == expected_result
+            planned = cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules)
+        plan_id = planned["comment"].split("\n")[-1].split()[1]
+
+        with patch.dict(cloudflare_tunnel_state.__opts__, {"test": False}):
+            ret = cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules, plan=plan_id)
+            again = cloudflare_tunnel_state.present(
+                "cf_tunnel_example", ingress_rules, plan=plan_id
             )
 
+    assert ret["result"] is True
+    assert ret["changes"]["test.example.com"]["result"] == "Added"
+    mock_create_dns.assert_called_once_with("test.example.com", mock_tunnel["id"])
+    # Only the configuration version was read again
+    assert mock_get_tunnel.call_count == 1
+    assert mock_get_dns_snapshot.call_count == 1
+    assert mock_get_tunnel_config.call_count == 2
+    # An applied plan is removed
+    assert again["result"] is False
+    assert again["comment"] == f"Plan {plan_id} does not exist"
+
+
+def test_present_saved_plan_out_of_date(tmp_path):
+    mock_create_dns = MagicMock(return_value=mock_dns)
+
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "cloudflare_tunnel.get_tunnel": MagicMock(return_value=mock_tunnel),
+            "cloudflare_tunnel.get_tunnel_config": MagicMock(
+                side_effect=[dict(mock_config, version=7), dict(mock_config, version=8)]
+            ),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(return_value={}),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
+            "cloudflare_tunnel.create_dns": mock_create_dns,
+        },
+    ), patch.dict(cloudflare_tunnel_state.__opts__, {"cachedir": str(tmp_path)}):
+        with patch.dict(cloudflare_tunnel_state.__opts__, {"test": True}):
+            planned = cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules)
+        plan_id = planned["comment"].split("\n")[-1].split()[1]
+
+        with patch.dict(cloudflare_tunnel_state.__opts__, {"test": False}):
+            ret = cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules, plan=plan_id)
+            other_ingress = cloudflare_tunnel_state.present(
+                "cf_tunnel_example", ingress_rules_multiple, plan=plan_id
+            )
+            invalid = cloudflare_tunnel_state.present(
+                "cf_tunnel_example", ingress_rules, plan="../../etc/passwd"
+            )
+
+    assert ret["result"] is False
+    assert ret["comment"] == (
+        f"Plan {plan_id} is out of date, the tunnel configuration changed since it was made"
+    )
+    assert other_ingress["comment"] == (
+        f"Plan {plan_id} was made for another tunnel or other ingress rules"
+    )
+    assert invalid["comment"] == "Invalid plan id ../../etc/passwd"
+    mock_create_dns.assert_not_called()
+
+
+def test_present_saved_plan_tunnel_created_since(tmp_path):
+    mock_create_tunnel = MagicMock(return_value=mock_tunnel)
+
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "cloudflare_tunnel.get_tunnel": MagicMock(side_effect=[False, mock_tunnel]),
+            "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=False),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(return_value={}),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
+            "cloudflare_tunnel.create_tunnel": mock_create_tunnel,
+        },
+    ), patch.dict(cloudflare_tunnel_state.__opts__, {"cachedir": str(tmp_path)}):
+        with patch.dict(cloudflare_tunnel_state.__opts__, {"test": True}):
+            planned = cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules)
+        plan_id = planned["comment"].split("\n")[-1].split()[1]
+
+        with patch.dict(cloudflare_tunnel_state.__opts__, {"test": False}):
+            ret = cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules, plan=plan_id)
+
+    assert ret["result"] is False
+    assert ret["comment"] == (
+        f"Plan {plan_id} is out of date, tunnel cf_tunnel_example was created since it was made"
+    )
+    mock_create_tunnel.assert_not_called()
+
+
+def test_present_create_tunnel_already_exists():
+    mock_create_tunnel_config = MagicMock(return_value=mock_config)
+
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "cloudflare_tunnel.get_tunnel": MagicMock(return_value=False),
+            "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=False),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(return_value={}),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=False),
+            "cloudflare_tunnel.create_tunnel": MagicMock(
+                return_value=(False, "Tunnel cf_tunnel_example already exists")
+            ),
+            "cloudflare_tunnel.create_tunnel_config": mock_create_tunnel_config,
+        },
+    ), patch.dict(cloudflare_tunnel_state.__opts__, {"test": False}):
+        ret = cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules)
+
+    assert ret == {
+        "name": "cf_tunnel_example",
+        "changes": {},
+        "result": False,
+        "comment": (
+            "Cloudflare tunnel cf_tunnel_example could not be created:"
+            " Tunnel cf_tunnel_example already exists"
+        ),
+    }
+    mock_create_tunnel_config.assert_not_called()
+
 
 def test_absent():
     expected_result = {
@@ -541,6 +886,7 @@ def test_absent():
         "result": True,
         "comment": "Cloudflare Tunnel cf_tunnel_example has been removed",
     }
+    mock_remove_dns_by_id = MagicMock(return_value=True)
 
     with patch.dict(
         cloudflare_tunnel_state.__salt__,
@@ -548,14 +894,43 @@ def test_absent():
             "cloudflare_tunnel.get_tunnel": MagicMock(return_value=mock_tunnel),
             "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config),
             "cloudflare_tunnel.remove_connector": MagicMock(return_value=True),
-            "cloudflare_tunnel.get_dns": MagicMock(return_value=mock_dns),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(
+                return_value={"test.example.com": mock_dns}
+            ),
             "cloudflare_tunnel.remove_tunnel": MagicMock(return_value=True),
-            "cloudflare_tunnel.remove_dns": MagicMock(return_value=True),
+            "cloudflare_tunnel.remove_dns_by_id": mock_remove_dns_by_id,
         },
     ):
         with patch.dict(cloudflare_tunnel_state.__opts__, {"test": False}):
             assert cloudflare_tunnel_state.absent("cf_tunnel_example") == expected_result
 
+    mock_remove_dns_by_id.assert_called_once_with(mock_dns["zone_id"], mock_dns["id"])
+
+
+def test_absent_spares_address_records():
+    address_dns = dict(mock_dns, type="A", content="198.51.100.4")
+    mock_remove_dns_by_id = MagicMock(return_value=True)
+
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "cloudflare_tunnel.get_tunnel": MagicMock(return_value=mock_tunnel),
+            "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config),
+            "cloudflare_tunnel.remove_connector": MagicMock(return_value=True),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(
+                return_value={"test.example.com": address_dns}
+            ),
+            "cloudflare_tunnel.remove_tunnel": MagicMock(return_value=True),
+            "cloudflare_tunnel.remove_dns_by_id": mock_remove_dns_by_id,
+        },
+    ):
+        with patch.dict(cloudflare_tunnel_state.__opts__, {"test": False}):
+            ret = cloudflare_tunnel_state.absent("cf_tunnel_example")
+
+    assert ret["result"] is True
+    assert not ret["changes"]["dns"]
+    mock_remove_dns_by_id.assert_not_called()
+
 
 def test_absent_multiple_dns():
     expected_result = {
@@ -579,9 +954,11 @@ def test_absent_multiple_dns():
             "cloudflare_tunnel.get_tunnel": MagicMock(return_value=mock_tunnel),
             "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config_multiple),
             "cloudflare_tunnel.remove_connector": MagicMock(return_value=True),
-            "cloudflare_tunnel.get_dns": MagicMock(side_effect=mock_dns_multiple),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(
+                return_value={dns["name"]: dns for dns in mock_dns_multiple}
+            ),
             "cloudflare_tunnel.remove_tunnel": MagicMock(return_value=True),
-            "cloudflare_tunnel.remove_dns": MagicMock(return_value=True),
+            "cloudflare_tunnel.remove_dns_by_id": MagicMock(return_value=True),
         },
     ):
         with patch.dict(cloudflare_tunnel_state.__opts__, {"test": False}):
@@ -632,3 +1009,688 @@ def test_absent_tunnel_does_not_exist():
         {"cloudflare_tunnel.get_tunnel": MagicMock(return_value=False)},
     ):
         assert cloudflare_tunnel_state.absent("cf_tunnel_example") == expected_result
+
+
+def test_run_concurrently_bounded_and_ordered():
+    lock = threading.Lock()
+    running = {"now": 0, "max": 0}
+
+    def call(item):
+        with lock:
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+        time.sleep(0.01)
+        with lock:
+            running["now"] -= 1
+        if item == 3:
+            raise salt.exceptions.CommandExecutionError("Rate limited")
+        return item * 2
+
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {"config.get": MagicMock(return_value={"max_workers": 2})},
+    ):
+        results = cloudflare_tunnel_state._run_concurrently(call, list(range(6)))
+
+    assert running["max"] == 2
+    assert [item for item, _, _ in results] == list(range(6))
+    assert [result for _, result, _ in results] == [0, 2, 4, None, 8, 10]
+    assert isinstance(results[3][2], salt.exceptions.CommandExecutionError)
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        ("8", 8),
+        (2.0, 2),
+        (0, 1),
+        (-3, 1),
+        ("many", cloudflare_tunnel_state.DEFAULT_MAX_WORKERS),
+        (None, cloudflare_tunnel_state.DEFAULT_MAX_WORKERS),
+        ([8], cloudflare_tunnel_state.DEFAULT_MAX_WORKERS),
+    ],
+)
+def test_max_workers_coerced(value, expected):
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {"config.get": MagicMock(return_value={"max_workers": value})},
+    ):
+        assert cloudflare_tunnel_state._max_workers() == expected
+
+
+def test_present_lookups_run_concurrently():
+    # Each independent lookup waits for the others, so running them one after the other fails
+    barrier = threading.Barrier(3, timeout=5)
+
+    def lookup(value):
+        def _lookup(*args):  # pylint: disable=unused-argument
+            barrier.wait()
+            return value
+
+        return _lookup
+
+    mock_get_tunnel_config = MagicMock(return_value=mock_config)
+
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "config.get": MagicMock(return_value={"max_workers": 4}),
+            "cloudflare_tunnel.get_tunnel": MagicMock(side_effect=lookup(mock_tunnel)),
+            "cloudflare_tunnel.get_tunnel_config": mock_get_tunnel_config,
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(
+                side_effect=lookup({"test.example.com": mock_dns})
+            ),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(side_effect=lookup(True)),
+        },
+    ), patch.dict(cloudflare_tunnel_state.__opts__, {"test": False}):
+        ret = cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules)
+
+    assert ret["result"] is True
+    assert ret["changes"] == {}
+    mock_get_tunnel_config.assert_called_once_with(mock_tunnel["id"])
+
+
+def test_present_dns_error_does_not_stop_others():
+    expected_result = {
+        "name": "cf_tunnel_example",
+        "changes": {
+            "test.example.com": {
+                "comment": "Managed by SaltStack",
+                "content": "f70ff985-a4ef-4643-bbbc-4a0ed4fc8415.cfargotunnel.com",
+                "proxied": True,
+                "type": "CNAME",
+                "result": "Added",
+            },
+            "test-3.example.com": {
+                "comment": "Managed by SaltStack",
+                "content": "f70ff985-a4ef-4643-bbbc-4a0ed4fc8415.cfargotunnel.com",
+                "proxied": True,
+                "type": "CNAME",
+                "result": "Added",
+            },
+        },
+        "result": False,
+        "comment": "DNS test-2.example.com could not be created: Rate limited",
+    }
+
+    def create_dns(hostname, tunnel_id):  # pylint: disable=unused-argument
+        if hostname == "test-2.example.com":
+            raise salt.exceptions.CommandExecutionError("Rate limited")
+        return {dns["name"]: dns for dns in mock_dns_multiple}[hostname]
+
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "cloudflare_tunnel.get_tunnel": MagicMock(return_value=mock_tunnel),
+            "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config_multiple),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(return_value={}),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
+            "cloudflare_tunnel.create_dns": MagicMock(side_effect=create_dns),
+        },
+    ):
+        with patch.dict(cloudflare_tunnel_state.__opts__, {"test": False}):
+            ret = cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules_multiple)
+
+    assert ret == expected_result
+    assert list(ret["changes"]) == ["test.example.com", "test-3.example.com"]
+
+
+def test_absent_dns_error_keeps_tunnel():
+    mock_remove_tunnel = MagicMock(return_value=True)
+
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "cloudflare_tunnel.get_tunnel": MagicMock(return_value=mock_tunnel),
+            "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config_multiple),
+            "cloudflare_tunnel.remove_connector": MagicMock(return_value=True),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(
+                return_value={dns["name"]: dns for dns in mock_dns_multiple}
+            ),
+            "cloudflare_tunnel.remove_tunnel": mock_remove_tunnel,
+            "cloudflare_tunnel.remove_dns_by_id": MagicMock(
+                side_effect=[True, salt.exceptions.CommandExecutionError("Rate limited"), True]
+            ),
+        },
+    ):
+        with patch.dict(cloudflare_tunnel_state.__opts__, {"test": False}):
+            ret = cloudflare_tunnel_state.absent("cf_tunnel_example")
+
+    assert ret["result"] is False
+    assert "tunnel" not in ret["changes"]
+    assert len(ret["changes"]["dns"]) == 2
+    assert ret["comment"].startswith("Cloudflare Tunnel cf_tunnel_example was not removed")
+    mock_remove_tunnel.assert_not_called()
+
+
+def test_present_writes_prometheus_textfile(tmp_path):
+    path = tmp_path / "cloudflare_tunnel.prom"
+
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "config.get": MagicMock(return_value={"prometheus_textfile": str(path)}),
+            "cloudflare_tunnel.get_tunnel": MagicMock(return_value=mock_tunnel),
+            "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(
+                return_value={"test.example.com": mock_dns}
+            ),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
+        },
+    ), patch.dict(cloudflare_tunnel_state.__opts__, {"test": False, "cachedir": str(tmp_path)}):
+        ret = cloudflare_tunnel_state.present("cf_tunnel_example", mock_config["config"]["ingress"])
+
+    assert ret["result"] is True
+    text = path.read_text()
+    assert 'cloudflare_tunnel_state_result{state="present",name="cf_tunnel_example"} 1' in text
+    assert (
+        'cloudflare_tunnel_state_ingress_rules_diffed{state="present",name="cf_tunnel_example"} 4'
+        in text
+    )
+    for phase in ("lookup", "diff"):
+        assert f'phase="{phase}"' in text
+
+
+def test_metrics_export_error_does_not_fail_state(tmp_path):
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "config.get": MagicMock(
+                return_value={"prometheus_textfile": str(tmp_path / "missing" / "tunnel.prom")}
+            ),
+            "cloudflare_tunnel.get_tunnel": MagicMock(return_value=False),
+        },
+    ), patch.dict(cloudflare_tunnel_state.__opts__, {"test": False, "cachedir": str(tmp_path)}):
+        ret = cloudflare_tunnel_state.absent("cf_tunnel_example")
+
+    assert ret["result"] is True
+
+
+def test_present_profiling(tmp_path):
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "cloudflare_tunnel.get_tunnel": MagicMock(return_value=mock_tunnel),
+            "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(
+                return_value={"test.example.com": mock_dns}
+            ),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
+        },
+    ), patch.dict(cloudflare_tunnel_state.__opts__, {"test": False, "cachedir": str(tmp_path)}):
+        ret = cloudflare_tunnel_state.present(
+            "cf_tunnel_example", mock_config["config"]["ingress"], profiling=True
+        )
+
+    assert ret["result"] is True
+    profiles = tmp_path / "cloudflare_tunnel" / "profiles"
+    written = sorted(path.suffix for path in profiles.iterdir())
+    assert written == [".collapsed", ".pstats"]
+    assert f"Profile written to {profiles}" in ret["comment"]
+
+
+def test_present_trace(tmp_path):
+    path = tmp_path / "traces.jsonl"
+
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "config.get": MagicMock(return_value={"trace": "jsonl", "trace_file": str(path)}),
+            "cloudflare_tunnel.get_tunnel": MagicMock(return_value=mock_tunnel),
+            "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(return_value={}),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
+            "cloudflare_tunnel.create_dns": MagicMock(return_value=mock_dns),
+        },
+    ), patch.dict(cloudflare_tunnel_state.__opts__, {"test": False}):
+        ret = cloudflare_tunnel_state.present("cf_tunnel_example", mock_config["config"]["ingress"])
+
+    spans = [salt.utils.json.loads(line) for line in path.read_text().splitlines()]
+    root = spans[-1]
+    assert root["name"] == "cloudflare_tunnel.present"
+    assert root["attributes"] == {"name": "cf_tunnel_example", "result": True, "changes": 1}
+    assert ret["result"] is True
+    assert {span["name"] for span in spans[:-1]} == {"lookup", "diff", "dns"}
+    assert {span["parent_span_id"] for span in spans[:-1]} == {root["span_id"]}
+
+
+@pytest.mark.parametrize("exporter", ["missing_module.Exporter", "contextlib.Missing", "jaeger"])
+def test_trace_exporter_not_loaded_does_not_fail_state(tmp_path, exporter):
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "config.get": MagicMock(return_value={"trace": exporter}),
+            "cloudflare_tunnel.get_tunnel": MagicMock(return_value=False),
+        },
+    ), patch.dict(cloudflare_tunnel_state.__opts__, {"test": False, "cachedir": str(tmp_path)}):
+        ret = cloudflare_tunnel_state.absent("cf_tunnel_example")
+
+    assert ret["result"] is True
+    assert not (tmp_path / "cloudflare_tunnel" / "traces.jsonl").exists()
+
+
+@pytest.mark.parametrize("mode,version_checks", [(True, 1), ("trust", 0)])
+def test_present_fingerprint_skips_lookups(tmp_path, mode, version_checks):
+    versioned_config = dict(mock_config, version=3)
+    mock_get_tunnel = MagicMock(return_value=mock_tunnel)
+    mock_get_tunnel_config = MagicMock(return_value=versioned_config)
+    mock_get_dns_snapshot = MagicMock(return_value={"test.example.com": mock_dns})
+
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "config.get": MagicMock(return_value={"fingerprint": mode}),
+            "cloudflare_tunnel.get_tunnel": mock_get_tunnel,
+            "cloudflare_tunnel.get_tunnel_config": mock_get_tunnel_config,
+            "cloudflare_tunnel.get_dns_snapshot": mock_get_dns_snapshot,
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
+        },
+    ), patch.dict(cloudflare_tunnel_state.__opts__, {"test": False, "cachedir": str(tmp_path)}):
+        first = cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules)
+        second = cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules)
+
+        # The catch-all rule is added to the configuration, the desired state is the same
+        third = cloudflare_tunnel_state.present(
+            "cf_tunnel_example",
+            [{"hostname": "test.example.com", "service": "https://localhost:8000"}],
+        )
+        stored = cloudflare_tunnel_state._fingerprints().get("fingerprints", "cf_tunnel_example")
+
+    assert first["comment"] == "Cloudflare Tunnel cf_tunnel_example is already in the desired state"
+    assert stored["tunnel_id"] == mock_tunnel["id"]
+    assert stored["version"] == 3
+    assert second == {
+        "name": "cf_tunnel_example",
+        "changes": {},
+        "result": True,
+        "comment": "Cloudflare Tunnel cf_tunnel_example is already in the desired state, unchanged",
+    }
+    assert third == second
+    assert mock_get_tunnel.call_count == 1
+    assert mock_get_dns_snapshot.call_count == 1
+    assert mock_get_tunnel_config.call_count == 1 + 2 * version_checks
+
+
+def test_present_fingerprint_version_changed(tmp_path):
+    mock_get_tunnel_config = MagicMock(
+        side_effect=[dict(mock_config, version=3), dict(mock_config, version=4)] * 2
+    )
+    mock_get_tunnel = MagicMock(return_value=mock_tunnel)
+
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "config.get": MagicMock(return_value={"fingerprint": True}),
+            "cloudflare_tunnel.get_tunnel": mock_get_tunnel,
+            "cloudflare_tunnel.get_tunnel_config": mock_get_tunnel_config,
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(
+                return_value={"test.example.com": mock_dns}
+            ),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
+        },
+    ), patch.dict(cloudflare_tunnel_state.__opts__, {"test": False, "cachedir": str(tmp_path)}):
+        cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules)
+        cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules)
+
+    assert mock_get_tunnel.call_count == 2
+
+
+def test_present_fingerprint_expires(tmp_path):
+    mock_get_tunnel = MagicMock(return_value=mock_tunnel)
+
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "config.get": MagicMock(
+                return_value={"fingerprint": "trust", "fingerprint_verify_interval": 60}
+            ),
+            "cloudflare_tunnel.get_tunnel": mock_get_tunnel,
+            "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(
+                return_value={"test.example.com": mock_dns}
+            ),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
+        },
+    ), patch.dict(cloudflare_tunnel_state.__opts__, {"test": False, "cachedir": str(tmp_path)}):
+        cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules)
+        with patch("time.time", MagicMock(return_value=time.time() + 61)):
+            cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules)
+
+    assert mock_get_tunnel.call_count == 2
+
+
+def test_absent_forgets_fingerprint(tmp_path):
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "config.get": MagicMock(return_value={"fingerprint": "trust"}),
+            "cloudflare_tunnel.get_tunnel": MagicMock(side_effect=[mock_tunnel, False, False]),
+            "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(
+                return_value={"test.example.com": mock_dns}
+            ),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
+            "cloudflare_tunnel.create_tunnel": MagicMock(return_value=mock_tunnel),
+            "cloudflare_tunnel.create_tunnel_config": MagicMock(return_value=mock_config),
+            "cloudflare_tunnel.update_dns_by_id": MagicMock(return_value=mock_dns),
+        },
+    ), patch.dict(cloudflare_tunnel_state.__opts__, {"test": False, "cachedir": str(tmp_path)}):
+        cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules)
+        cloudflare_tunnel_state.absent("cf_tunnel_example")
+        ret = cloudflare_tunnel_state.present("cf_tunnel_example", ingress_rules)
+
+    assert "tunnel created" in ret["changes"]
+
+
+def _present_chunk(name, ingress, **kwargs):
+    return dict(
+        {
+            "state": "cloudflare_tunnel",
+            "__id__": name,
+            "name": name,
+            "fun": "present",
+            "ingress": ingress,
+        },
+        **kwargs,
+    )
+
+
+def test_mod_aggregate():
+    chunks = [
+        _present_chunk("first", ingress_rules),
+        _present_chunk("second", ingress_rules_multiple),
+        _present_chunk("done", ingress_rules),
+        _present_chunk("planned", ingress_rules, plan="0" * 32),
+        _present_chunk("repointed", ingress_rules, repoint_dns=True),
+        dict(_present_chunk("removed", []), fun="absent"),
+        dict(_present_chunk("package", []), state="pkg"),
+    ]
+    running = {"cloudflare_tunnel_|-done_|-done_|-present": {"result": True}}
+
+    with patch.dict(cloudflare_tunnel_state.__context__, {}):
+        assert cloudflare_tunnel_state.mod_aggregate(chunks[0], chunks, running) is chunks[0]
+        pending = dict(cloudflare_tunnel_state.__context__["cloudflare_tunnel.aggregate"])
+
+    assert pending == {"first": ingress_rules, "second": ingress_rules_multiple}
+    assert [chunk["name"] for chunk in chunks if chunk.get("__agg__")] == ["first", "second"]
+
+
+def test_present_aggregated():
+    other_ingress = [
+        {"hostname": "test.example.org", "service": "https://localhost:8000"},
+        {"service": "http_status:404"},
+    ]
+    other_tunnel = dict(mock_tunnel, id="a1b2c3", name="other")
+    mock_apply_dns_batch = MagicMock(
+        side_effect=lambda zone_id, creates, updates, deletes: [
+            {"name": record["name"], "id": "1", "action": "created", "result": True}
+            for record in creates
+        ]
+    )
+    chunks = [
+        _present_chunk("cf_tunnel_example", ingress_rules),
+        _present_chunk("other", other_ingress),
+    ]
+
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "config.get": MagicMock(return_value={"max_workers": 4}),
+            "cloudflare_tunnel.get_tunnel": MagicMock(
+                side_effect={"cf_tunnel_example": mock_tunnel, "other": other_tunnel}.get
+            ),
+            "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(return_value={}),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
+            "cloudflare_tunnel.create_tunnel_config": MagicMock(return_value=mock_config),
+            "cloudflare_tunnel.get_zones": MagicMock(
+                return_value={
+                    "test.example.com": {"id": "zone-com"},
+                    "test.example.org": {"id": "zone-org"},
+                }
+            ),
+            "cloudflare_tunnel.apply_dns_batch": mock_apply_dns_batch,
+        },
+    ), patch.dict(cloudflare_tunnel_state.__context__, {}), patch.dict(
+        cloudflare_tunnel_state.__opts__, {"test": False}
+    ):
+        cloudflare_tunnel_state.mod_aggregate(chunks[0], chunks, {})
+        rets = [
+            cloudflare_tunnel_state.present(chunk["name"], chunk["ingress"]) for chunk in chunks
+        ]
+
+    assert [ret["result"] for ret in rets] == [True, True]
+    assert rets[0]["changes"]["test.example.com"]["result"] == "Added"
+    assert "test.example.org" not in rets[0]["changes"]
+    assert rets[1]["changes"]["test.example.org"]["content"] == "a1b2c3.cfargotunnel.com"
+    assert rets[1]["changes"]["tunnel config"]["new"] == [
+        {"hostname": "test.example.org", "service": "https://localhost:8000"}
+    ]
+    assert sorted(call.args[0] for call in mock_apply_dns_batch.call_args_list) == [
+        "zone-com",
+        "zone-org",
+    ]
+
+
+def test_present_aggregated_dns_batch_error():
+    other_ingress = [
+        {"hostname": "other.example.com", "service": "https://localhost:8000"},
+        {"service": "http_status:404"},
+    ]
+    chunks = [
+        _present_chunk("cf_tunnel_example", ingress_rules),
+        _present_chunk("other", other_ingress),
+    ]
+
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "config.get": MagicMock(return_value={"max_workers": 4}),
+            "cloudflare_tunnel.get_tunnel": MagicMock(
+                side_effect=lambda name: mock_tunnel if name == "cf_tunnel_example" else False
+            ),
+            "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(return_value={}),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
+            "cloudflare_tunnel.create_tunnel": MagicMock(return_value=dict(mock_tunnel, id="2")),
+            "cloudflare_tunnel.create_tunnel_config": MagicMock(return_value=mock_config),
+            "cloudflare_tunnel.get_zones": MagicMock(
+                return_value={
+                    "test.example.com": {"id": "zone-com"},
+                    "other.example.com": {"id": "zone-com"},
+                }
+            ),
+            "cloudflare_tunnel.apply_dns_batch": MagicMock(
+                side_effect=salt.exceptions.CommandExecutionError("Rate limited")
+            ),
+        },
+    ), patch.dict(cloudflare_tunnel_state.__context__, {}), patch.dict(
+        cloudflare_tunnel_state.__opts__, {"test": False}
+    ):
+        cloudflare_tunnel_state.mod_aggregate(chunks[0], chunks, {})
+        rets = [
+            cloudflare_tunnel_state.present(chunk["name"], chunk["ingress"]) for chunk in chunks
+        ]
+
+    assert [ret["result"] for ret in rets] == [False, False]
+    assert rets[0]["comment"] == "DNS test.example.com could not be created: Rate limited"
+    assert rets[1]["changes"]["tunnel created"] == "other"
+    assert rets[1]["comment"] == "\n".join(
+        [
+            "Cloudflare tunnel other was created",
+            "DNS other.example.com could not be created: Rate limited",
+        ]
+    )
+
+
+def test_present_aggregated_tunnel_already_exists():
+    other_ingress = [
+        {"hostname": "other.example.com", "service": "https://localhost:8000"},
+        {"service": "http_status:404"},
+    ]
+    chunks = [
+        _present_chunk("cf_tunnel_example", ingress_rules),
+        _present_chunk("other", other_ingress),
+    ]
+    mock_apply_dns_batch = MagicMock(
+        side_effect=lambda zone_id, creates, updates, deletes: [
+            {"name": record["name"], "id": "1", "action": "created", "result": True}
+            for record in creates
+        ]
+    )
+
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "config.get": MagicMock(return_value={"max_workers": 4}),
+            "cloudflare_tunnel.get_tunnel": MagicMock(
+                side_effect=lambda name: mock_tunnel if name == "cf_tunnel_example" else False
+            ),
+            "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(return_value={}),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
+            "cloudflare_tunnel.create_tunnel": MagicMock(
+                return_value=(False, "Tunnel other already exists")
+            ),
+            "cloudflare_tunnel.create_tunnel_config": MagicMock(return_value=mock_config),
+            "cloudflare_tunnel.get_zones": MagicMock(
+                return_value={"test.example.com": {"id": "zone-com"}}
+            ),
+            "cloudflare_tunnel.apply_dns_batch": mock_apply_dns_batch,
+        },
+    ), patch.dict(cloudflare_tunnel_state.__context__, {}), patch.dict(
+        cloudflare_tunnel_state.__opts__, {"test": False}
+    ):
+        cloudflare_tunnel_state.mod_aggregate(chunks[0], chunks, {})
+        rets = [
+            cloudflare_tunnel_state.present(chunk["name"], chunk["ingress"]) for chunk in chunks
+        ]
+
+    assert [ret["result"] for ret in rets] == [True, False]
+    assert rets[0]["changes"]["test.example.com"]["result"] == "Added"
+    assert rets[1]["comment"] == (
+        "Cloudflare tunnel other could not be created: Tunnel other already exists"
+    )
+    mock_apply_dns_batch.assert_called_once()
+
+
+def test_present_aggregated_connector_error():
+    other_ingress = [
+        {"hostname": "other.example.com", "service": "https://localhost:8000"},
+        {"service": "http_status:404"},
+    ]
+    chunks = [
+        _present_chunk("cf_tunnel_example", ingress_rules),
+        _present_chunk("other", other_ingress),
+    ]
+    mock_install_connector = MagicMock(
+        side_effect=salt.exceptions.CommandExecutionError("Error installing connector")
+    )
+
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "cloudflare_tunnel.get_tunnel": MagicMock(
+                side_effect=lambda name: dict(mock_tunnel, name=name, id=f"{name}-id")
+            ),
+            "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(return_value={}),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=False),
+            "cloudflare_tunnel.create_tunnel_config": MagicMock(return_value=mock_config),
+            "cloudflare_tunnel.get_zones": MagicMock(
+                return_value={
+                    "test.example.com": {"id": "zone-com"},
+                    "other.example.com": {"id": "zone-com"},
+                }
+            ),
+            "cloudflare_tunnel.apply_dns_batch": MagicMock(
+                side_effect=lambda zone_id, creates, updates, deletes: [
+                    {"name": record["name"], "id": "1", "action": "created", "result": True}
+                    for record in creates
+                ]
+            ),
+            "cloudflare_tunnel.install_connector": mock_install_connector,
+        },
+    ), patch.dict(cloudflare_tunnel_state.__context__, {}), patch.dict(
+        cloudflare_tunnel_state.__opts__, {"test": False}
+    ):
+        cloudflare_tunnel_state.mod_aggregate(chunks[0], chunks, {})
+        rets = [
+            cloudflare_tunnel_state.present(chunk["name"], chunk["ingress"]) for chunk in chunks
+        ]
+
+    # Only the state the connector was installed for fails, the other keeps its changes
+    assert [ret["result"] for ret in rets] == [False, True]
+    assert rets[0]["comment"] == (
+        "Cloudflare connector could not be installed: Error installing connector"
+    )
+    assert rets[0]["changes"]["test.example.com"]["result"] == "Added"
+    assert rets[1]["changes"]["other.example.com"]["result"] == "Added"
+    mock_install_connector.assert_called_once_with("cf_tunnel_example-id")
+
+
+def test_managed_test_mode(tmp_path):
+    tunnels = {
+        "cf_tunnel_example": ingress_rules,
+        "new": [{"hostname": "test.example.org", "service": "https://localhost:8000"}],
+    }
+
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "cloudflare_tunnel.list_tunnels": MagicMock(return_value=[mock_tunnel]),
+            "cloudflare_tunnel.get_tunnel": MagicMock(
+                side_effect=lambda name: mock_tunnel if name == "cf_tunnel_example" else False
+            ),
+            "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(
+                return_value={"test.example.com": mock_dns}
+            ),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
+        },
+    ), patch.dict(cloudflare_tunnel_state.__opts__, {"test": True, "cachedir": str(tmp_path)}):
+        ret = cloudflare_tunnel_state.managed("web", tunnels)
+
+    assert ret["result"] is None
+    assert ret["comment"].splitlines() == [
+        "1 of 2 Cloudflare Tunnels are already in the desired state",
+        "new: Tunnel new will be created",
+        "new: Tunnel config will be created/updated",
+        "new: DNS test.example.org will be created",
+    ]
+    assert list(ret["changes"]) == ["new"]
+    assert not (tmp_path / "cloudflare_tunnel").exists()
+
+
+def test_managed_tunnel_lookup_error(tmp_path):
+    def get_dns_snapshot(hostnames):
+        if "test.example.org" in hostnames:
+            raise salt.exceptions.ArgumentValueError("Zone not found for dns test.example.org")
+        return {"test.example.com": mock_dns}
+
+    tunnels = {
+        "cf_tunnel_example": ingress_rules,
+        "new": [{"hostname": "test.example.org", "service": "https://localhost:8000"}],
+    }
+
+    with patch.dict(
+        cloudflare_tunnel_state.__salt__,
+        {
+            "cloudflare_tunnel.list_tunnels": MagicMock(return_value=[mock_tunnel]),
+            "cloudflare_tunnel.get_tunnel": MagicMock(
+                side_effect=lambda name: mock_tunnel if name == "cf_tunnel_example" else False
+            ),
+            "cloudflare_tunnel.get_tunnel_config": MagicMock(return_value=mock_config),
+            "cloudflare_tunnel.get_dns_snapshot": MagicMock(side_effect=get_dns_snapshot),
+            "cloudflare_tunnel.is_connector_installed": MagicMock(return_value=True),
+        },
+    ), patch.dict(cloudflare_tunnel_state.__opts__, {"test": False, "cachedir": str(tmp_path)}):
+        ret = cloudflare_tunnel_state.managed("web", tunnels)
+
+    assert ret["result"] is False
+    assert ret["changes"] == {}
+    assert ret["comment"].splitlines() == [
+        "1 of 2 Cloudflare Tunnels are already in the desired state",
+        "new: Cloudflare Tunnel new could not be looked up: Zone not found for dns "
+        "test.example.org",
+    ]
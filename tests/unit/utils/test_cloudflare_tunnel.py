@@ -0,0 +1,638 @@
+import copy
+import threading
+import time
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+import CloudFlare
+import pytest
+import requests
+import salt.exceptions
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod as cf_tunnel_utils
+
+
+@pytest.fixture
+def mock_get_client():
+    with patch.object(
+        cf_tunnel_utils, "_get_client", MagicMock(side_effect=lambda *args: MagicMock())
+    ) as mock_client:
+        yield mock_client
+
+
+def test_client_pool_reuses_released_client(mock_get_client):
+    pool = cf_tunnel_utils.ClientPool()
+
+    with pool.client("token") as first:
+        pass
+    with pool.client("token") as second:
+        pass
+
+    assert first is second
+    assert mock_get_client.call_count == 1
+    assert pool.stats() == {"created": 1, "reused": 1, "evicted": 0, "idle": 1}
+
+
+def test_client_pool_keys_by_token_and_profile(mock_get_client):
+    pool = cf_tunnel_utils.ClientPool()
+
+    with pool.client("token") as first:
+        pass
+    with pool.client("other-token") as second:
+        pass
+    with pool.client("token", {"base_url": "http://127.0.0.1:8080"}) as third:
+        pass
+    with pool.client("token", {"api_token": "token", "account": "1234"}) as fourth:
+        pass
+
+    assert first is not second
+    assert third not in (first, second)
+    assert fourth is first
+    assert mock_get_client.call_count == 3
+
+
+def test_client_pool_checked_out_client_not_shared(mock_get_client):
+    pool = cf_tunnel_utils.ClientPool()
+
+    with pool.client("token") as first:
+        with pool.client("token") as second:
+            assert first is not second
+
+    assert pool.stats()["idle"] == 2
+
+
+def test_client_pool_evicts_idle_clients(mock_get_client):
+    pool = cf_tunnel_utils.ClientPool(idle_timeout=10)
+
+    with patch("time.monotonic", MagicMock(return_value=100)):
+        with pool.client("token"):
+            pass
+
+    with patch("time.monotonic", MagicMock(return_value=111)):
+        with pool.client("token"):
+            pass
+
+    assert mock_get_client.call_count == 2
+    assert pool.stats()["evicted"] == 1
+
+
+def test_client_pool_size_cap(mock_get_client):
+    pool = cf_tunnel_utils.ClientPool(max_size=2)
+
+    for token in ("token-1", "token-2", "token-3"):
+        with pool.client(token):
+            pass
+
+    assert pool.stats() == {"created": 3, "reused": 0, "evicted": 1, "idle": 2}
+
+    with pool.client("token-1"):
+        pass
+
+    assert pool.stats()["created"] == 4
+
+
+def test_client_pool_threads(mock_get_client):
+    pool = cf_tunnel_utils.ClientPool()
+    lock = threading.Lock()
+    in_use = set()
+    errors = []
+
+    def worker():
+        for _ in range(50):
+            with pool.client("token") as client:
+                with lock:
+                    if id(client) in in_use:
+                        errors.append(client)
+                    in_use.add(id(client))
+                time.sleep(0)
+                with lock:
+                    in_use.discard(id(client))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = pool.stats()
+    assert not errors
+    assert stats["created"] + stats["reused"] == 400
+    assert stats["created"] <= 8
+
+
+def test_request_uses_pooled_client(mock_get_client):
+    with patch.object(cf_tunnel_utils, "_CLIENT_POOL", cf_tunnel_utils.ClientPool()):
+        cf_tunnel_utils.get_dns("token", "zone-id", "test.example.com")
+        cf_tunnel_utils.remove_dns("token", "zone-id", "dns-id")
+
+        assert mock_get_client.call_count == 1
+        assert cf_tunnel_utils.client_stats()["pool"]["reused"] == 1
+
+
+mock_zones = [
+    {"id": "1", "name": "example.com", "status": "active"},
+    {"id": "2", "name": "example.co.uk", "status": "active"},
+    {"id": "3", "name": "dev.example.com", "status": "active"},
+]
+
+
+def test_zone_index_longest_suffix():
+    index = cf_tunnel_utils.ZoneIndex(mock_zones)
+
+    assert index.size == 3
+    assert index.lookup("test.example.com")["id"] == "1"
+    assert index.lookup("example.com")["id"] == "1"
+    assert index.lookup("a.b.example.co.uk")["id"] == "2"
+    assert index.lookup("app.dev.example.com")["id"] == "3"
+    assert index.lookup("App.Dev.Example.com.")["id"] == "3"
+    assert index.lookup("test.example.org") is None
+    assert index.lookup("co.uk") is None
+
+
+def test_list_zones_paginates():
+    pages = [[{"id": str(i), "name": f"zone{i}.com"} for i in range(50)], [mock_zones[0]]]
+
+    with patch.object(cf_tunnel_utils, "_request", MagicMock(side_effect=pages)) as mock_request:
+        zones = cf_tunnel_utils.list_zones("token", "account-id")
+
+    assert len(zones) == 51
+    assert mock_request.call_count == 2
+    assert mock_request.call_args.kwargs["params"] == {
+        "page": 2,
+        "per_page": 50,
+        "account.id": "account-id",
+    }
+
+
+def test_find_zone_uses_index():
+    with patch.object(cf_tunnel_utils, "_ZONE_INDEXES", {}):
+        with patch.object(
+            cf_tunnel_utils, "list_zones", MagicMock(return_value=mock_zones)
+        ) as mock_list:
+            assert cf_tunnel_utils.find_zone("token", "a.example.com")["id"] == "1"
+            assert cf_tunnel_utils.find_zone("token", "b.dev.example.com")["id"] == "3"
+
+    assert mock_list.call_count == 1
+
+
+def test_find_zone_refreshes_on_miss():
+    new_zone = {"id": "4", "name": "example.org", "status": "active"}
+
+    with patch.object(cf_tunnel_utils, "_ZONE_INDEXES", {}):
+        with patch.object(
+            cf_tunnel_utils,
+            "list_zones",
+            MagicMock(side_effect=[mock_zones, mock_zones + [new_zone]]),
+        ) as mock_list:
+            cf_tunnel_utils.get_zone_index("token")
+            with patch.object(cf_tunnel_utils, "ZONE_INDEX_MISS_REFRESH", -1):
+                assert cf_tunnel_utils.find_zone("token", "www.example.org") == new_zone
+
+    assert mock_list.call_count == 2
+
+
+def test_find_zone_expired_index():
+    with patch.object(cf_tunnel_utils, "_ZONE_INDEXES", {}):
+        with patch.object(
+            cf_tunnel_utils, "list_zones", MagicMock(return_value=mock_zones)
+        ) as mock_list:
+            cf_tunnel_utils.find_zone("token", "a.example.com", profile={"zone_index_ttl": -1})
+            cf_tunnel_utils.find_zone("token", "a.example.com", profile={"zone_index_ttl": -1})
+
+    assert mock_list.call_count == 2
+
+
+def test_get_dns_snapshot():
+    records = [
+        {"id": "1", "name": "Test.example.com", "type": "CNAME"},
+        {"id": "2", "name": "test-2.example.com", "type": "A"},
+        {"id": "3", "name": "test-2.example.com", "type": "AAAA"},
+        {"id": "4", "name": "test-3.example.com", "type": "TXT"},
+    ]
+
+    with patch.object(cf_tunnel_utils, "_request", MagicMock(return_value=records)) as mock_request:
+        snapshot = cf_tunnel_utils.get_dns_snapshot("token", "zone-id")
+
+    # Address records keep a CNAME record from being created, they are part of the snapshot
+    assert snapshot == {"test.example.com": records[0], "test-2.example.com": records[1]}
+    assert mock_request.call_count == 1
+    assert mock_request.call_args.kwargs["params"] == {
+        "page": 1,
+        "per_page": cf_tunnel_utils.DNS_RECORDS_PER_PAGE,
+    }
+
+
+def test_get_dns_snapshot_single_type():
+    records = [{"id": "1", "name": "test.example.com", "type": "CNAME"}]
+
+    with patch.object(cf_tunnel_utils, "_request", MagicMock(return_value=records)) as mock_request:
+        snapshot = cf_tunnel_utils.get_dns_snapshot("token", "zone-id", record_types=("CNAME",))
+
+    assert snapshot == {"test.example.com": records[0]}
+    assert mock_request.call_args.kwargs["params"]["type"] == "CNAME"
+
+
+def test_list_dns_paginates():
+    with patch.object(cf_tunnel_utils, "DNS_RECORDS_PER_PAGE", 2):
+        with patch.object(
+            cf_tunnel_utils,
+            "_request",
+            MagicMock(side_effect=[[{"id": "1"}, {"id": "2"}], [{"id": "3"}]]),
+        ) as mock_request:
+            records = cf_tunnel_utils.list_dns("token", "zone-id", record_type=None)
+
+    assert [record["id"] for record in records] == ["1", "2", "3"]
+    assert mock_request.call_args.kwargs["params"] == {"page": 2, "per_page": 2}
+
+
+def test_batch_dns():
+    with patch.object(cf_tunnel_utils, "_request", MagicMock(return_value={})) as mock_request:
+        cf_tunnel_utils.batch_dns("token", "zone-id", deletes=[{"id": "1"}])
+
+    assert mock_request.call_args.args == ("token", "POST", "zones/dns_records/batch", "zone-id")
+    assert mock_request.call_args.kwargs["data"] == {
+        "deletes": [{"id": "1"}],
+        "puts": [],
+        "posts": [],
+    }
+
+
+def test_endpoint_registers_unknown_endpoint():
+    client = MagicMock(spec=["add", "zones"])
+    client.zones = MagicMock(spec=["dns_records"])
+    client.zones.dns_records = MagicMock(spec=["get"])
+
+    def add(_, *parts):
+        client.zones.dns_records.batch = MagicMock()
+
+    client.add.side_effect = add
+
+    api = cf_tunnel_utils._endpoint(client, "zones/dns_records/batch")
+
+    client.add.assert_called_once_with("AUTH", "zones", "dns_records", "batch")
+    assert api is client.zones.dns_records.batch
+
+
+def test_token_bucket_paces_requests():
+    bucket = cf_tunnel_utils.TokenBucket(requests=12, period=10, burst=2)
+    mock_sleep = MagicMock()
+
+    with patch("time.time", MagicMock(return_value=1000.0)):
+        with patch("time.sleep", mock_sleep):
+            waits = [bucket.acquire() for _ in range(4)]
+
+    # Two requests fit in the burst, the rest are spaced by the refill rate of 1 per second
+    assert waits == [0.0, 0.0, pytest.approx(1.0), pytest.approx(2.0)]
+    assert mock_sleep.call_count == 2
+    assert bucket.stats() == {
+        "requests": 4,
+        "delayed": 2,
+        "wait_total": pytest.approx(3.0),
+        "wait_max": pytest.approx(2.0),
+    }
+
+
+def test_token_bucket_refills():
+    bucket = cf_tunnel_utils.TokenBucket(requests=12, period=10, burst=2)
+
+    with patch("time.time", MagicMock(side_effect=[1000.0, 1000.0, 1000.0, 1010.0])):
+        with patch("time.sleep", MagicMock()):
+            waits = [bucket.acquire() for _ in range(4)]
+
+    assert waits == [0.0, 0.0, pytest.approx(1.0), 0.0]
+
+
+def test_token_bucket_shared_state_file(tmp_path):
+    state_file = str(tmp_path / "rate_limit")
+    first = cf_tunnel_utils.TokenBucket(requests=12, period=10, burst=2, state_file=state_file)
+    second = cf_tunnel_utils.TokenBucket(requests=12, period=10, burst=2, state_file=state_file)
+
+    with patch("time.time", MagicMock(return_value=1000.0)):
+        with patch("time.sleep", MagicMock()):
+            assert first.acquire() == 0.0
+            assert second.acquire() == 0.0
+            assert first.acquire() == pytest.approx(1.0)
+
+
+def test_rate_limiter_per_token():
+    with patch.object(cf_tunnel_utils, "_RATE_LIMITERS", {}):
+        first = cf_tunnel_utils._rate_limiter("token")
+        assert cf_tunnel_utils._rate_limiter("token") is first
+        assert cf_tunnel_utils._rate_limiter("other-token") is not first
+        assert cf_tunnel_utils._rate_limiter("token", {"rate_limit_burst": 10}) is not first
+        assert cf_tunnel_utils._rate_limiter("token", {"rate_limit": 0}) is None
+
+
+def test_request_waits_for_rate_limiter(mock_get_client):
+    mock_bucket = MagicMock()
+    mock_bucket.acquire.return_value = 0.25
+
+    with patch.object(cf_tunnel_utils, "_rate_limiter", MagicMock(return_value=mock_bucket)):
+        cf_tunnel_utils.get_tunnel("token", "account", "tunnel")
+
+    mock_bucket.acquire.assert_called_once_with()
+
+
+@pytest.mark.parametrize(
+    "code,message,method,expected",
+    [
+        (429, "Too Many Requests", "POST", True),
+        (971, "Please wait and consider throttling your request speed", "GET", True),
+        (502, "Bad Gateway", "GET", True),
+        (503, "Service Unavailable", "PUT", True),
+        (503, "Service Unavailable", "POST", False),
+        (0, "connection failed.", "DELETE", True),
+        (0, "connection timeout", "GET", True),
+        (0, "no token defined", "GET", False),
+        (1003, "Invalid or missing zone id.", "GET", False),
+        (10000, "Authentication error", "GET", False),
+        (81053, "An A, AAAA, or CNAME record with that host already exists.", "POST", False),
+    ],
+)
+def test_retry_policy_is_retryable(code, message, method, expected):
+    exc = CloudFlare.exceptions.CloudFlareAPIError(code, message)
+
+    assert cf_tunnel_utils.RetryPolicy.is_retryable(exc, method) is expected
+
+
+def _http_error(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.exceptions.HTTPError(f"{status_code} Server Error", response=response)
+
+
+@pytest.mark.parametrize(
+    "status_code,method,expected",
+    [
+        (502, "GET", True),
+        (503, "DELETE", True),
+        (502, "POST", False),
+        (429, "POST", True),
+        (404, "GET", False),
+    ],
+)
+def test_retry_policy_is_retryable_http_error(status_code, method, expected):
+    exc = _http_error(status_code)
+
+    assert cf_tunnel_utils.RetryPolicy.is_retryable(exc, method) is expected
+
+
+def test_retry_policy_delay_full_jitter():
+    policy = cf_tunnel_utils.RetryPolicy(attempts=10, base_delay=1, max_delay=8, deadline=100)
+    exc = CloudFlare.exceptions.CloudFlareAPIError(429, "Too Many Requests")
+
+    with patch("random.uniform", MagicMock(side_effect=lambda low, high: high)) as mock_uniform:
+        delays = [policy.delay(exc, "GET", attempt, 0) for attempt in range(6)]
+
+    assert delays == [1, 2, 4, 8, 8, 8]
+    assert all(call.args[0] == 0 for call in mock_uniform.call_args_list)
+
+
+def test_retry_policy_gives_up():
+    policy = cf_tunnel_utils.RetryPolicy(attempts=3, base_delay=1, max_delay=8, deadline=10)
+    exc = CloudFlare.exceptions.CloudFlareAPIError(429, "Too Many Requests")
+
+    with patch("random.uniform", MagicMock(side_effect=lambda low, high: high)):
+        assert policy.delay(exc, "GET", 1, 0) == 2
+        assert policy.delay(exc, "GET", 2, 0) is None
+        assert policy.delay(exc, "GET", 1, 9) is None
+
+
+def test_request_retries_retryable_errors(mock_get_client):
+    mock_client = MagicMock()
+    mock_client.zones.get.side_effect = [
+        CloudFlare.exceptions.CloudFlareAPIError(429, "Too Many Requests"),
+        CloudFlare.exceptions.CloudFlareAPIError(502, "Bad Gateway"),
+        [{"id": "1234ABC"}],
+    ]
+    mock_get_client.side_effect = lambda *args: mock_client
+    mock_sleep = MagicMock()
+
+    with patch.object(cf_tunnel_utils, "_CLIENT_POOL", cf_tunnel_utils.ClientPool()):
+        with patch("time.sleep", mock_sleep):
+            assert cf_tunnel_utils.get_zone_id("token", "example.com") == [{"id": "1234ABC"}]
+
+    assert mock_client.zones.get.call_count == 3
+    assert mock_sleep.call_count == 2
+
+
+def test_request_retries_http_errors(mock_get_client):
+    mock_client = MagicMock()
+    mock_client.zones.get.side_effect = [_http_error(502), [{"id": "1234ABC"}]]
+    mock_client.zones.post.side_effect = _http_error(502)
+    mock_get_client.side_effect = lambda *args: mock_client
+
+    with patch.object(cf_tunnel_utils, "_CLIENT_POOL", cf_tunnel_utils.ClientPool()):
+        with patch("time.sleep", MagicMock()) as mock_sleep:
+            assert cf_tunnel_utils.get_zone_id("token", "example.com") == [{"id": "1234ABC"}]
+
+            with pytest.raises(salt.exceptions.CommandExecutionError, match="502"):
+                cf_tunnel_utils._request("token", "POST", "zones", data={"name": "example.com"})
+
+    assert mock_client.zones.get.call_count == 2
+    assert mock_client.zones.post.call_count == 1
+    assert mock_sleep.call_count == 1
+
+
+def test_request_does_not_retry_permanent_errors(mock_get_client):
+    mock_client = MagicMock()
+    mock_client.zones.get.side_effect = CloudFlare.exceptions.CloudFlareAPIError(
+        10000, "Authentication error"
+    )
+    mock_get_client.side_effect = lambda *args: mock_client
+
+    with patch.object(cf_tunnel_utils, "_CLIENT_POOL", cf_tunnel_utils.ClientPool()):
+        with patch("time.sleep", MagicMock()) as mock_sleep:
+            with pytest.raises(salt.exceptions.CommandExecutionError, match="Authentication"):
+                cf_tunnel_utils.get_zone_id("token", "example.com")
+
+    assert mock_client.zones.get.call_count == 1
+    mock_sleep.assert_not_called()
+
+
+def test_request_stops_after_attempts(mock_get_client):
+    mock_client = MagicMock()
+    mock_client.zones.get.side_effect = CloudFlare.exceptions.CloudFlareAPIError(
+        503, "Service Unavailable"
+    )
+    mock_get_client.side_effect = lambda *args: mock_client
+
+    with patch.object(cf_tunnel_utils, "_CLIENT_POOL", cf_tunnel_utils.ClientPool()):
+        with patch("time.sleep", MagicMock()):
+            with pytest.raises(salt.exceptions.CommandExecutionError):
+                cf_tunnel_utils.get_zone_id("token", "example.com", profile={"retry_attempts": 3})
+
+    assert mock_client.zones.get.call_count == 3
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    single_flight = cf_tunnel_utils.SingleFlight()
+    release = threading.Event()
+    mock_func = MagicMock(side_effect=lambda: release.wait() and [{"id": "1234ABC"}])
+    results = []
+
+    def worker():
+        results.append(single_flight.do(("token", "zones"), mock_func))
+
+    threads = [threading.Thread(target=worker) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while single_flight.stats()["hits"] < 4:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert mock_func.call_count == 1
+    assert results == [[{"id": "1234ABC"}]] * 5
+    assert single_flight.stats() == {"hits": 4, "misses": 1}
+
+    # The response is copied for the callers that shared it
+    assert len({id(result) for result in results}) == 5
+
+
+def test_single_flight_leader_copy_independent():
+    single_flight = cf_tunnel_utils.SingleFlight()
+    release = threading.Event()
+    changed = threading.Event()
+    results = {}
+    deepcopy = copy.deepcopy
+
+    def waiting_deepcopy(value):
+        # The waiting callers only copy the response once the leader changed its own
+        if threading.current_thread().name != "leader":
+            changed.wait(timeout=5)
+        return deepcopy(value)
+
+    def worker():
+        result = single_flight.do("key", lambda: release.wait() and [{"id": "1234ABC"}])
+        if threading.current_thread().name == "leader":
+            result[0]["name"] = "changed"
+            changed.set()
+        results[threading.current_thread().name] = result
+
+    leader = threading.Thread(target=worker, name="leader")
+    followers = [threading.Thread(target=worker, name=f"follower{index}") for index in range(2)]
+    with patch.object(cf_tunnel_utils.copy, "deepcopy", waiting_deepcopy):
+        leader.start()
+        while single_flight.stats()["misses"] < 1:
+            time.sleep(0.001)
+        for thread in followers:
+            thread.start()
+        while single_flight.stats()["hits"] < 2:
+            time.sleep(0.001)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+
+    assert results == {
+        "leader": [{"id": "1234ABC", "name": "changed"}],
+        "follower0": [{"id": "1234ABC"}],
+        "follower1": [{"id": "1234ABC"}],
+    }
+
+
+def test_single_flight_shares_errors():
+    single_flight = cf_tunnel_utils.SingleFlight()
+    release = threading.Event()
+    errors = []
+
+    def fail():
+        release.wait()
+        raise salt.exceptions.CommandExecutionError("Bad Gateway")
+
+    def worker():
+        try:
+            single_flight.do("key", fail)
+        except salt.exceptions.CommandExecutionError as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    while single_flight.stats()["hits"] < 2:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 3
+    assert single_flight.stats()["misses"] == 1
+
+
+def test_single_flight_sequential_calls_not_shared():
+    single_flight = cf_tunnel_utils.SingleFlight()
+    mock_func = MagicMock(return_value=[])
+
+    single_flight.do("key", mock_func)
+    single_flight.do("key", mock_func)
+
+    assert mock_func.call_count == 2
+
+
+def test_request_single_flight_only_for_get():
+    mock_single_flight = MagicMock()
+
+    with patch.object(cf_tunnel_utils, "_SINGLE_FLIGHT", mock_single_flight):
+        with patch.object(cf_tunnel_utils, "_send", MagicMock()) as mock_send:
+            cf_tunnel_utils.get_tunnel("token", "account", "tunnel")
+            cf_tunnel_utils.remove_tunnel("token", "account", "tunnel-id")
+
+    key = mock_single_flight.do.call_args.args[0]
+    assert key == (
+        "token",
+        (),
+        "accounts/cfd_tunnel",
+        ("account",),
+        (("is_deleted", "false"), ("name", "tunnel")),
+    )
+    assert mock_single_flight.do.call_count == 1
+    assert mock_send.call_count == 1
+
+
+def test_api_metrics_histogram():
+    metrics = cf_tunnel_utils.ApiMetrics(buckets=(0.1, 1))
+    metrics.record("GET", "zones", 0.05)
+    metrics.record("GET", "zones", 0.5, retries=2)
+    metrics.record("GET", "zones", 5, error=True)
+    metrics.record("POST", "zones/dns_records", 0.1)
+
+    stats = metrics.stats()
+
+    assert stats["GET zones"] == {
+        "count": 3,
+        "errors": 1,
+        "retries": 2,
+        "latency_sum": 5.55,
+        "latency_max": 5,
+        "histogram": {"0.1": 1, "1": 2, "+Inf": 3},
+    }
+    assert stats["POST zones/dns_records"]["histogram"] == {"0.1": 1, "1": 1, "+Inf": 1}
+
+    metrics.reset()
+    assert metrics.stats() == {}
+
+
+def test_request_records_metrics(mock_get_client):
+    mock_client = MagicMock()
+    mock_client.zones.get.side_effect = [
+        CloudFlare.exceptions.CloudFlareAPIError(429, "Too Many Requests"),
+        [{"id": "1234ABC"}],
+    ]
+    mock_client.zones.dns_records.delete.side_effect = CloudFlare.exceptions.CloudFlareAPIError(
+        1003, "Invalid or missing zone id."
+    )
+    mock_get_client.side_effect = lambda *args: mock_client
+
+    with patch.object(cf_tunnel_utils, "_API_METRICS", cf_tunnel_utils.ApiMetrics()), patch.object(
+        cf_tunnel_utils, "_CLIENT_POOL", cf_tunnel_utils.ClientPool()
+    ), patch("time.sleep"):
+        cf_tunnel_utils.get_zone_id("token", "example.com")
+        with pytest.raises(salt.exceptions.CommandExecutionError):
+            cf_tunnel_utils.remove_dns("token", "zone-id", "dns-id")
+
+        stats = cf_tunnel_utils.api_stats(reset=True)
+        assert cf_tunnel_utils.api_stats() == {}
+
+    assert (stats["GET zones"]["count"], stats["GET zones"]["retries"]) == (1, 1)
+    assert stats["GET zones"]["errors"] == 0
+    assert stats["DELETE zones/dns_records"]["errors"] == 1
@@ -0,0 +1,85 @@
+import threading
+from unittest.mock import patch
+
+import salt.utils.msgpack
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_cache as cf_tunnel_cache
+
+
+def test_inventory_cache_shared_between_instances(tmp_path):
+    cf_tunnel_cache.InventoryCache(str(tmp_path)).set("tunnels", "account:blog", {"id": "1234"})
+
+    cache = cf_tunnel_cache.InventoryCache(str(tmp_path))
+    assert cache.get("tunnels", "account:blog") == {"id": "1234"}
+    assert cache.get("tunnels", "account:other") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_inventory_cache_msgpack_round_trip(tmp_path):
+    tunnel = {"id": "1234", "name": "blog", "connections": [{"colo_name": "yyz01"}]}
+    cache = cf_tunnel_cache.InventoryCache(str(tmp_path))
+    cache.set("tunnels", "account:blog", tunnel)
+    cache.set("dns", "zone", {"blog.example.com": {"id": "1", "proxied": True}})
+
+    assert cf_tunnel_cache.InventoryCache(str(tmp_path)).get("tunnels", "account:blog") == tunnel
+
+    # Keys stay text through repeated read and write cycles instead of mixing with bytes
+    raw = (tmp_path / cf_tunnel_cache.CACHE_FILE).read_bytes()
+    data = salt.utils.msgpack.unpackb(raw, raw=False)
+    assert sorted(data) == ["dns", "tunnels"]
+    assert list(data["dns"]) == ["zone"]
+    assert data["dns"]["zone"][1] == {"blog.example.com": {"id": "1", "proxied": True}}
+
+
+def test_inventory_cache_ttl_per_entity(tmp_path):
+    cache = cf_tunnel_cache.InventoryCache(str(tmp_path), ttls={"dns": 10})
+    cache.set("dns", "zone", {"test.example.com": {"id": "1"}})
+    cache.set("zones", "account:test.example.com", {"id": "zone"})
+
+    with patch("time.time", return_value=cache._read()["dns"]["zone"][0] + 60):
+        assert cache.get("dns", "zone") is None
+        assert cache.get("zones", "account:test.example.com") == {"id": "zone"}
+        stats = cache.stats()
+
+    assert stats["entities"]["dns"] == {"entries": 0, "expired": 1, "ttl": 10}
+    assert stats["entities"]["zones"] == {"entries": 1, "expired": 0, "ttl": 86400}
+    assert stats["size"] > 0
+
+
+def test_inventory_cache_invalidate(tmp_path):
+    cache = cf_tunnel_cache.InventoryCache(str(tmp_path))
+    cache.set("dns", "zone1", {})
+    cache.set("dns", "zone2", {})
+    cache.set("tunnels", "account:blog", {"id": "1234"})
+
+    cache.invalidate("dns", "zone1")
+    assert cache.get("dns", "zone1") is None
+    assert cache.get("dns", "zone2") == {}
+
+    cache.invalidate("tunnels")
+    assert cache.get("tunnels", "account:blog") is None
+
+    cache.clear()
+    assert cache.stats()["entities"] == {}
+
+
+def test_inventory_cache_unreadable_file(tmp_path):
+    cache = cf_tunnel_cache.InventoryCache(str(tmp_path))
+    (tmp_path / cf_tunnel_cache.CACHE_FILE).write_bytes(b"\xc1not msgpack")
+
+    assert cache.get("tunnels", "account:blog") is None
+
+    cache.set("tunnels", "account:blog", {"id": "1234"})
+    assert cache.get("tunnels", "account:blog") == {"id": "1234"}
+
+
+def test_inventory_cache_concurrent_writers(tmp_path):
+    def _write(index):
+        cf_tunnel_cache.InventoryCache(str(tmp_path)).set("dns", f"zone{index}", {})
+
+    threads = [threading.Thread(target=_write, args=(index,)) for index in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert cf_tunnel_cache.InventoryCache(str(tmp_path)).stats()["entities"]["dns"]["entries"] == 20
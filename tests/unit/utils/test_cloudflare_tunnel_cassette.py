@@ -0,0 +1,154 @@
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+import CloudFlare
+import pytest
+import salt.exceptions
+import salt.utils.json
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_cassette as cf_tunnel_cassette
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod as cf_tunnel_utils
+
+
+@pytest.fixture
+def cassette_path(tmp_path):
+    return str(tmp_path / "cassette.jsonl")
+
+
+def _interactions(path):
+    with open(path, encoding="utf-8") as fh_:
+        return [salt.utils.json.loads(line) for line in fh_]
+
+
+def test_redact():
+    value = {
+        "name": "blog",
+        "tunnel_secret": "c2VjcmV0",
+        "credentials_file": {"TunnelSecret": "c2VjcmV0"},
+        "ingress": [{"hostname": "app.example.com", "token": "abc"}],
+    }
+
+    assert cf_tunnel_cassette.redact(value) == {
+        "name": "blog",
+        "tunnel_secret": "REDACTED",
+        "credentials_file": "REDACTED",
+        "ingress": [{"hostname": "app.example.com", "token": "REDACTED"}],
+    }
+
+
+def test_replay_in_recorded_order(cassette_path):
+    recorder = cf_tunnel_cassette.Cassette(cassette_path, mode="record")
+    params = {"name": "blog"}
+    recorder.record("GET", "accounts/cfd_tunnel", ["1234"], params, None, 0.1, [])
+    recorder.record("GET", "accounts/cfd_tunnel", ["1234"], params, None, 0.2, [{"id": 1}])
+
+    cassette = cf_tunnel_cassette.Cassette(cassette_path, latency="zero")
+
+    for expected in ([], [{"id": 1}], [{"id": 1}]):
+        assert cassette.play("GET", "accounts/cfd_tunnel", ("1234",), params, None) == (
+            expected,
+            None,
+        )
+
+
+def test_replay_errors(cassette_path):
+    recorder = cf_tunnel_cassette.Cassette(cassette_path, mode="record")
+    recorder.record(
+        "DELETE", "accounts/cfd_tunnel", ["1234", "1"], None, None, 0.1, error=(1022, "x")
+    )
+
+    cassette = cf_tunnel_cassette.Cassette(cassette_path, latency="zero")
+
+    assert cassette.play("DELETE", "accounts/cfd_tunnel", ("1234", "1"), None, None) == (
+        None,
+        (1022, "x"),
+    )
+
+
+def test_replay_latency(cassette_path):
+    cf_tunnel_cassette.Cassette(cassette_path, mode="record").record(
+        "GET", "zones", [], None, None, 0.25, []
+    )
+
+    with patch("time.sleep") as mock_sleep:
+        cf_tunnel_cassette.Cassette(cassette_path).play("GET", "zones", (), None, None)
+        cf_tunnel_cassette.Cassette(cassette_path, latency="zero").play(
+            "GET", "zones", (), None, None
+        )
+
+    mock_sleep.assert_called_once_with(0.25)
+
+
+def test_replay_matches_redacted_body(cassette_path):
+    cf_tunnel_cassette.Cassette(cassette_path, mode="record").record(
+        "POST", "accounts/cfd_tunnel", ["1234"], None, {"name": "blog", "tunnel_secret": "a"}, 0, {}
+    )
+
+    cassette = cf_tunnel_cassette.Cassette(cassette_path, latency="zero")
+
+    assert cassette.play(
+        "POST", "accounts/cfd_tunnel", ("1234",), None, {"name": "blog", "tunnel_secret": "b"}
+    ) == ({}, None)
+    with pytest.raises(salt.exceptions.CommandExecutionError):
+        cassette.play("POST", "accounts/cfd_tunnel", ("1234",), None, {"name": "other"})
+
+
+def test_cassette_invalid_settings(cassette_path):
+    with pytest.raises(salt.exceptions.ArgumentValueError):
+        cf_tunnel_cassette.Cassette(cassette_path, mode="rewind")
+    with pytest.raises(salt.exceptions.ArgumentValueError):
+        cf_tunnel_cassette.Cassette(cassette_path, mode="record", latency="slow")
+    with pytest.raises(salt.exceptions.CommandExecutionError):
+        cf_tunnel_cassette.Cassette(cassette_path)
+
+
+def test_request_records_to_cassette(cassette_path):
+    api_token = "AS0KLASDOK1201KASD1KJ1239ASKJD123"
+    profile = {"cassette": cassette_path, "cassette_mode": "record", "rate_limit": 0}
+    client = MagicMock()
+    client.accounts.cfd_tunnel.token.get.return_value = "eyJhIjoiMTIzNCJ9"
+    client.zones.dns_records.delete.side_effect = CloudFlare.exceptions.CloudFlareAPIError(
+        code=81044, message="Record does not exist."
+    )
+
+    with patch.object(cf_tunnel_utils, "_CLIENT_POOL", cf_tunnel_utils.ClientPool()), patch.object(
+        cf_tunnel_utils, "_get_client", MagicMock(return_value=client)
+    ):
+        token = cf_tunnel_utils.get_tunnel_token(api_token, "1234", "1", profile=profile)
+        with pytest.raises(salt.exceptions.CommandExecutionError):
+            cf_tunnel_utils.remove_dns(api_token, "zone", "record", profile=profile)
+
+    interactions = _interactions(cassette_path)
+    assert token == "eyJhIjoiMTIzNCJ9"
+    assert [interaction["request"]["endpoint"] for interaction in interactions] == [
+        "accounts/cfd_tunnel/token",
+        "zones/dns_records",
+    ]
+    assert interactions[0]["response"] == {"result": "REDACTED", "error": None}
+    assert interactions[1]["response"] == {
+        "result": None,
+        "error": [81044, "Record does not exist."],
+    }
+    assert api_token not in salt.utils.json.dumps(interactions)
+
+
+def test_request_replays_cassette(cassette_path):
+    cf_tunnel_cassette.Cassette(cassette_path, mode="record").record(
+        "GET", "zones/dns_records", ["zone"], {"type": "CNAME", "page": 1}, None, 0.1, [{"id": 1}]
+    )
+    profile = {"cassette": cassette_path, "cassette_latency": "zero"}
+
+    with patch.object(cf_tunnel_utils, "_get_client") as mock_get_client, patch.object(
+        cf_tunnel_utils, "_rate_limiter"
+    ) as mock_rate_limiter:
+        result = cf_tunnel_utils._request(  # pylint: disable=protected-access
+            "token",
+            "GET",
+            "zones/dns_records",
+            "zone",
+            profile=profile,
+            params={"type": "CNAME", "page": 1},
+        )
+
+    assert result == [{"id": 1}]
+    mock_get_client.assert_not_called()
+    mock_rate_limiter.assert_not_called()
@@ -0,0 +1,118 @@
+import time
+
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_ingress as cf_tunnel_ingress
+
+catch_all = {"service": "http_status:404"}
+
+
+def test_canonical_rule_ignores_spelling():
+    assert cf_tunnel_ingress.canonical_rule(
+        {
+            "hostname": "App.Example.com.",
+            "service": "HTTP://LocalHost:8000/",
+            "originRequest": {"noTLSVerify": True, "connectTimeout": 10},
+        }
+    ) == cf_tunnel_ingress.canonical_rule(
+        {
+            "hostname": "app.example.com",
+            "service": "http://localhost:8000",
+            "originRequest": {"connectTimeout": 10, "noTLSVerify": True},
+        }
+    )
+    assert cf_tunnel_ingress.canonical_rule(catch_all) == ("", "", "http_status:404", None)
+
+
+def test_diff_ingress():
+    current = [
+        {"hostname": "a.example.com", "service": "http://127.0.0.1:8000"},
+        {"hostname": "b.example.com", "service": "http://127.0.0.1:8001"},
+        {"hostname": "c.example.com", "path": "/api", "service": "http://127.0.0.1:8002"},
+        catch_all,
+    ]
+    desired = [
+        {"hostname": "a.example.com", "service": "http://127.0.0.1:8000"},
+        {"hostname": "c.example.com", "path": "/api", "service": "http://127.0.0.1:9002"},
+        {"hostname": "c.example.com", "service": "http://127.0.0.1:8003"},
+        catch_all,
+    ]
+
+    diff = cf_tunnel_ingress.diff_ingress(desired, current)
+
+    assert diff == {
+        "added": [desired[2]],
+        "removed": [current[1]],
+        "modified": [(current[2], desired[1])],
+        "reordered": [],
+        "stale_hostnames": ["b.example.com"],
+    }
+
+
+def test_diff_ingress_no_changes():
+    rules = [
+        {"hostname": "a.example.com", "service": "http://127.0.0.1:8000"},
+        {"hostname": "a.example.com", "path": "/static", "service": "http://127.0.0.1:8001"},
+        catch_all,
+    ]
+
+    diff = cf_tunnel_ingress.diff_ingress([dict(rule) for rule in rules], rules)
+
+    assert not any(diff.values())
+
+
+def test_diff_ingress_reordered():
+    current = [
+        {"hostname": "a.example.com", "service": "http://127.0.0.1:8000"},
+        {"hostname": "b.example.com", "service": "http://127.0.0.1:8001"},
+        catch_all,
+    ]
+    desired = [current[1], current[0], catch_all]
+
+    diff = cf_tunnel_ingress.diff_ingress(desired, current)
+
+    assert diff["reordered"] == [current[1], current[0]]
+    assert not diff["added"] and not diff["removed"] and not diff["modified"]
+
+
+def test_diff_ingress_repeated_hostname_and_path():
+    current = [
+        {"hostname": "a.example.com", "service": "http://127.0.0.1:8000"},
+        catch_all,
+    ]
+    desired = [
+        {"hostname": "a.example.com", "service": "http://127.0.0.1:8000"},
+        {"hostname": "a.example.com", "service": "http://127.0.0.1:8001"},
+        catch_all,
+    ]
+
+    diff = cf_tunnel_ingress.diff_ingress(desired, current)
+
+    assert diff["added"] == [desired[1]]
+    assert not diff["modified"]
+
+
+def test_with_catch_all():
+    rules = [{"hostname": "a.example.com", "service": "http://127.0.0.1:8000"}]
+
+    assert cf_tunnel_ingress.with_catch_all(rules) == rules + [catch_all]
+    assert cf_tunnel_ingress.with_catch_all(rules + [catch_all]) == rules + [catch_all]
+    assert rules == [{"hostname": "a.example.com", "service": "http://127.0.0.1:8000"}]
+
+
+def test_diff_ingress_large_tunnel():
+    current = [
+        {
+            "hostname": f"app{index}.example.com",
+            "service": f"http://127.0.0.1:{8000 + index}",
+            "originRequest": {"connectTimeout": 10},
+        }
+        for index in range(5000)
+    ] + [catch_all]
+    desired = [dict(rule) for rule in current]
+    desired[2500] = dict(desired[2500], service="http://127.0.0.1:1")
+
+    started = time.perf_counter()
+    diff = cf_tunnel_ingress.diff_ingress(desired, current)
+    elapsed = time.perf_counter() - started
+
+    assert diff["modified"] == [(current[2500], desired[2500])]
+    assert elapsed < 1
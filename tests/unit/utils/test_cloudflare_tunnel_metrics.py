@@ -0,0 +1,102 @@
+import os
+from unittest.mock import patch
+
+import pytest
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_metrics as cf_tunnel_metrics
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod as cf_tunnel_utils
+
+
+@pytest.fixture
+def api_metrics():
+    metrics = cf_tunnel_utils.ApiMetrics(buckets=(0.1, 1))
+    with patch.object(cf_tunnel_utils, "_API_METRICS", metrics), patch.dict(
+        cf_tunnel_metrics._EXPORTED_API, clear=True
+    ):
+        yield metrics
+
+
+def test_state_run_phases_and_api_calls(api_metrics):
+    run = cf_tunnel_metrics.StateRun("present", "blog")
+    api_metrics.record("GET", "accounts/cfd_tunnel", 0.05)
+
+    with run.phase("lookup"):
+        api_metrics.record("GET", "zones", 0.05)
+    with run.phase("lookup"):
+        pass
+    run.count("dns_records_changed", 2)
+
+    metrics = run.to_dict()
+
+    assert metrics["api_calls"] == 2
+    assert list(metrics["phases"]) == ["lookup"]
+    assert metrics["counters"] == {"ingress_rules_diffed": 0, "dns_records_changed": 2}
+
+
+def test_render():
+    store = {
+        "api": {
+            "GET zones": {
+                "count": 2,
+                "errors": 0,
+                "retries": 1,
+                "latency_sum": 0.5,
+                "histogram": {"0.1": 1, "1": 2, "+Inf": 2},
+            }
+        },
+        "states": {
+            'present:my"tunnel': {
+                "state": "present",
+                "name": 'my"tunnel',
+                "result": True,
+                "duration": 1.5,
+                "finished": 1700000000.0,
+                "api_calls": 4,
+                "phases": {"lookup": 0.25},
+                "counters": {"ingress_rules_diffed": 3, "dns_records_changed": 1},
+            }
+        },
+    }
+
+    text = cf_tunnel_metrics.render(store)
+
+    assert "# TYPE cloudflare_tunnel_api_request_duration_seconds histogram" in text
+    assert (
+        'cloudflare_tunnel_api_request_duration_seconds_bucket{method="GET",endpoint="zones",'
+        'le="+Inf"} 2' in text
+    )
+    assert 'cloudflare_tunnel_api_request_retries_total{method="GET",endpoint="zones"} 1' in text
+    assert 'cloudflare_tunnel_state_api_calls{state="present",name="my\\"tunnel"} 4' in text
+    assert (
+        'cloudflare_tunnel_state_phase_duration_seconds{state="present",name="my\\"tunnel",'
+        'phase="lookup"} 0.25' in text
+    )
+    assert text.endswith("\n")
+
+
+def test_textfile_exporter_adds_up_processes(api_metrics, tmp_path):
+    path = str(tmp_path / "cloudflare_tunnel.prom")
+    exporter = cf_tunnel_metrics.TextfileExporter(path, str(tmp_path / "cache" / "metrics.json"))
+
+    api_metrics.record("GET", "zones", 0.05)
+    exporter.export(cf_tunnel_metrics.StateRun("present", "blog"))
+    api_metrics.record("GET", "zones", 0.5)
+    exporter.export(cf_tunnel_metrics.StateRun("absent", "old"))
+
+    # A new process starts with empty counters
+    api_metrics.reset()
+    cf_tunnel_metrics._EXPORTED_API.clear()
+    api_metrics.record("GET", "zones", 5)
+    exporter.export(cf_tunnel_metrics.StateRun("present", "blog"))
+
+    with open(path, encoding="utf-8") as prom:
+        text = prom.read()
+
+    assert (
+        'cloudflare_tunnel_api_request_duration_seconds_count{method="GET",endpoint="zones"} 3'
+        in text
+    )
+    assert 'le="0.1"} 1' in text
+    assert 'le="1"} 2' in text
+    assert 'cloudflare_tunnel_state_result{state="absent",name="old"} 0' in text
+    assert text.count("cloudflare_tunnel_state_duration_seconds{") == 2
+    assert oct(os.stat(path).st_mode & 0o777) == "0o644"
@@ -0,0 +1,72 @@
+import pstats
+import threading
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_metrics as cf_tunnel_metrics
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod as cf_tunnel_utils
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_profile as cf_tunnel_profile
+
+
+def test_profiler_labels_api_bound_samples(tmp_path):
+    run = cf_tunnel_metrics.StateRun("present", "blog tunnel")
+    profiler = cf_tunnel_profile.StateProfiler(run, str(tmp_path))
+    sending = threading.Event()
+    release = threading.Event()
+
+    def _get(*args, **kwargs):
+        sending.set()
+        release.wait(5)
+        return []
+
+    mock_client = MagicMock()
+    mock_client.zones.get.side_effect = _get
+
+    with patch.object(
+        cf_tunnel_utils, "_get_client", MagicMock(return_value=mock_client)
+    ), patch.object(cf_tunnel_utils, "_CLIENT_POOL", cf_tunnel_utils.ClientPool()):
+        thread = threading.Thread(target=cf_tunnel_utils.get_zone_id, args=("token", "a.com"))
+        with run.phase("lookup"):
+            thread.start()
+            sending.wait(5)
+            profiler.sample()
+            release.set()
+            thread.join()
+
+    profiler.write()
+
+    assert profiler.phases() == {"lookup": cf_tunnel_profile.API_BOUND}
+    with open(profiler.collapsed_path, encoding="utf-8") as collapsed:
+        stack, count = collapsed.read().strip().rsplit(" ", 1)
+    assert count == "1"
+    assert stack.startswith(
+        "present(blog_tunnel);lookup;api-bound;utils/cloudflare_tunnel_mod.py:get_zone_id;"
+    )
+    assert "utils/cloudflare_tunnel_mod.py:_send" in stack
+
+
+def test_profiler_writes_cprofile_dump(tmp_path):
+    run = cf_tunnel_metrics.StateRun("absent", "blog")
+
+    with cf_tunnel_profile.StateProfiler(run, str(tmp_path / "profiles")) as profiler:
+        with run.phase("diff"):
+            sorted(range(1000), key=str)
+
+    stats = pstats.Stats(profiler.pstats_path)
+    assert any("sorted" in function[2] for function in stats.stats)
+
+
+def test_profiler_phase_labels(tmp_path):
+    profiler = cf_tunnel_profile.StateProfiler(
+        cf_tunnel_metrics.StateRun("present", "blog"), str(tmp_path)
+    )
+    profiler.samples = {
+        "present(blog);dns;api-bound;states/cloudflare_tunnel_mod.py:present": 3,
+        "present(blog);dns;cpu-bound;states/cloudflare_tunnel_mod.py:present": 1,
+        "present(blog);diff;cpu-bound;states/cloudflare_tunnel_mod.py:present": 2,
+    }
+
+    assert profiler.phases() == {
+        "dns": cf_tunnel_profile.API_BOUND,
+        "diff": cf_tunnel_profile.CPU_BOUND,
+    }
@@ -0,0 +1,107 @@
+import concurrent.futures
+import contextvars
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+import CloudFlare
+import pytest
+import salt.utils.json
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_mod as cf_tunnel_utils
+import saltext.cloudflare_tunnel.utils.cloudflare_tunnel_trace as cf_tunnel_trace
+
+
+def test_spans_nest_across_threads():
+    exporter = cf_tunnel_trace.InMemoryExporter()
+
+    with cf_tunnel_trace.trace("cloudflare_tunnel.present", exporter, {"name": "blog"}) as root:
+        with cf_tunnel_trace.span("dns"):
+            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+                for index in range(2):
+                    executor.submit(
+                        contextvars.copy_context().run,
+                        cf_tunnel_trace.add_span,
+                        "POST zones/dns_records",
+                        0.5,
+                        attributes={"index": index},
+                    )
+
+    spans = {span["name"]: span for span in exporter.spans}
+    assert len(exporter.spans) == 4
+    assert {span["trace_id"] for span in exporter.spans} == {root.trace.trace_id}
+    assert spans["cloudflare_tunnel.present"]["parent_span_id"] is None
+    assert spans["cloudflare_tunnel.present"]["attributes"] == {"name": "blog"}
+    assert spans["dns"]["parent_span_id"] == root.span_id
+    leaves = [span for span in exporter.spans if span["name"] == "POST zones/dns_records"]
+    assert {leaf["parent_span_id"] for leaf in leaves} == {spans["dns"]["span_id"]}
+    assert leaves[0]["duration"] == 0.5
+
+
+def test_span_error_status():
+    exporter = cf_tunnel_trace.InMemoryExporter()
+
+    with pytest.raises(ValueError):
+        with cf_tunnel_trace.trace("cloudflare_tunnel.absent", exporter):
+            with cf_tunnel_trace.span("lookup"):
+                raise ValueError("failed")
+
+    assert [span["status"] for span in exporter.spans] == ["error", "error"]
+
+
+def test_no_spans_outside_trace():
+    with cf_tunnel_trace.span("lookup") as span:
+        cf_tunnel_trace.add_span("GET zones", 0.1)
+
+    assert span is None
+
+
+def test_jsonl_file_exporter(tmp_path):
+    path = tmp_path / "traces" / "traces.jsonl"
+    exporter = cf_tunnel_trace.load_exporter("jsonl", str(path))
+
+    for _ in range(2):
+        with cf_tunnel_trace.trace("cloudflare_tunnel.present", exporter):
+            pass
+
+    spans = [salt.utils.json.loads(line) for line in path.read_text().splitlines()]
+    assert [span["name"] for span in spans] == ["cloudflare_tunnel.present"] * 2
+
+
+def test_load_exporter_dotted_path():
+    exporter = cf_tunnel_trace.load_exporter(
+        "saltext.cloudflare_tunnel.utils.cloudflare_tunnel_trace.InMemoryExporter", None
+    )
+
+    assert isinstance(exporter, cf_tunnel_trace.InMemoryExporter)
+
+
+def test_request_span_attributes():
+    mock_client = MagicMock()
+    mock_client.zones.get.side_effect = [
+        CloudFlare.exceptions.CloudFlareAPIError(429, "Too Many Requests"),
+        [{"id": "1234ABC"}],
+    ]
+    mock_client.zones.dns_records.delete.side_effect = CloudFlare.exceptions.CloudFlareAPIError(
+        1003, "Invalid or missing zone id."
+    )
+    exporter = cf_tunnel_trace.InMemoryExporter()
+
+    with patch.object(
+        cf_tunnel_utils, "_get_client", MagicMock(return_value=mock_client)
+    ), patch.object(cf_tunnel_utils, "_CLIENT_POOL", cf_tunnel_utils.ClientPool()), patch(
+        "time.sleep"
+    ):
+        with cf_tunnel_trace.trace("cloudflare_tunnel.present", exporter):
+            cf_tunnel_utils.get_zone_id("token", "example.com")
+            with pytest.raises(salt.exceptions.CommandExecutionError):
+                cf_tunnel_utils.remove_dns("token", "zone-id", "dns-id")
+
+    spans = {span["name"]: span for span in exporter.spans}
+    assert spans["GET zones"]["status"] == "ok"
+    assert spans["GET zones"]["attributes"] == {
+        "method": "GET",
+        "endpoint": "zones",
+        "status_code": 200,
+        "retries": 1,
+    }
+    assert spans["DELETE zones/dns_records"]["status"] == "error"
+    assert spans["DELETE zones/dns_records"]["attributes"]["status_code"] == 1003